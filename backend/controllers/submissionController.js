@@ -4,10 +4,34 @@ import Assignment from "../models/assignmentModel.js";
 import Classroom from "../models/classroomModel.js";
 import { spawn } from "child_process";
 import path from "path";
+import readline from "readline";
 import { uploadImageToCloudinary } from '../utils/cloudinaryUpload.js'
 import { ensureLocalImage } from '../utils/ensureLocalImage.js'
+import { gradeWithWorker } from '../utils/gradingWorker.js'
 import fs from 'fs'
 
+/**
+ * Cập nhật bài nộp với kết quả từ AI (dùng chung cho chấm từng bài và chấm cả lớp).
+ * @param {string} submissionId - ID của bài nộp.
+ * @param {object} aiGradingResult - Kết quả JSON từ Python.
+ */
+const saveAiGradingResult = async (submissionId, aiGradingResult) => {
+  if (aiGradingResult && Object.keys(aiGradingResult).length > 0) {
+    const updatedSubmission = await Submission.findByIdAndUpdate(
+      submissionId,
+      {
+        aiScore: aiGradingResult?.score ?? null,
+        aiFeedback: aiGradingResult?.comment ?? aiGradingResult?.feedback ?? null,
+        aidetail: aiGradingResult?.details ?? [],
+      },
+      { new: true }
+    );
+    console.log(`[AI Background] Đã cập nhật điểm AI cho submission: ${submissionId}`, { score: updatedSubmission.aiScore });
+  } else {
+    console.log(`[AI Background] Không có kết quả từ AI cho submission: ${submissionId}`);
+  }
+};
+
 /**
  * Chạy quy trình chấm điểm AI trong nền.
  * @param {string} submissionId - ID của bài nộp cần chấm.
@@ -26,7 +50,20 @@ const runAiGradingInBackground = async (submissionId, fileUrls, answerKey) => {
     }
 
     // 2. Gọi AI với file local (KHÔNG SỬA AI)
-    const aiGradingResult = await executePythonScript(localImagePaths, answerKey);
+    // AI_GRADING_WORKER=true: dùng worker Python chạy sẵn thay vì spawn mỗi bài
+    // AI_GRADING_STREAM=true: nhận event từng stage, lưu đáp án trắc nghiệm trước khi LLM chấm xong
+    let aiGradingResult;
+    if (process.env.AI_GRADING_WORKER === 'true') {
+      aiGradingResult = await gradeWithWorker(localImagePaths, answerKey);
+    } else if (process.env.AI_GRADING_STREAM === 'true') {
+      aiGradingResult = await executePythonScriptStream(localImagePaths, answerKey, async (event) => {
+        if (event.event === 'stage' && event.stage === 'mcq' && event.data?.answers) {
+          await Submission.findByIdAndUpdate(submissionId, { aidetail: [{ mcq: event.data.answers }] });
+        }
+      });
+    } else {
+      aiGradingResult = await executePythonScript(localImagePaths, answerKey);
+    }
 
     // 3. Xóa file temp sau khi AI chạy xong
     for (const p of localImagePaths) {
@@ -36,21 +73,7 @@ const runAiGradingInBackground = async (submissionId, fileUrls, answerKey) => {
     }
 
 
-    // Cập nhật bài nộp với kết quả từ AI
-    if (aiGradingResult && Object.keys(aiGradingResult).length > 0) {
-      const updatedSubmission = await Submission.findByIdAndUpdate(
-        submissionId,
-        {
-          aiScore: aiGradingResult?.score ?? null,
-          aiFeedback: aiGradingResult?.comment ?? aiGradingResult?.feedback ?? null,
-          aidetail: aiGradingResult?.details ?? [],
-        },
-        { new: true }
-      );
-      console.log(`[AI Background] Đã cập nhật điểm AI cho submission: ${submissionId}`, { score: updatedSubmission.aiScore });
-    } else {
-      console.log(`[AI Background] Không có kết quả từ AI cho submission: ${submissionId}`);
-    }
+    await saveAiGradingResult(submissionId, aiGradingResult);
   } catch (error) {
     console.error(`[AI Background] Lỗi nghiêm trọng khi chấm điểm cho submission ${submissionId}:`, error);
   }
@@ -218,6 +241,74 @@ const executePythonScript = (fileUrls, answerKey) => {
   });
 };
 
+/**
+ * Giống executePythonScript nhưng chạy main_processor.py --stream:
+ * stdout chỉ gồm event JSON-lines (mỗi stage một dòng, cuối cùng là event "result"),
+ * không cần buffer toàn bộ output rồi tìm marker.
+ * @param {string[]} fileUrls - Mảng các đường dẫn tệp.
+ * @param {string} answerKey - Đáp án.
+ * @param {(event: object) => Promise<void>|void} onEvent - Gọi với mỗi event "stage".
+ * @returns {Promise<object>} - Promise giải quyết với kết quả JSON cuối cùng.
+ */
+const executePythonScriptStream = (fileUrls, answerKey, onEvent) => {
+  return new Promise((resolve) => {
+    const PY_TIMEOUT_MS = 600000; // 10 phút
+    const pythonScript = path.join(process.cwd(), "ocr_llm", "main_processor.py");
+    const args = [pythonScript, "--stream", fileUrls.join(","), answerKey || ""];
+
+    const pythonProcess = spawn("python", args, {
+      stdio: ["ignore", "pipe", "pipe"],
+      env: {
+        ...process.env,
+        PYTHONIOENCODING: 'utf-8',
+        PYTHONLEGACYWINDOWSSTDIO: 'utf-8'
+      }
+    });
+
+    let result = {};
+    // Ghi DB của các event phải xong trước khi trả kết quả cuối,
+    // nếu không bản ghi một phần (vd. aidetail chỉ có mcq) có thể ghi đè kết quả cuối
+    const pendingEvents = [];
+
+    const timeout = setTimeout(() => {
+      console.error("Python process timeout, killing...");
+      try { pythonProcess.kill("SIGKILL"); } catch (e) { /* ignore */ }
+    }, PY_TIMEOUT_MS);
+
+    readline.createInterface({ input: pythonProcess.stdout }).on("line", (line) => {
+      let event;
+      try {
+        event = JSON.parse(line);
+      } catch (e) {
+        console.error("Dòng stdout không phải JSON:", line);
+        return;
+      }
+
+      if (event.event === "result") {
+        result = event.result || {};
+        return;
+      }
+      console.log(`[AI stage] ${event.stage}: ${event.ms} ms (t=${event.t_ms} ms)`);
+      pendingEvents.push(
+        Promise.resolve(onEvent?.(event)).catch((err) =>
+          console.error(`Lỗi xử lý event ${event.stage}:`, err)
+        )
+      );
+    });
+
+    pythonProcess.stderr.on("data", (chunk) => {
+      console.error(`[Python stderr] ${chunk.toString()}`);
+    });
+
+    pythonProcess.on("close", async (code) => {
+      clearTimeout(timeout);
+      console.log(`Python process finish with code: ${code}`);
+      await Promise.all(pendingEvents);
+      resolve(result);
+    });
+  });
+};
+
 // PUT /api/submissions/:id (student only)
 const updateSubmission = async (req, res) => {
   try {
@@ -342,4 +433,4 @@ const gradeSubmission = async (req, res) => {
 };
 
 
-export { updateSubmission, submitAssignment, getSubmissionsByAssignment, getMySubmissions, gradeSubmission, runAiGradingInBackground };
+export { updateSubmission, submitAssignment, getSubmissionsByAssignment, getMySubmissions, gradeSubmission, runAiGradingInBackground, saveAiGradingResult };
@@ -7,7 +7,8 @@ import Submission from "../models/submissionModel.js";
 import User from "../models/userModel.js";
 
 import { uploadImageToCloudinary } from "../utils/cloudinaryUpload.js";
-import { runAiGradingInBackground } from "./submissionController.js";
+import { runAiGradingInBackground, saveAiGradingResult } from "./submissionController.js";
+import { gradeClassBatch } from "../utils/batchGrader.js";
 
 
 const normalize = (str) =>
@@ -133,7 +134,14 @@ export const uploadZipController = async (req, res) => {
     });
 
     // 8️⃣ Chạy AI ở background (KHÔNG BLOCK)
-    if (assignment.answerKey) {
+    // AI_GRADING_BATCH=true: chấm cả lớp trong một process Python (pipeline theo stage)
+    if (assignment.answerKey && process.env.AI_GRADING_BATCH === "true") {
+      gradeClassBatch(
+        createdSubmissions.map(item => ({ id: item.submission._id, files: item.files })),
+        assignment.answerKey,
+        (submissionId, result) => saveAiGradingResult(submissionId, result)
+      ).catch(err => console.error("❌ Lỗi AI batch:", err));
+    } else if (assignment.answerKey) {
       for (const item of createdSubmissions) {
         runAiGradingInBackground(
           item.submission._id,
@@ -0,0 +1,247 @@
+"""
+Chấm cả lớp trong một process: các học sinh chảy qua pipeline nhiều stage,
+mỗi stage có pool riêng nên CPU (clean / OCR / YOLO) và mạng (Gemini) chạy chồng lên nhau
+giữa các học sinh, thay vì spawn main_processor.py cho từng bài với max_workers=1.
+
+    prepare (download + clean, pool process)  ->  ocr (pool process PaddleOCR)
+        ->  mcq (1 luồng, YOLO trong process chính)  ->  llm (pool luồng gọi Gemini)
+    (options["ocr_mode"] = "regions": mcq chạy trước ocr để OCR bỏ qua vùng trắc nghiệm)
+
+Manifest JSON (file hoặc "-" để đọc từ stdin):
+  {"rubric": "...", "options": {"profile": "fast"},
+   "students": {"<studentId>": ["url hoặc path", ...], ...}}
+  ("students" cũng có thể là list {"id": "...", "pages": [...]})
+
+stdout là JSON-lines, mỗi học sinh một dòng NGAY KHI chấm xong (không theo thứ tự manifest):
+  {"studentId": "...", "ok": true, "result": {score, comment, feasibility, details, cleanedUrls}}
+dòng cuối: {"studentId": null, "ok": true, "result": {"total", "failed", "seconds"}}
+
+Chạy: python ocr_llm/batch_processor.py manifest.json  (từ thư mục backend)
+Số worker mỗi stage mặc định theo resource plan (CPU / RAM của container, xem resource_planner),
+override: BATCH_CLEAN_WORKERS, BATCH_OCR_WORKERS, BATCH_LLM_WORKERS;
+số học sinh đang nằm trong pipeline cùng lúc (giới hạn RAM): BATCH_MAX_IN_FLIGHT.
+"""
+import sys
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+from stdio_channel import open_protocol_channel
+
+_channel = open_protocol_channel()
+
+from concurrent.futures import ThreadPoolExecutor
+
+from main_processor import (
+    log, parse_urls, build_error_result, resolve_options,
+    download_pages, clean_pages, ocr_pages, mcq_pages, build_llm_context,
+)
+from executor_manager import ExecutorManager, ocr_stage
+from ocr_processor import OCR_BATCHED
+from llm_processor import grade_submission_with_llm
+from gemini_client import LLM_MAX_CONCURRENCY
+from mcq_grader import get_mcq_grader
+from cloudinary_uploader import BackgroundUploader
+from metrics import JobMetrics, attach, timed
+from debug_writer import job_debug_dir
+from ocr_regions import get_ocr_mode
+from resource_planner import configure_resources, get_resource_plan
+
+# Không đặt -> theo resource plan ("batch")
+BATCH_CLEAN_WORKERS = int(os.getenv("BATCH_CLEAN_WORKERS", "0")) or None
+BATCH_OCR_WORKERS = int(os.getenv("BATCH_OCR_WORKERS", "0")) or None
+BATCH_LLM_WORKERS = int(os.getenv("BATCH_LLM_WORKERS", str(LLM_MAX_CONCURRENCY)))
+BATCH_MAX_IN_FLIGHT = int(os.getenv("BATCH_MAX_IN_FLIGHT", "8"))
+
+
+def load_manifest(source):
+    """RETURN: (rubric, options, list (student_id, urls))"""
+    if source == "-":
+        manifest = json.load(io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8"))
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    students = manifest.get("students") or {}
+    if isinstance(students, dict):
+        students = [{"id": sid, "pages": pages} for sid, pages in students.items()]
+    entries = [(str(s["id"]), parse_urls(s.get("pages") or [])) for s in students]
+    return manifest.get("rubric") or "", manifest.get("options") or {}, entries
+
+
+class StudentJob:
+    """Trạng thái của một học sinh khi đi qua các stage"""
+
+    def __init__(self, student_id, urls, debug_dir=None):
+        self.student_id = student_id
+        self.urls = urls
+        self.pages = []
+        self.ocr_results = None
+        self.mcq_results = None
+        self.uploader = None
+        self.result = None
+        self.metrics = JobMetrics()
+        self.debug_dir = debug_dir
+
+
+class BatchPipeline:
+    def __init__(self, rubric, options=None, on_result=None,
+                 clean_workers=BATCH_CLEAN_WORKERS, ocr_workers=BATCH_OCR_WORKERS,
+                 llm_workers=BATCH_LLM_WORKERS, max_in_flight=BATCH_MAX_IN_FLIGHT):
+        self.rubric = rubric
+        self.options, self.profile, self.cache = resolve_options(options)
+        self.ocr_mode = get_ocr_mode(self.options.get("ocr_mode"))
+        # Mỗi học sinh là một task OCR: dòng chữ của mọi trang được nhận dạng chung lô
+        self.ocr_batched = self.options.get("ocr_batched", OCR_BATCHED)
+        self.on_result = on_result or (lambda student_id, ok, result: None)
+
+        # Pool process dùng chung cho cả lớp: model chỉ load một lần mỗi process,
+        # số luồng mỗi process theo plan để các pool không tranh nhau CPU.
+        # Khởi động trước khi load YOLO để process con không fork kèm torch
+        self.executors = ExecutorManager(
+            get_resource_plan(), workers={"clean": clean_workers, "ocr": ocr_workers}
+        )
+        self.clean_executor = self.executors.warm("clean")
+        self.ocr_executor = self.executors.warm(ocr_stage(self.ocr_batched))
+        clean_workers = self.executors.workers("clean")
+        ocr_workers = self.executors.workers(ocr_stage(self.ocr_batched))
+        self.mcq_grader = get_mcq_grader()
+
+        # Mỗi stage một pool luồng điều phối; số luồng = số học sinh xử lý song song ở stage đó
+        ocr_step = ("ocr", ThreadPoolExecutor(ocr_workers, thread_name_prefix="ocr"), self._ocr)
+        # YOLO chạy trong process chính, không thread-safe -> đúng 1 luồng
+        mcq_step = ("mcq", ThreadPoolExecutor(1, thread_name_prefix="mcq"), self._mcq)
+        self.stages = [
+            ("prepare", ThreadPoolExecutor(clean_workers, thread_name_prefix="prepare"), self._prepare),
+            # OCR theo vùng cần bố cục trắc nghiệm -> MCQ chạy trước OCR
+            *((mcq_step, ocr_step) if self.ocr_mode == "regions" else (ocr_step, mcq_step)),
+            ("llm", ThreadPoolExecutor(llm_workers, thread_name_prefix="llm"), self._grade),
+        ]
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Condition()
+        self._pending = 0
+        self.failed = 0
+
+    # ---------- stages ----------
+    def _prepare(self, job):
+        downloaded = download_pages(job.urls)
+        job.pages = clean_pages(downloaded, self.profile, self.cache, executor=self.clean_executor)
+        # Upload ảnh sạch chạy nền trong lúc học sinh này đi tiếp qua OCR/MCQ/LLM
+        job.uploader = BackgroundUploader("processed_batch")
+        for page in job.pages:
+            job.uploader.submit(page)
+
+    def _ocr(self, job):
+        job.ocr_results = ocr_pages(
+            job.pages, self.profile, self.cache, executor=self.ocr_executor,
+            mode=self.ocr_mode, layout_version=self.mcq_grader.cache_version(),
+            batched=self.ocr_batched,
+        )
+
+    def _mcq(self, job):
+        job.mcq_results = mcq_pages(
+            job.pages, self.cache, self.mcq_grader, job.debug_dir,
+            with_layout=self.ocr_mode == "regions",
+        )
+
+    def _grade(self, job):
+        final_context, _ = build_llm_context(job.pages, job.ocr_results, job.mcq_results, self.mcq_grader)
+        grading_result = grade_submission_with_llm(
+            [p.cleaned for p in job.pages], self.rubric, final_context,
+            use_cache=self.options.get("llm_cache", True),
+        )
+        job.result = {**grading_result, "cleanedUrls": job.uploader.collect()}
+
+    # ---------- điều phối ----------
+    @staticmethod
+    def _run_stage(name, fn, job):
+        # Mỗi stage chạy ở luồng khác nhau: gắn lại số liệu của học sinh này trước khi chạy
+        with attach(job.metrics), timed(name):
+            fn(job)
+
+    def _submit(self, job, stage_index):
+        name, executor, fn = self.stages[stage_index]
+        future = executor.submit(self._run_stage, name, fn, job)
+        future.add_done_callback(lambda f: self._advance(job, stage_index, f))
+
+    def _advance(self, job, stage_index, future):
+        error = future.exception()
+        if error is None and stage_index + 1 < len(self.stages):
+            self._submit(job, stage_index + 1)
+            return
+        if error is not None:
+            log(f"Student {job.student_id} failed at stage {self.stages[stage_index][0]}: {error}")
+        self._finish(job, error)
+
+    def _finish(self, job, error):
+        if job.uploader is not None:
+            job.uploader.close()
+        # Giải phóng ảnh trước khi nhận học sinh tiếp theo
+        job.pages = []
+        try:
+            if error is None:
+                self.on_result(job.student_id, True, {**job.result, "timings": job.metrics.summary()})
+            else:
+                self.on_result(job.student_id, False, build_error_result(error))
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._pending -= 1
+                if error is not None:
+                    self.failed += 1
+                self._lock.notify_all()
+
+    def run(self, entries):
+        """entries: list (student_id, urls). Chặn tới khi mọi học sinh đã có kết quả"""
+        for student_id, urls in entries:
+            # Đủ BATCH_MAX_IN_FLIGHT học sinh trong pipeline thì chờ bớt rồi mới nhận tiếp
+            self._slots.acquire()
+            with self._lock:
+                self._pending += 1
+            debug_dir = job_debug_dir(self.options, f"{student_id}-{uuid.uuid4().hex[:8]}")
+            self._submit(StudentJob(student_id, urls, debug_dir), 0)
+
+        with self._lock:
+            while self._pending:
+                self._lock.wait()
+
+    def close(self):
+        for _, executor, _ in self.stages:
+            executor.shutdown(wait=True)
+        self.executors.shutdown()
+
+
+def main():
+    if len(sys.argv) != 2:
+        log("Usage: python batch_processor.py <manifest.json | ->")
+        sys.exit(1)
+
+    rubric, options, entries = load_manifest(sys.argv[1])
+    configure_resources("batch")
+    lock = threading.Lock()
+
+    def emit(student_id, ok, result):
+        with lock:
+            _channel.write(json.dumps(
+                {"studentId": student_id, "ok": ok, "result": result}, ensure_ascii=False
+            ) + "\n")
+            _channel.flush()
+
+    started = time.perf_counter()
+    log(f"🚀 Batch grading {len(entries)} student(s)...")
+    pipeline = BatchPipeline(rubric, options, on_result=emit)
+    try:
+        pipeline.run(entries)
+    finally:
+        pipeline.close()
+
+    seconds = time.perf_counter() - started
+    log(f"🎉 Batch finished in {seconds:.1f}s ({pipeline.failed} failed)")
+    emit(None, True, {"total": len(entries), "failed": pipeline.failed, "seconds": round(seconds, 2)})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+"""
+Benchmark từng stage của pipeline trên ảnh bài thi mẫu (uploads/Bai_thi_Toan_4a2*):
+  clean_image             clean_image_array (bản in-memory pipeline đang dùng)
+  deskew_image            trên ảnh nhị phân của bước làm sạch đầu tiên
+  remove_small_components trên ảnh nhị phân của bước làm sạch đầu tiên
+  extract_text_from_image PaddleOCR trên ảnh sạch
+  extract_text_batched    OCR batched cả bài nộp (detection từng trang, recognition chung lô),
+                          ms/page = thời gian cả bài / số trang
+  mcq_process_image       MCQGrader.process_image trên ảnh gốc
+  mcq_process_image_onnx  như trên với MCQ_BACKEND=onnx (_int8: bản quantize int8), cần export trước:
+                          python ocr_llm/yolo_onnx.py [--int8]
+  end_to_end              main_processor.process_submission, mỗi thư mục học sinh là một bài nộp,
+                          Gemini = FakeBackend (LLM_BACKEND=fake), Cloudinary = stub không gọi mạng
+  import_time             python -X importtime -c "import main_processor": thời gian import, khởi động
+                          và các framework nặng (torch, paddle, ...) bị kéo vào lúc import
+                          (cũng là thứ mỗi process con của pool làm sạch ảnh phải import khi spawn)
+
+Mỗi benchmark chạy trong một process riêng để đo peak RSS độc lập.
+Kết quả: ms/page (mean, p50, p95), thời gian setup (load model), peak RSS (MB), lưu JSON
+để so sánh giữa các commit.
+
+Chạy (từ thư mục backend):
+  python ocr_llm/benchmarks/bench_stages.py
+  python ocr_llm/benchmarks/bench_stages.py --only clean_image,deskew_image --repeat 5
+  python ocr_llm/benchmarks/bench_stages.py --compare ocr_llm/benchmarks/results/stages-abc1234.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import BACKEND_DIR, OCR_LLM_DIR, sample_pages, sample_submissions, write_json
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Framework không được phép load chỉ vì import main_processor
+HEAVY_MODULES = ("torch", "paddle", "paddleocr", "ultralytics", "google.generativeai", "cloudinary")
+
+
+# ---------------- đo lường ----------------
+
+def peak_rss_mb():
+    """Peak RSS của process hiện tại (MB), None nếu nền tảng không hỗ trợ"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux: KB, macOS: bytes
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except Exception:
+        return None
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(per_page_ms, setup_ms, pages, repeat, extra=None):
+    return {
+        "pages": pages,
+        "repeat": repeat,
+        "setup_ms": round(setup_ms, 1),
+        "ms_per_page": round(sum(per_page_ms) / len(per_page_ms), 2) if per_page_ms else None,
+        "p50_ms": round(percentile(per_page_ms, 0.5), 2) if per_page_ms else None,
+        "p95_ms": round(percentile(per_page_ms, 0.95), 2) if per_page_ms else None,
+        **(extra or {}),
+    }
+
+
+def time_each(fn, inputs, repeat):
+    """Gọi fn(x) cho từng input, lặp repeat lần. RETURN: list ms cho mỗi lần gọi"""
+    samples = []
+    for _ in range(repeat):
+        for item in inputs:
+            t0 = time.perf_counter()
+            fn(item)
+            samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+# ---------------- benchmarks (chạy trong process con) ----------------
+
+def _raw_pages(limit):
+    from page_image import load_image
+    return [img for img in (load_image(p["image"]) for p in sample_pages(limit)) if img is not None]
+
+
+def _binarized(raws):
+    """Ảnh nhị phân giống bước đầu của clean_image_array (đầu vào cho deskew / remove_small_components)"""
+    import cv2
+    from img_preprocessing import get_profile
+
+    _, params = get_profile()
+    out = []
+    for img in raws:
+        h, w = img.shape[:2]
+        if max(h, w) > params["max_side"]:
+            scale = params["max_side"] / max(h, w)
+            img = cv2.resize(img, None, fx=scale, fy=scale)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        binary = cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 25, 10
+        )
+        out.append((binary, img))
+    return out
+
+
+def bench_clean_image(limit, repeat):
+    t0 = time.perf_counter()
+    from img_preprocessing import clean_image_array
+    raws = _raw_pages(limit)
+    setup_ms = (time.perf_counter() - t0) * 1000
+    samples = time_each(clean_image_array, raws, repeat)
+    return summarize(samples, setup_ms, len(raws), repeat)
+
+
+def bench_deskew_image(limit, repeat):
+    t0 = time.perf_counter()
+    from img_preprocessing import deskew_image
+    inputs = _binarized(_raw_pages(limit))
+    setup_ms = (time.perf_counter() - t0) * 1000
+    samples = time_each(lambda item: deskew_image(*item), inputs, repeat)
+    return summarize(samples, setup_ms, len(inputs), repeat)
+
+
+def bench_remove_small_components(limit, repeat):
+    t0 = time.perf_counter()
+    from img_preprocessing import remove_small_components
+    inputs = [binary for binary, _ in _binarized(_raw_pages(limit))]
+    setup_ms = (time.perf_counter() - t0) * 1000
+    samples = time_each(lambda binary: remove_small_components(binary, 120), inputs, repeat)
+    return summarize(samples, setup_ms, len(inputs), repeat)
+
+
+def bench_extract_text_from_image(limit, repeat):
+    t0 = time.perf_counter()
+    from img_preprocessing import clean_image_array
+    from ocr_processor import extract_text_from_image, init_ocr_worker
+    cleaned = [c for c in (clean_image_array(img) for img in _raw_pages(limit)) if c is not None]
+    init_ocr_worker(warmup=True)
+    setup_ms = (time.perf_counter() - t0) * 1000
+    samples = time_each(extract_text_from_image, cleaned, repeat)
+    return summarize(samples, setup_ms, len(cleaned), repeat)
+
+
+def bench_extract_text_batched(limit, repeat):
+    t0 = time.perf_counter()
+    from img_preprocessing import clean_image_array
+    from page_image import load_image
+    from ocr_processor import extract_text_batched, init_ocr_worker
+    submissions = [
+        [c for c in (clean_image_array(load_image(path)) for path in paths) if c is not None]
+        for paths in sample_submissions(limit)
+    ]
+    init_ocr_worker(warmup=True, batched=True)
+    setup_ms = (time.perf_counter() - t0) * 1000
+    samples = []
+    for _ in range(repeat):
+        for pages in submissions:
+            t1 = time.perf_counter()
+            extract_text_batched(pages)
+            samples.extend([(time.perf_counter() - t1) * 1000 / len(pages)] * len(pages))
+    return summarize(samples, setup_ms, sum(len(p) for p in submissions), repeat)
+
+
+def bench_mcq_process_image(limit, repeat, backend="torch", int8=False):
+    t0 = time.perf_counter()
+    from mcq_grader import MCQGrader
+    raws = _raw_pages(limit)
+    grader = MCQGrader(backend, int8=int8)
+    if grader.model_abcd is None:
+        raise ImportError(f"YOLO models not found: {grader.paths}")
+    grader.process_image(raws[0])  # warm-up (khởi tạo predictor)
+    setup_ms = (time.perf_counter() - t0) * 1000
+    samples = time_each(grader.process_image, raws, repeat)
+    return summarize(samples, setup_ms, len(raws), repeat)
+
+
+def bench_end_to_end(limit, repeat):
+    # Backend giả cho Gemini, tắt cache để mọi stage đều thực sự chạy
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ.setdefault("LLM_FAKE_LATENCY", "0")
+    os.environ["OCR_CACHE"] = "0"
+    os.environ["LLM_CACHE"] = "0"
+
+    t0 = time.perf_counter()
+    import cloudinary_uploader
+    from main_processor import process_submission
+    from llm_processor import get_llm_client
+
+    # Stub Cloudinary: không gọi mạng, trả URL giả theo nội dung ảnh
+    cloudinary_uploader.upload_cleaned_image = (
+        lambda image, student_name, public_id=None: f"https://stub.invalid/{student_name}/{public_id}.jpg"
+    )
+    submissions = sample_submissions()
+    if limit:
+        # limit tính theo số trang như các benchmark khác
+        kept, total = [], 0
+        for pages in submissions:
+            if total >= limit:
+                break
+            kept.append(pages[:limit - total])
+            total += len(kept[-1])
+        submissions = kept
+    options = {"cache": False, "llm_cache": False}
+
+    # Bài đầu tiên: cold start (load PaddleOCR / YOLO), tính riêng
+    cold = time.perf_counter()
+    result = process_submission(submissions[0], "(benchmark)", options=options)
+    first_ms = (time.perf_counter() - cold) * 1000
+    # Lỗi trước khi tới backend fake (vd. thiếu thư viện) thì không đo đường lỗi
+    if getattr(get_llm_client().backend, "calls", 0) == 0:
+        raise RuntimeError(f"LLM stage never reached the fake backend: {result.get('comment')}")
+    setup_ms = (time.perf_counter() - t0) * 1000
+
+    samples, stages = [], {}
+    for _ in range(repeat):
+        for pages in submissions:
+            started = time.perf_counter()
+            result = process_submission(pages, "(benchmark)", options=options)
+            per_page = (time.perf_counter() - started) * 1000 / len(pages)
+            samples.extend([per_page] * len(pages))
+            for stage, row in result.get("timings", {}).get("stages", {}).items():
+                stages.setdefault(stage, []).append(row["wall_ms"] / len(pages))
+
+    stage_ms = {stage: round(sum(v) / len(v), 2) for stage, v in stages.items()}
+    return summarize(samples, setup_ms, sum(len(p) for p in submissions), repeat, {
+        "submissions": len(submissions),
+        "first_submission_ms": round(first_ms, 1),
+        "stage_ms_per_page": stage_ms,
+    })
+
+
+def parse_importtime(stderr):
+    """Dòng "import time: self [us] | cumulative | package" -> list (package, self_us, cumulative_us)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+            rows.append((name.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return rows
+
+
+def bench_import_time(limit, repeat):
+    code = (
+        "import json, sys, main_processor; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    startup_ms, import_ms, rows, heavy = [], [], [], []
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=OCR_LLM_DIR, capture_output=True, text=True,
+        )
+        startup_ms.append((time.perf_counter() - t0) * 1000)
+        if proc.returncode != 0:
+            last = proc.stderr.strip().splitlines()[-1:] or ["unknown error"]
+            raise ImportError(last[0])
+        rows = parse_importtime(proc.stderr)
+        import_ms.append(next(cum for name, _, cum in rows if name == "main_processor") / 1000)
+        heavy = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    top = sorted(rows, key=lambda r: r[2], reverse=True)[:15]
+    return {
+        "import_ms": round(percentile(import_ms, 0.5), 1),
+        "startup_ms": round(percentile(startup_ms, 0.5), 1),
+        "heavy_modules": heavy,
+        "top_imports_ms": {name: round(cum / 1000, 1) for name, _, cum in top},
+    }
+
+
+BENCHMARKS = {
+    "clean_image": bench_clean_image,
+    "deskew_image": bench_deskew_image,
+    "remove_small_components": bench_remove_small_components,
+    "extract_text_from_image": bench_extract_text_from_image,
+    "extract_text_batched": bench_extract_text_batched,
+    "mcq_process_image": bench_mcq_process_image,
+    "mcq_process_image_onnx": lambda limit, repeat: bench_mcq_process_image(limit, repeat, "onnx"),
+    "mcq_process_image_onnx_int8": lambda limit, repeat: bench_mcq_process_image(limit, repeat, "onnx", True),
+    "end_to_end": bench_end_to_end,
+    "import_time": bench_import_time,
+}
+
+
+def run_child(name, limit, repeat, result_file):
+    """Entry point của process con: chạy một benchmark, ghi kết quả ra result_file"""
+    try:
+        result = BENCHMARKS[name](limit, repeat)
+    except ImportError as e:
+        # Thiếu thư viện (vd. chưa cài paddleocr / ultralytics): ghi nhận và bỏ qua
+        result = {"skipped": f"{type(e).__name__}: {e}"}
+    result["peak_rss_mb"] = peak_rss_mb()
+    write_json(result_file, result)
+
+
+# ---------------- điều phối & so sánh ----------------
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def run_all(names, limit, repeat):
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "limit": limit,
+            "repeat": repeat,
+        },
+        "results": {},
+    }
+    for name in names:
+        print(f"⏱️  {name} ...", flush=True)
+        fd, result_file = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            cmd = [sys.executable, os.path.abspath(__file__), "--child", name,
+                   "--repeat", str(repeat), "--result-file", result_file]
+            if limit:
+                cmd += ["--limit", str(limit)]
+            proc = subprocess.run(cmd, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL)
+            if proc.returncode != 0:
+                report["results"][name] = {"error": f"exit code {proc.returncode}"}
+                continue
+            with open(result_file, encoding="utf-8") as f:
+                report["results"][name] = json.load(f)
+        finally:
+            os.remove(result_file)
+    return report
+
+
+def print_report(report, baseline=None, threshold=0.10):
+    """In bảng kết quả; có baseline thì thêm cột chênh lệch. RETURN: list benchmark bị chậm đi"""
+    def fmt(value, pattern):
+        return pattern.format(value) if value is not None else "-"
+
+    regressions = []
+    old_results = (baseline or {}).get("results", {})
+    header = f"\n{'benchmark':<26}{'pages':>7}{'ms/page':>10}{'p95':>10}{'setup ms':>10}{'RSS MB':>9}"
+    if baseline:
+        header += f"{'base ms':>10}{'delta':>9}"
+    print(header)
+    for name, row in report["results"].items():
+        if "import_ms" in row:
+            heavy = ", ".join(row["heavy_modules"]) or "none"
+            line = f"{name:<26}  import {row['import_ms']:.0f} ms, startup {row['startup_ms']:.0f} ms, heavy: {heavy}"
+            old = old_results.get(name, {}).get("import_ms")
+            if baseline and old:
+                line += f" (base {old:.0f} ms, {row['import_ms'] / old - 1:+.1%})"
+            print(line)
+            continue
+        if "ms_per_page" not in row:
+            print(f"{name:<26}  {row.get('skipped') or row.get('error')}")
+            continue
+        line = (
+            f"{name:<26}{row['pages']:>7}{fmt(row['ms_per_page'], '{:.1f}'):>10}"
+            f"{fmt(row['p95_ms'], '{:.1f}'):>10}{fmt(row['setup_ms'], '{:.0f}'):>10}"
+            f"{fmt(row['peak_rss_mb'], '{:.0f}'):>9}"
+        )
+        old = old_results.get(name, {}).get("ms_per_page")
+        if baseline and old and row["ms_per_page"] is not None:
+            delta = row["ms_per_page"] / old - 1
+            line += f"{old:>10.1f}{delta:>+9.1%}"
+            if delta > threshold:
+                regressions.append(name)
+                line += "  ⚠️"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="Danh sách benchmark, cách nhau bởi dấu phẩy (mặc định: tất cả)")
+    parser.add_argument("--limit", type=int, help="Chỉ lấy N trang mẫu đầu")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần lặp lại bộ ảnh")
+    parser.add_argument("--out", help="File JSON kết quả (mặc định: benchmarks/results/stages-<commit>.json)")
+    parser.add_argument("--compare", help="File JSON kết quả cũ để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Chậm hơn baseline quá tỉ lệ này -> exit 1")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.limit, args.repeat, args.result_file)
+        return
+
+    names = [n.strip() for n in args.only.split(",")] if args.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+    report = run_all(names, args.limit, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = print_report(report, baseline, args.threshold)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"stages-{report['meta']['commit']}.json")
+    write_json(out, report)
+    print(f"\n💾 Results written to {out}")
+    if regressions:
+        print(f"⚠️ Slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
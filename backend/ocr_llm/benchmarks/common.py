@@ -0,0 +1,67 @@
+"""
+Tiện ích dùng chung cho các script benchmark (chạy từ thư mục backend).
+"""
+import glob
+import hashlib
+import json
+import os
+import sys
+
+OCR_LLM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.dirname(OCR_LLM_DIR)
+
+# Cho phép import các module của ocr_llm giống như main_processor
+if OCR_LLM_DIR not in sys.path:
+    sys.path.insert(0, OCR_LLM_DIR)
+
+SAMPLE_GLOB = os.path.join(BACKEND_DIR, "uploads", "Bai_thi_Toan_4a2*", "**", "*.jpg")
+
+
+def sample_pages(limit=None):
+    """
+    Ảnh bài thi mẫu đi kèm repo (bỏ ảnh *_debug.jpg và các bản sao trùng nội dung).
+    RETURN: list [{"image": path, "mcq": None}]
+    """
+    pages, seen = [], set()
+    for path in sorted(glob.glob(SAMPLE_GLOB, recursive=True)):
+        if path.endswith("_debug.jpg"):
+            continue
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        pages.append({"image": path, "mcq": None})
+    return pages[:limit] if limit else pages
+
+
+def sample_submissions(limit=None):
+    """Gom ảnh mẫu theo thư mục học sinh -> mỗi thư mục là một bài nộp. RETURN: list [list path]"""
+    groups = {}
+    for page in sample_pages():
+        groups.setdefault(os.path.dirname(page["image"]), []).append(page["image"])
+    submissions = [groups[d] for d in sorted(groups)]
+    return submissions[:limit] if limit else submissions
+
+
+def load_manifest(path):
+    """
+    Bộ ảnh có nhãn: {"pages": [{"image": "...", "mcq": {"1": "A", "2": "C"}}]}
+    Đường dẫn ảnh tương đối được tính từ thư mục chứa manifest.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    pages = []
+    for item in data.get("pages", []):
+        image = item["image"]
+        if not os.path.isabs(image):
+            image = os.path.join(base, image)
+        pages.append({"image": image, "mcq": item.get("mcq")})
+    return pages
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,46 @@
+"""
+Kiểm tra LLM_BACKEND=fake chạy được offline: grade_submission_with_llm với FakeBackend
+phải trả đúng JSON của backend fake khi KHÔNG có SDK Gemini (package google bị chặn import),
+lỗi / trả kết quả khác -> exit 1.
+
+  python ocr_llm/benchmarks/llm_fake_offline.py
+
+Chạy từ thư mục backend.
+"""
+import json
+import os
+import sys
+
+# Chặn SDK Gemini trước mọi import khác: import google.* -> ImportError như máy chưa cài
+sys.modules["google"] = None
+os.environ["LLM_BACKEND"] = "fake"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import sample_pages
+
+from gemini_client import FakeBackend
+from llm_processor import grade_submission_with_llm, set_llm_backend
+from page_image import load_image
+
+
+def main():
+    pages = sample_pages(limit=1)
+    if not pages:
+        print("❌ No sample pages found")
+        sys.exit(1)
+
+    expected = {"score": 7, "comment": "offline", "feasibility": True, "details": {}}
+    backend = FakeBackend(latency=0, failure_rate=0, response=json.dumps(expected))
+    set_llm_backend(backend)
+
+    result = grade_submission_with_llm(
+        [load_image(pages[0]["image"])], "(offline check)", "(no OCR text)", use_cache=False
+    )
+    if result != expected or backend.calls != 1:
+        print(f"❌ Fake backend result: {result} (calls: {backend.calls})")
+        sys.exit(1)
+    print("✅ grade_submission_with_llm runs with FakeBackend and no google package")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Golden check cho MCQGrader: đáp án trắc nghiệm trên bộ ảnh mẫu phải giữ nguyên
+sau khi sửa logic ghép circle / option và gom hàng.
+
+  python ocr_llm/benchmarks/mcq_golden.py --record   # ghi golden từ code hiện tại (trước khi sửa)
+  python ocr_llm/benchmarks/mcq_golden.py            # so với golden, lệch -> exit 1
+
+Cần trọng số YOLO (models/*.pt) và process_images (có từ khi chấm theo lô), nên không chạy
+được trên commit gốc. Chạy từ thư mục backend; golden mặc định: benchmarks/golden/mcq_answers.json
+So logic chấm với vòng lặp ban đầu, không cần trọng số: mcq_grade_parity.py
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import sample_pages, load_manifest, write_json, BACKEND_DIR
+
+from page_image import load_image
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "mcq_answers.json")
+
+
+def grade_pages(pages):
+    """RETURN: {đường dẫn tương đối: kết quả process_image}"""
+    from mcq_grader import MCQGrader
+
+    grader = MCQGrader()
+    results = grader.process_images([load_image(p["image"]) for p in pages])
+    return {
+        os.path.relpath(p["image"], BACKEND_DIR).replace(os.sep, "/"): res
+        for p, res in zip(pages, results)
+    }
+
+
+def diff(golden, current):
+    """RETURN: list dòng mô tả chỗ lệch"""
+    problems = []
+    for page in sorted(set(golden) | set(current)):
+        if page not in current:
+            problems.append(f"{page}: missing")
+            continue
+        if page not in golden:
+            problems.append(f"{page}: not in golden")
+            continue
+        for q in sorted(set(golden[page]) | set(current[page]), key=lambda q: int(q) if q.isdigit() else q):
+            old, new = golden[page].get(q), current[page].get(q)
+            if old != new:
+                problems.append(f"{page} #{q}: {old} -> {new}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", help="Bộ ảnh khác (JSON {\"pages\": [{\"image\": ...}]})")
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    parser.add_argument("--record", action="store_true", help="Ghi golden thay vì so sánh")
+    args = parser.parse_args()
+
+    pages = load_manifest(args.manifest) if args.manifest else sample_pages()
+    current = grade_pages(pages)
+
+    if args.record:
+        write_json(args.golden, current)
+        print(f"✅ Golden written: {args.golden} ({len(current)} pages)")
+        return
+
+    with open(args.golden, encoding="utf-8") as f:
+        golden = json.load(f)
+    problems = diff(golden, current)
+    for line in problems:
+        print(f"❌ {line}")
+    if problems:
+        sys.exit(1)
+    print(f"✅ MCQ answers match golden ({len(current)} pages)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Parity check cho MCQGrader._parse_detections + _grade_page (ghép circle / option bằng ma trận
+intersection_areas, gom hàng bằng cluster_rows) với vòng lặp ban đầu, KHÔNG cần trọng số YOLO:
+sinh ngẫu nhiên các bộ detection (lưới câu hỏi có nhiễu, thiếu / thừa box, box rải ngẫu nhiên),
+đáp án của 2 bản phải giống hệt nhau, lệch -> exit 1.
+
+  python ocr_llm/benchmarks/mcq_grade_parity.py
+  python ocr_llm/benchmarks/mcq_grade_parity.py --sets 10000 --seed 7
+
+Chạy từ thư mục backend. Có trọng số YOLO thì so trên ảnh thật bằng mcq_golden.py.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: F401  (thêm ocr_llm vào sys.path)
+
+import numpy as np
+
+from mcq_grader import MAP_ABCD, MAP_STRUCT, MCQGrader
+from yolo_onnx import OnnxResult
+
+PAGE_W, PAGE_H = 1600, 2200
+
+
+# ---------------- bản gốc (trước khi vector hoá) ----------------
+
+def center(b):
+    return ((b[0]+b[2])//2, (b[1]+b[3])//2)
+
+
+def iou_area(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    if x2 < x1 or y2 < y1: return 0
+    return (x2-x1)*(y2-y1)
+
+
+def grade_page_loop(res_abcd, res_struct):
+    """MCQGrader._grade_page ban đầu (bỏ phần ảnh debug)"""
+    options, circles, questions = [], [], []
+    mcq_start_y = None
+
+    for x1, y1, x2, y2, score, cls in res_abcd.boxes.data.tolist():
+        cls = int(cls)
+        b = [int(x1),int(y1),int(x2),int(y2)]
+
+        if MAP_ABCD.get(cls) == 'objects':
+            y_obj = center(b)[1]
+            if mcq_start_y is None or y_obj > mcq_start_y:
+                mcq_start_y = y_obj
+            continue
+
+        if cls in [0,1,2,3]:
+            options.append({
+                'bbox':b,'center':center(b),
+                'label':MAP_ABCD[cls],
+                'selected':False,'source':'real'
+            })
+
+    for x1, y1, x2, y2, score, cls in res_struct.boxes.data.tolist():
+        b=[int(x1),int(y1),int(x2),int(y2)]
+        if MAP_STRUCT[int(cls)]=='circle':
+            circles.append({'bbox':b,'center':center(b),'mapped':False})
+        else:
+            questions.append({'bbox':b,'center':center(b)})
+
+    if mcq_start_y is None:
+        if circles:
+            mcq_start_y = min(c['center'][1] for c in circles)
+        elif questions:
+            mcq_start_y = min(q['center'][1] for q in questions)
+        else:
+            mcq_start_y = 0
+
+    circles = [c for c in circles if c['center'][1] >= mcq_start_y]
+
+    for c in circles:
+        best_opt, best_area = None, 0
+        for o in options:
+            area = iou_area(c["bbox"], o["bbox"])
+            if area > best_area:
+                best_area = area
+                best_opt = o
+
+        if best_opt and best_area > 0.1 * (
+            (best_opt["bbox"][2] - best_opt["bbox"][0]) *
+            (best_opt["bbox"][3] - best_opt["bbox"][1])
+        ):
+            best_opt["selected"] = True
+            c["mapped"] = True
+
+    circles.sort(key=lambda c: c["center"][1])
+    avg_h = np.mean(
+        [c["bbox"][3] - c["bbox"][1] for c in circles]
+    ) if circles else 80
+
+    ROW_TH = avg_h * 1.4
+    rows = []
+
+    for c in circles:
+        placed = False
+        for r in rows:
+            if abs(r[0]["center"][1] - c["center"][1]) < ROW_TH:
+                r.append(c)
+                placed = True
+                break
+        if not placed:
+            rows.append([c])
+
+    results = {}
+    for q_idx, row in enumerate(rows, start=1):
+
+        row_opts = []
+        for c in row:
+            for o in options:
+                if o["selected"] and iou_area(o["bbox"], c["bbox"]) > 0:
+                    row_opts.append(o)
+
+        row_opts.sort(key=lambda o: o["center"][0])
+        detected_labels = [o["label"] for o in row_opts]
+
+        FULL = ["A", "B", "C", "D"]
+        if len(detected_labels) < 4:
+            xs = sorted([c["center"][0] for c in row])
+            for i in range(len(detected_labels), min(len(xs), 4)):
+                row_opts.append({
+                    "label": FULL[i],
+                    "selected": True,
+                    "source": "virtual"
+                })
+
+        answers = [o["label"] for o in row_opts if o["selected"]]
+
+        if not answers:
+            final, status = None, "blank"
+        elif len(answers) == 1:
+            final, status = answers[0], "ok"
+        else:
+            final, status = answers, "multiple"
+
+        results[str(q_idx)] = {
+            "answer": final,
+            "status": status
+        }
+    return results
+
+
+# ---------------- sinh detection ngẫu nhiên ----------------
+
+def box(cx, cy, w, h):
+    return [cx - w // 2, cy - h // 2, cx + w // 2, cy + h // 2]
+
+
+def random_page(rng):
+    """RETURN: (box ABCD, box structure) dạng [x1, y1, x2, y2, conf, cls]"""
+    abcd, struct = [], []
+    top = rng.randint(0, PAGE_H // 2)
+    size = rng.randint(24, 60)
+    row_gap = int(size * rng.uniform(1.1, 2.5))     # có lúc sát ngưỡng gom hàng (1.4 * cao)
+    col_gap = int(size * rng.uniform(1.0, 3.0))
+    left = rng.randint(0, 200)
+
+    for r in range(rng.randint(0, 25)):
+        y = top + r * row_gap + rng.randint(-size // 3, size // 3)
+        for col in range(4):
+            x = left + col * col_gap + rng.randint(-size // 4, size // 4)
+            h = size + rng.randint(-8, 8)
+            if rng.random() < 0.9:
+                struct.append(box(x, y, size + rng.randint(-8, 8), h) + [rng.random(), 1])
+            if rng.random() < 0.6:
+                # option lệch ít / nhiều so với circle, đôi khi sai nhãn
+                dx, dy = rng.randint(-size, size), rng.randint(-size // 2, size // 2)
+                label = col if rng.random() < 0.85 else rng.randint(0, 3)
+                abcd.append(box(x + dx, y + dy, rng.randint(10, size * 2), rng.randint(10, size * 2))
+                            + [rng.random(), label])
+        if rng.random() < 0.5:
+            struct.append(box(left - size * 2, y, size * 2, size) + [rng.random(), 0])
+
+    # Box rải ngẫu nhiên (cả 'objects' và 'cau_hoi'), có box suy biến (rộng / cao 0)
+    for _ in range(rng.randint(0, 6)):
+        x, y = rng.randint(0, PAGE_W), rng.randint(0, PAGE_H)
+        abcd.append(box(x, y, rng.randint(0, 120), rng.randint(0, 120)) + [rng.random(), rng.randint(0, 4)])
+    for _ in range(rng.randint(0, 4)):
+        x, y = rng.randint(0, PAGE_W), rng.randint(0, PAGE_H)
+        struct.append(box(x, y, rng.randint(0, 120), rng.randint(0, 120)) + [rng.random(), rng.randint(0, 1)])
+
+    rng.shuffle(abcd)
+    rng.shuffle(struct)
+    return (
+        OnnxResult(np.asarray(abcd, dtype=np.float32).reshape(-1, 6)),
+        OnnxResult(np.asarray(struct, dtype=np.float32).reshape(-1, 6)),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sets", type=int, default=3000, help="Số bộ detection ngẫu nhiên")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # Chỉ dùng phần chấm trên detection, không load model
+    grader = MCQGrader.__new__(MCQGrader)
+
+    problems, answers, old_s, new_s = [], 0, 0.0, 0.0
+    for n in range(args.sets):
+        res_abcd, res_struct = random_page(rng)
+        t0 = time.perf_counter()
+        old = grade_page_loop(res_abcd, res_struct)
+        t1 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):     # bỏ log fallback của _parse_detections
+            new = grader._grade_page(None, *grader._parse_detections(res_abcd, res_struct))
+        t2 = time.perf_counter()
+        old_s, new_s = old_s + t1 - t0, new_s + t2 - t1
+        answers += len(old)
+        if new != old:
+            diff = [q for q in sorted(set(old) | set(new), key=int) if old.get(q) != new.get(q)]
+            problems.append(f"set {n}: {len(diff)} question(s) differ, first #{diff[0]}: "
+                            f"{old.get(diff[0])} -> {new.get(diff[0])}")
+
+    for line in problems[:20]:
+        print(f"❌ {line}")
+    print(f"⏱️ loop {old_s * 1000 / args.sets:.2f} ms/set, vectorized {new_s * 1000 / args.sets:.2f} ms/set")
+    if problems:
+        print(f"❌ {len(problems)}/{args.sets} set(s) differ")
+        sys.exit(1)
+    print(f"✅ _grade_page matches the original loop ({args.sets} sets, {answers} answers)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+So backend ONNX Runtime với backend torch (ultralytics) của MCQGrader trên bộ ảnh mẫu:
+  - đáp án trắc nghiệm từng câu phải giống nhau (lệch -> exit 1)
+  - box detect của 2 model: số box, số box ghép được (cùng class, IoU >= --iou), lệch toạ độ lớn nhất
+  - độ trễ process_image (ms/page, p50, p95) của từng backend
+
+  python ocr_llm/benchmarks/mcq_onnx_parity.py            # torch vs onnx fp32
+  python ocr_llm/benchmarks/mcq_onnx_parity.py --int8     # torch vs onnx int8 (cho phép lệch: --allow-diff)
+
+Chạy từ thư mục backend, sau khi export: python ocr_llm/yolo_onnx.py [--int8]
+RSS của từng backend đo riêng process: bench_stages.py --only mcq_process_image,mcq_process_image_onnx
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import sample_pages, load_manifest, write_json, BACKEND_DIR
+from mcq_golden import diff
+
+from page_image import load_image
+
+
+def detections(grader, images):
+    """RETURN: list (box ABCD, box structure) theo trang, ndarray (N, 6)"""
+    from mcq_grader import CONF_ABCD, CONF_STRUCT
+
+    out = []
+    for img in images:
+        res_abcd = grader._predict_batch(grader.model_abcd, [img], CONF_ABCD)[0]
+        res_struct = grader._predict_batch(grader.model_struct, [img], CONF_STRUCT)[0]
+        out.append(tuple(np.asarray(r.boxes.data.tolist(), dtype=np.float64).reshape(-1, 6)
+                         for r in (res_abcd, res_struct)))
+    return out
+
+
+def match_boxes(ref, new, iou_thres):
+    """Ghép box cùng class theo IoU lớn nhất. RETURN: (số box ghép được, lệch toạ độ lớn nhất px)"""
+    from mcq_grader import intersection_areas
+
+    if len(ref) == 0 or len(new) == 0:
+        return 0, 0.0
+    inter = intersection_areas(ref[:, :4].astype(np.int64), new[:, :4].astype(np.int64))
+    area_ref = (ref[:, 2] - ref[:, 0]) * (ref[:, 3] - ref[:, 1])
+    area_new = (new[:, 2] - new[:, 0]) * (new[:, 3] - new[:, 1])
+    iou = inter / (area_ref[:, None] + area_new[None, :] - inter + 1e-9)
+    iou[ref[:, 5][:, None] != new[:, 5][None, :]] = 0
+    best = iou.argmax(1)
+    matched = iou[np.arange(len(ref)), best] >= iou_thres
+    if not matched.any():
+        return 0, 0.0
+    shift = np.abs(ref[matched, :4] - new[best[matched], :4]).max()
+    return int(matched.sum()), float(shift)
+
+
+def latency(grader, images, repeat):
+    """ms/page của process_image (đã warm-up)"""
+    grader.process_image(images[0])
+    samples = []
+    for _ in range(repeat):
+        for img in images:
+            t0 = time.perf_counter()
+            grader.process_image(img)
+            samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        "ms_per_page": round(sum(samples) / len(samples), 2),
+        "p50_ms": round(samples[len(samples) // 2], 2),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", help="Bộ ảnh khác (JSON {\"pages\": [{\"image\": ...}]})")
+    parser.add_argument("--int8", action="store_true", help="So với bản ONNX int8")
+    parser.add_argument("--iou", type=float, default=0.9, help="IoU tối thiểu để coi 2 box là một")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--allow-diff", type=int, default=0, help="Số câu được phép lệch đáp án")
+    parser.add_argument("--out", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    from mcq_grader import MCQGrader
+
+    pages = load_manifest(args.manifest) if args.manifest else sample_pages()
+    paths = [p["image"] for p in pages]
+    images = [load_image(p) for p in paths]
+    graders = {"torch": MCQGrader("torch"), "onnx": MCQGrader("onnx", int8=args.int8)}
+    for name, grader in graders.items():
+        if grader.model_abcd is None:
+            print(f"❌ {name} models not found: {grader.paths}")
+            sys.exit(1)
+
+    # ---- đáp án ----
+    answers = {
+        name: {
+            os.path.relpath(p, BACKEND_DIR).replace(os.sep, "/"): res
+            for p, res in zip(paths, grader.process_images(images))
+        }
+        for name, grader in graders.items()
+    }
+    problems = diff(answers["torch"], answers["onnx"])
+    for line in problems:
+        print(f"❌ {line}")
+
+    # ---- box ----
+    boxes = {name: detections(grader, images) for name, grader in graders.items()}
+    box_report = {}
+    for i, model in enumerate(("abcd", "struct")):
+        ref_total = sum(len(page[i]) for page in boxes["torch"])
+        new_total = sum(len(page[i]) for page in boxes["onnx"])
+        matched, shift = 0, 0.0
+        for ref_page, new_page in zip(boxes["torch"], boxes["onnx"]):
+            m, s = match_boxes(ref_page[i], new_page[i], args.iou)
+            matched, shift = matched + m, max(shift, s)
+        box_report[model] = {"torch": ref_total, "onnx": new_total, "matched": matched, "max_shift_px": round(shift, 2)}
+        print(f"📦 {model}: torch {ref_total} box, onnx {new_total} box, "
+              f"{matched} matched (IoU >= {args.iou}), max shift {shift:.2f}px")
+
+    # ---- độ trễ ----
+    timings = {name: latency(grader, images, args.repeat) for name, grader in graders.items()}
+    print(f"\n{'backend':<12}{'ms/page':>10}{'p50':>10}{'p95':>10}")
+    for name, row in timings.items():
+        print(f"{name:<12}{row['ms_per_page']:>10.1f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}")
+
+    if args.out:
+        write_json(args.out, {
+            "int8": args.int8, "pages": len(paths), "answer_diffs": problems,
+            "boxes": box_report, "latency": timings,
+        })
+    if len(problems) > args.allow_diff:
+        sys.exit(1)
+    print(f"\n✅ ONNX answers match torch ({len(paths)} pages, {len(problems)} diff(s))")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+So sánh các profile làm sạch ảnh (img_preprocessing.PREPROCESS_PROFILES) trên một bộ ảnh:
+  - ms/page của clean_image_array
+  - độ tin cậy trung bình của PaddleOCR trên ảnh sạch
+
+Không đo trắc nghiệm: pipeline luôn chấm MCQ trên ảnh RAW (mcq_pages dùng p.raw), profile
+làm sạch không ảnh hưởng tới đáp án trắc nghiệm. Độ chính xác MCQ: mcq_golden.py.
+
+Chạy (từ thư mục backend):
+  python ocr_llm/benchmarks/preprocess_profiles.py
+  python ocr_llm/benchmarks/preprocess_profiles.py --manifest pages.json --out results/profiles.json
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import sample_pages, load_manifest, write_json
+
+from img_preprocessing import PREPROCESS_PROFILES, clean_image_array
+from page_image import load_image
+
+
+def mean_ocr_confidence(structure):
+    scores = [item["score"] for item in structure or [] if isinstance(item, dict)]
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+def run(pages, profiles, with_ocr=True):
+    extract_text_from_image = None
+    if with_ocr:
+        from ocr_processor import extract_text_from_image
+
+    raws = [load_image(p["image"]) for p in pages]
+
+    report = {}
+    for name in profiles:
+        clean_ms, confidences = [], []
+        for raw in raws:
+            t0 = time.perf_counter()
+            cleaned = clean_image_array(raw, name)
+            clean_ms.append((time.perf_counter() - t0) * 1000)
+            if cleaned is None:
+                continue
+
+            if extract_text_from_image is not None:
+                confidences.append(mean_ocr_confidence(extract_text_from_image(cleaned)))
+
+        report[name] = {
+            "pages": len(clean_ms),
+            "clean_ms_per_page": sum(clean_ms) / len(clean_ms) if clean_ms else None,
+            "ocr_mean_confidence": sum(confidences) / len(confidences) if confidences else None,
+        }
+    return report
+
+
+def print_report(report):
+    def fmt(value, pattern):
+        return pattern.format(value) if value is not None else "-"
+
+    print(f"\n{'profile':<14}{'pages':>7}{'ms/page':>12}{'ocr conf':>12}")
+    for name, row in report.items():
+        print(
+            f"{name:<14}{row['pages']:>7}"
+            f"{fmt(row['clean_ms_per_page'], '{:.0f}'):>12}"
+            f"{fmt(row['ocr_mean_confidence'], '{:.4f}'):>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", help="JSON bộ ảnh (mặc định: ảnh mẫu trong uploads/)")
+    parser.add_argument("--profiles", default=",".join(PREPROCESS_PROFILES), help="Danh sách profile, cách nhau bởi dấu phẩy")
+    parser.add_argument("--limit", type=int, help="Chỉ lấy N ảnh đầu")
+    parser.add_argument("--no-ocr", action="store_true", help="Bỏ qua đo độ tin cậy OCR")
+    parser.add_argument("--out", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    pages = load_manifest(args.manifest) if args.manifest else sample_pages()
+    if args.limit:
+        pages = pages[:args.limit]
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+
+    report = run(pages, profiles, with_ocr=not args.no_ocr)
+    print_report(report)
+    if args.out:
+        write_json(args.out, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Parity check cho img_preprocessing.remove_small_components (bảng tra theo nhãn) với
+vòng lặp từng thành phần ban đầu: trên mọi trang mẫu uploads/Bai_thi_Toan_4a2*,
+ảnh nhị phân mà clean_image_array thật sự đưa vào hàm (cả 2 lần, đúng min_size)
+phải cho kết quả giống hệt từng bit (cùng giá trị, cùng dtype), lệch -> exit 1.
+
+  python ocr_llm/benchmarks/remove_components_parity.py
+  python ocr_llm/benchmarks/remove_components_parity.py --profiles fast
+
+Chạy từ thư mục backend.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import sample_pages, load_manifest, BACKEND_DIR
+
+import cv2
+import numpy as np
+
+import img_preprocessing
+from img_preprocessing import PREPROCESS_PROFILES, clean_image_array, remove_small_components
+from page_image import load_image
+
+
+def remove_small_components_loop(binary_img, min_size=80):
+    """Bản gốc (trước khi dùng bảng tra): so sánh toàn ảnh cho từng thành phần"""
+    nb_components, output, stats, _ = cv2.connectedComponentsWithStats(
+        binary_img, connectivity=8
+    )
+    sizes = stats[1:, cv2.CC_STAT_AREA]
+    nb_components -= 1
+    img_clean = np.zeros(output.shape, dtype=np.uint8)
+    for i in range(nb_components):
+        if sizes[i] >= min_size:
+            img_clean[output == i + 1] = 255
+    return img_clean
+
+
+def pipeline_inputs(img, profile):
+    """RETURN: list (ảnh nhị phân, min_size) mà clean_image_array gọi remove_small_components"""
+    calls = []
+
+    def record(binary_img, min_size=80):
+        calls.append((binary_img.copy(), min_size))
+        return remove_small_components(binary_img, min_size)
+
+    img_preprocessing.remove_small_components = record
+    try:
+        clean_image_array(img, profile)
+    finally:
+        img_preprocessing.remove_small_components = remove_small_components
+    return calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", help="Bộ ảnh khác (JSON {\"pages\": [{\"image\": ...}]})")
+    parser.add_argument("--profiles", default=",".join(PREPROCESS_PROFILES), help="Danh sách profile, cách nhau bởi dấu phẩy")
+    args = parser.parse_args()
+
+    pages = load_manifest(args.manifest) if args.manifest else sample_pages()
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    if not pages:
+        print("❌ No sample pages found")
+        sys.exit(1)
+
+    problems, checked, lut_ms, loop_ms = [], 0, 0.0, 0.0
+    for page in pages:
+        name = os.path.relpath(page["image"], BACKEND_DIR).replace(os.sep, "/")
+        img = load_image(page["image"])
+        if img is None:
+            problems.append(f"{name}: cannot decode image")
+            continue
+        for profile in profiles:
+            for step, (binary, min_size) in enumerate(pipeline_inputs(img, profile), 1):
+                t0 = time.perf_counter()
+                new = remove_small_components(binary, min_size)
+                t1 = time.perf_counter()
+                old = remove_small_components_loop(binary, min_size)
+                t2 = time.perf_counter()
+                lut_ms, loop_ms = lut_ms + (t1 - t0) * 1000, loop_ms + (t2 - t1) * 1000
+                checked += 1
+                if new.dtype != old.dtype or new.shape != old.shape:
+                    problems.append(f"{name} [{profile} #{step}]: {old.dtype}{old.shape} -> {new.dtype}{new.shape}")
+                elif not np.array_equal(new, old):
+                    problems.append(f"{name} [{profile} #{step}]: {np.count_nonzero(new != old)} px differ")
+
+    for line in problems:
+        print(f"❌ {line}")
+    if checked:
+        print(f"⏱️ lut {lut_ms / checked:.1f} ms/call, loop {loop_ms / checked:.1f} ms/call")
+    if problems or not checked:
+        sys.exit(1)
+    print(f"✅ remove_small_components matches the per-component loop "
+          f"({len(pages)} pages x {len(profiles)} profiles, {checked} calls)")
+
+
+if __name__ == "__main__":
+    main()
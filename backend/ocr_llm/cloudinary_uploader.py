@@ -1,20 +1,125 @@
-import cloudinary
-import cloudinary.uploader
+import hashlib
+import io
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-)
+from metrics import bind, record_bytes, timed
 
-def upload_cleaned_image(local_path: str, student_name: str):
+_cloudinary = None
+
+
+def get_cloudinary():
+    """Import + cấu hình SDK Cloudinary ở lần upload đầu tiên (không tốn thời gian khởi động)"""
+    global _cloudinary
+    if _cloudinary is None:
+        import cloudinary
+        import cloudinary.uploader
+        import cloudinary.utils
+
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+            api_key=os.getenv("CLOUDINARY_API_KEY"),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+        )
+        _cloudinary = cloudinary
+    return _cloudinary
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+
+# public_id -> secure_url của các ảnh đã upload trong process này (worker mode)
+_uploaded = {}
+
+
+def content_public_id(data: bytes) -> str:
+    """public_id theo nội dung: cùng một ảnh sạch luôn ra cùng một id"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def _find_existing(folder: str, public_id: str):
+    """
+    Kiểm tra ảnh đã có trên Cloudinary chưa bằng HEAD tới URL phân phối
+    (không tốn quota Admin API). RETURN: secure_url hoặc None
+    """
+    from downloader import get_session
+
+    full_id = f"{folder}/{public_id}"
+    if full_id in _uploaded:
+        return _uploaded[full_id]
+
+    url = get_cloudinary().utils.cloudinary_url(full_id, format="jpg", secure=True)[0]
+    try:
+        r = get_session().head(url, timeout=10)
+        if r.status_code == 200:
+            _uploaded[full_id] = url
+            return url
+    except Exception:
+        pass
+    return None
+
+
+def upload_cleaned_image(image, student_name: str, public_id: str = None):
     """
     Upload ảnh CLEANED lên Cloudinary
+    image: đường dẫn file hoặc bytes ảnh đã encode (upload thẳng từ RAM)
+    public_id: nếu có (vd. content_public_id), ảnh đã tồn tại sẽ không upload lại
     """
-    result = cloudinary.uploader.upload(
-        local_path,
-        folder=f"{os.getenv('CLOUDINARY_FOLDER_CLEAN')}/{student_name}",
-        resource_type="image"
+    folder = f"{os.getenv('CLOUDINARY_FOLDER_CLEAN')}/{student_name}"
+
+    if public_id:
+        existing = _find_existing(folder, public_id)
+        if existing:
+            return existing
+
+    if isinstance(image, (bytes, bytearray)):
+        image = io.BytesIO(image)
+    options = {}
+    if public_id:
+        options = {"public_id": public_id, "overwrite": False}
+    result = get_cloudinary().uploader.upload(
+        image,
+        folder=folder,
+        resource_type="image",
+        **options
     )
+    if public_id:
+        _uploaded[f"{folder}/{public_id}"] = result["secure_url"]
     return result["secure_url"]
+
+
+class BackgroundUploader:
+    """
+    Upload ảnh sạch ở luồng nền trong lúc OCR / MCQ / LLM đang chạy.
+    submit() trả về ngay; collect() chờ và lấy URL theo đúng thứ tự đã submit.
+    """
+
+    def __init__(self, student_name: str, max_workers: int = UPLOAD_WORKERS):
+        self.student_name = student_name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+
+    def _upload(self, page):
+        # Encode JPEG ngay trong luồng nền để không chặn luồng chính
+        data = page.cleaned_jpeg()
+        with timed("upload_page"):
+            url = upload_cleaned_image(data, self.student_name, content_public_id(data))
+        record_bytes("upload", len(data))
+        return url
+
+    def submit(self, page):
+        # bind: luồng upload ghi số liệu vào job đang chấm
+        self._futures.append((page, self._executor.submit(bind(self._upload), page)))
+
+    def collect(self):
+        urls = []
+        for page, future in self._futures:
+            try:
+                urls.append(future.result())
+            except Exception as e:
+                sys.stderr.write(f"Cloudinary upload failed for page {page.index + 1}: {e}\n")
+                urls.append(None)
+        self._executor.shutdown(wait=True)
+        return urls
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+"""
+Ghi ảnh debug của MCQ Grader ở luồng nền (tắt mặc định, bật theo job bằng options["debug"]
+hoặc MCQ_DEBUG=1).
+
+Luồng chấm chỉ đưa (đường dẫn, ảnh, các nhãn cần vẽ) vào hàng đợi có giới hạn rồi đi tiếp;
+vẽ chữ + encode + ghi file chạy ở luồng writer. Hàng đợi đầy thì bỏ ảnh đó thay vì chờ,
+nên kết quả chấm không bao giờ bị trễ vì debug I/O.
+"""
+import atexit
+import os
+import queue
+import sys
+import threading
+
+import cv2
+
+from metrics import REGISTRY
+
+MCQ_DEBUG = os.getenv("MCQ_DEBUG", "0") == "1"
+# Ảnh debug giữ lại sau job (không nằm cạnh ảnh gốc trong uploads/)
+MCQ_DEBUG_DIR = os.getenv("MCQ_DEBUG_DIR", os.path.join("uploads", "debug"))
+MCQ_DEBUG_QUEUE = int(os.getenv("MCQ_DEBUG_QUEUE", "16"))
+# Thời gian tối đa chờ ghi nốt ảnh còn trong hàng đợi khi process thoát (giây)
+MCQ_DEBUG_FLUSH_TIMEOUT = float(os.getenv("MCQ_DEBUG_FLUSH_TIMEOUT", "10"))
+
+
+class DebugWriter:
+    def __init__(self, max_queue=MCQ_DEBUG_QUEUE):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="mcq-debug-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, path, image, marks):
+        """
+        image: ảnh BGR của trang (không bị sửa, writer vẽ lên bản sao)
+        marks: list (text, (x, y)) cần vẽ
+        RETURN: False nếu hàng đợi đầy và ảnh bị bỏ qua
+        """
+        try:
+            self._queue.put_nowait((path, image, marks))
+            return True
+        except queue.Full:
+            REGISTRY.inc("grading_debug_images_total", status="dropped")
+            sys.stderr.write(f"⚠️ Debug queue full, skip {path}\n")
+            return False
+
+    def _write(self, path, image, marks):
+        debug_img = image.copy()
+        for text, org in marks:
+            cv2.putText(debug_img, text, org, cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 120, 0), 2)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # imencode + ghi bytes: đường dẫn tiếng Việt/Unicode vẫn ghi được trên Windows
+        ok, buf = cv2.imencode(os.path.splitext(path)[1] or ".jpg", debug_img)
+        if not ok:
+            raise ValueError("Cannot encode debug image")
+        with open(path, "wb") as f:
+            f.write(buf.tobytes())
+
+    def _run(self):
+        while True:
+            path, image, marks = self._queue.get()
+            try:
+                self._write(path, image, marks)
+                REGISTRY.inc("grading_debug_images_total", status="written")
+            except Exception as e:
+                REGISTRY.inc("grading_debug_images_total", status="error")
+                sys.stderr.write(f"⚠️ Could not write debug image {path}: {e}\n")
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout=MCQ_DEBUG_FLUSH_TIMEOUT):
+        """Chờ hàng đợi ghi hết (tối đa timeout giây)"""
+        done = threading.Thread(target=self._queue.join, daemon=True)
+        done.start()
+        done.join(timeout)
+
+
+_debug_writer = None
+_debug_writer_lock = threading.Lock()
+
+
+def get_debug_writer():
+    global _debug_writer
+    with _debug_writer_lock:
+        if _debug_writer is None:
+            _debug_writer = DebugWriter()
+            # CLI thoát ngay sau khi in kết quả: ghi nốt ảnh debug còn lại
+            atexit.register(_debug_writer.flush)
+        return _debug_writer
+
+
+def job_debug_dir(options, job_id):
+    """Thư mục ảnh debug của một job, hoặc None nếu job không bật debug"""
+    if not options.get("debug", MCQ_DEBUG):
+        return None
+    return os.path.join(MCQ_DEBUG_DIR, job_id)
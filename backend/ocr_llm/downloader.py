@@ -0,0 +1,148 @@
+"""
+Tải ảnh bài nộp song song: một requests.Session dùng chung (connection pool),
+ghi dữ liệu theo từng chunk, giới hạn số kết nối đồng thời trên mỗi host
+và tự thử lại với backoff khi lỗi mạng / 429 / 5xx.
+"""
+import io
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+DOWNLOAD_PER_HOST = int(os.getenv("DOWNLOAD_PER_HOST", "4"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_BACKOFF = float(os.getenv("DOWNLOAD_BACKOFF", "0.5"))
+# Retry-After của server chỉ được chờ tối đa chừng này giây (host gửi 3600 không được giữ job cả giờ)
+DOWNLOAD_RETRY_AFTER_MAX = float(os.getenv("DOWNLOAD_RETRY_AFTER_MAX", "30"))
+DOWNLOAD_TIMEOUT = (10, 30)  # (connect, read) giây
+CHUNK_SIZE = 64 * 1024
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+_host_lock = threading.Lock()
+
+
+def log(message):
+    sys.stderr.write(f"{message}\n")
+    sys.stderr.flush()
+
+
+def get_session():
+    """Session dùng chung để tái sử dụng kết nối TCP/TLS giữa các ảnh (và các job)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=DOWNLOAD_WORKERS,
+                pool_maxsize=DOWNLOAD_WORKERS,
+            )
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+    return _session
+
+
+def _host_semaphore(host, per_host):
+    with _host_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(per_host)
+        return _host_limits[host]
+
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _stream_to(url, out, session):
+    """GET dạng stream, ghi từng chunk vào out (file hoặc BytesIO)"""
+    with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+        if r.status_code in RETRYABLE_STATUS:
+            retry_after = r.headers.get("Retry-After")
+            raise RetryableError(
+                f"HTTP {r.status_code}",
+                float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        r.raise_for_status()
+        for chunk in r.iter_content(CHUNK_SIZE):
+            if chunk:
+                out.write(chunk)
+
+
+def _fetch_url(url, save_path, per_host, retries, backoff):
+    host = urlparse(url).netloc
+    session = get_session()
+
+    for attempt in range(retries + 1):
+        try:
+            with _host_semaphore(host, per_host):
+                if save_path:
+                    with open(save_path, "wb") as f:
+                        _stream_to(url, f, session)
+                    return save_path
+                buf = io.BytesIO()
+                _stream_to(url, buf, session)
+                return buf.getvalue()
+        except (RetryableError, requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= retries:
+                raise
+            # Exponential backoff + jitter, ưu tiên Retry-After nếu server gửi (có giới hạn trên)
+            retry_after = getattr(e, "retry_after", None)
+            delay = min(retry_after, DOWNLOAD_RETRY_AFTER_MAX) if retry_after else backoff * (2 ** attempt)
+            delay += random.uniform(0, backoff)
+            log(f"⚠️ Download {url} failed ({e}), retry {attempt + 1}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def fetch_image(src, save_path=None, per_host=DOWNLOAD_PER_HOST,
+                retries=DOWNLOAD_RETRIES, backoff=DOWNLOAD_BACKOFF):
+    """
+    Tải một ảnh từ URL hoặc đọc từ local path.
+    RETURN: bytes ảnh (save_path=None) hoặc save_path sau khi đã ghi file
+    """
+    if src.startswith("http://") or src.startswith("https://"):
+        return _fetch_url(src, save_path, per_host, retries, backoff)
+    elif os.path.exists(src):
+        if save_path:
+            shutil.copyfile(src, save_path)
+            return save_path
+        with open(src, "rb") as f:
+            return f.read()
+    else:
+        raise ValueError(f"Invalid image source: {src}")
+
+
+def download_images(sources, dest_dir=None, max_workers=DOWNLOAD_WORKERS,
+                    per_host=DOWNLOAD_PER_HOST, retries=DOWNLOAD_RETRIES,
+                    backoff=DOWNLOAD_BACKOFF):
+    """
+    Tải nhiều ảnh song song.
+    dest_dir: nếu có, ghi stream ra file <dest_dir>/<i>.jpg; nếu không, giữ bytes trong RAM
+    RETURN: list cùng thứ tự sources, phần tử là bytes/đường dẫn hoặc None nếu ảnh đó lỗi
+    """
+    def task(item):
+        i, src = item
+        save_path = os.path.join(dest_dir, f"{i}.jpg") if dest_dir else None
+        try:
+            return fetch_image(src, save_path, per_host, retries, backoff)
+        except Exception as e:
+            log(f"Error processing image {src}: {e}")
+            return None
+
+    if not sources:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sources)))) as executor:
+        return list(executor.map(task, enumerate(sources)))
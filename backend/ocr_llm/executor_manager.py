@@ -0,0 +1,155 @@
+"""
+Pool process sống lâu, đặt tên theo stage, dùng chung cho cả pipeline.
+
+Trước đây clean_arrays_parallel / ocr_batch_parallel mỗi lần gọi lại tạo rồi huỷ
+ProcessPoolExecutor: trả chi phí fork/spawn, import lại module và load lại PaddleOCR
+cho từng bài nộp. ExecutorManager giữ mỗi stage một pool (tạo khi dùng lần đầu,
+initializer load sẵn model / giới hạn luồng) cho tới khi shutdown():
+
+  - main_processor (một bài): pool OCR mở min(số ảnh, plan) worker và warm ngay từ đầu,
+    PaddleOCR load trong lúc download / clean; bài 1 trang không load model nhiều lần
+  - grading_worker (service): pool clean dùng lại cho mọi job tới khi worker tắt
+  - batch_processor: mỗi BatchPipeline một manager, số worker theo BATCH_*_WORKERS / resource plan
+
+Stage có sẵn: "clean", "ocr", "ocr_batched" (xem ocr_stage); stage khác thêm bằng register().
+Pool bị hỏng (worker chết giữa chừng) được tạo lại ở lần get() tiếp theo.
+get(stage, workers) / warm(stage, workers): pool tạo mới chỉ mở `workers` process; pool đang chạy
+được dùng nguyên (ProcessPoolExecutor không đổi kích thước được, thay pool thì mất model đã load).
+"""
+import atexit
+import sys
+import threading
+
+from img_parallel import create_clean_executor
+from ocr_batch_processor import create_ocr_executor
+from resource_planner import get_resource_plan
+
+
+def ocr_stage(batched=False):
+    """Tên pool OCR: chế độ batched load module khác nên dùng pool riêng"""
+    return "ocr_batched" if batched else "ocr"
+
+
+def _noop():
+    return None
+
+
+def default_pools(plan, workers=None):
+    """
+    Cấu hình mặc định {stage: (số worker, factory(số worker) -> executor)} theo resource plan.
+    workers: {stage: số worker} ghi đè số worker của plan
+    """
+    workers = workers or {}
+    ocr_workers = workers.get("ocr") or plan.ocr_workers or 1
+    return {
+        "clean": (
+            workers.get("clean") or plan.clean_workers,
+            lambda n: create_clean_executor(n, plan.clean_threads),
+        ),
+        "ocr": (
+            ocr_workers,
+            lambda n: create_ocr_executor(n, warmup=True, threads=plan.ocr_threads),
+        ),
+        "ocr_batched": (
+            ocr_workers,
+            lambda n: create_ocr_executor(n, warmup=True, batched=True, threads=plan.ocr_threads),
+        ),
+    }
+
+
+class ExecutorManager:
+    def __init__(self, plan=None, workers=None):
+        self._specs = default_pools(plan or get_resource_plan(), workers)
+        self._pools = {}
+        self._sizes = {}        # stage -> số process của pool đang chạy
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def register(self, stage, workers, factory):
+        """Thêm / thay cấu hình pool của một stage (trước khi pool đó được tạo)"""
+        with self._lock:
+            if stage in self._pools:
+                raise ValueError(f"Pool '{stage}' is already running")
+            self._specs[stage] = (workers, factory)
+
+    def workers(self, stage):
+        """Số worker tối đa của stage"""
+        return self._specs[stage][0]
+
+    def get(self, stage, workers=None):
+        """
+        Pool của stage (tạo lần đầu dùng; pool hỏng thì tạo lại).
+        workers: số process khi phải tạo pool mới (không quá workers(stage)); None = tối đa
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ExecutorManager is shut down")
+            if stage not in self._specs:
+                raise ValueError(f"Unknown pool '{stage}', expected one of {sorted(self._specs)}")
+            pool = self._pools.get(stage)
+            # ProcessPoolExecutor không có API public cho trạng thái broken
+            if pool is not None and getattr(pool, "_broken", False):
+                sys.stderr.write(f"⚠️ Pool '{stage}' is broken, restarting it\n")
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = None
+            if pool is None:
+                limit, factory = self._specs[stage]
+                size = limit if workers is None else max(1, min(workers, limit))
+                pool = self._pools[stage] = factory(size)
+                self._sizes[stage] = size
+            return pool
+
+    def submit(self, stage, fn, *args, **kwargs):
+        return self.get(stage).submit(fn, *args, **kwargs)
+
+    def map(self, stage, fn, *iterables):
+        return self.get(stage).map(fn, *iterables)
+
+    def warm(self, stage, workers=None):
+        """
+        Khởi động worker của stage ngay (initializer load model chạy nền), không chờ.
+        workers: như get(); pool đã chạy thì warm đủ số process hiện có
+        RETURN: pool của stage
+        """
+        pool = self.get(stage, workers)
+        for _ in range(self._sizes[stage]):
+            pool.submit(_noop)
+        return pool
+
+    def shutdown(self, wait=True):
+        """Đóng mọi pool; gọi nhiều lần không sao"""
+        with self._lock:
+            self._closed = True
+            pools, self._pools = self._pools, {}
+            self._sizes = {}
+        for pool in pools.values():
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+_executor_manager = None
+_executor_manager_lock = threading.Lock()
+
+
+def get_executor_manager():
+    """Manager dùng chung của process (main_processor / grading_worker), tự đóng khi process thoát"""
+    global _executor_manager
+    with _executor_manager_lock:
+        if _executor_manager is None:
+            _executor_manager = ExecutorManager()
+            atexit.register(_executor_manager.shutdown)
+        return _executor_manager
+
+
+def shutdown_executors():
+    """Đóng manager dùng chung (nếu đã tạo); lần get_executor_manager() sau tạo manager mới"""
+    global _executor_manager
+    with _executor_manager_lock:
+        manager, _executor_manager = _executor_manager, None
+    if manager is not None:
+        manager.shutdown()
@@ -0,0 +1,282 @@
+"""
+Lớp client bọc quanh Gemini cho chấm bài song song:
+  - token bucket dùng chung (requests/phút và tokens/phút) cho mọi luồng
+  - giới hạn số request đồng thời
+  - retry exponential backoff có jitter với lỗi tạm thời (429, 5xx, timeout)
+  - backend thay thế được: "gemini" (thật) hoặc "fake" (offline, để test throughput / lỗi)
+  - context caching: phần prefix cố định (hướng dẫn + rubric) được đăng ký một lần
+    mỗi bài tập làm cached content, các lần chấm sau chỉ gửi phần riêng của học sinh
+
+Cấu hình bằng biến môi trường LLM_* (xem bên dưới).
+"""
+import datetime
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_RPM = float(os.getenv("LLM_RPM", "60"))
+LLM_TPM = float(os.getenv("LLM_TPM", "1000000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+
+# Model chấm bài, dùng chung cho request thường và context cache
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-flash-latest")
+
+# Context caching (Gemini explicit caching): cần model có version cố định (không dùng alias -latest,
+# khi đó bỏ qua cache) và prefix đủ dài; không cache được thì gửi prefix kèm request như bình thường
+# (vẫn hưởng implicit caching)
+LLM_CONTEXT_CACHE = os.getenv("LLM_CONTEXT_CACHE", "1") != "0"
+LLM_CONTEXT_CACHE_TTL = int(os.getenv("LLM_CONTEXT_CACHE_TTL", "3600"))  # giây
+LLM_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+# Tạo cache lỗi: thử lại sau khoảng này (giây) thay vì tắt cache cho bài tập đó mãi mãi
+LLM_CONTEXT_CACHE_RETRY = float(os.getenv("LLM_CONTEXT_CACHE_RETRY", "300"))
+
+# Ước lượng token cho mỗi ảnh gửi kèm (Gemini tính ~258 token / ảnh)
+IMAGE_TOKENS = 258
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable",
+    "DeadlineExceeded", "InternalServerError", "GatewayTimeout",
+}
+
+
+class TokenBucket:
+    """Bucket nạp đều `rate_per_min` đơn vị mỗi phút, tối đa `capacity`"""
+
+    def __init__(self, rate_per_min: float, capacity: float = None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity or rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0):
+        """Chờ tới khi đủ token rồi trừ (amount lớn hơn capacity được cắt về capacity)"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(min(wait, 1.0))
+
+
+def estimate_tokens(contents) -> int:
+    tokens = 0
+    for part in contents:
+        if isinstance(part, str):
+            tokens += len(part) // 4 + 1
+        else:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if type(error).__name__ in RETRYABLE_NAMES:
+        return True
+    code = getattr(error, "code", None)
+    code = getattr(code, "value", code)
+    return code in RETRYABLE_STATUS
+
+
+# ---------------- Context cache ----------------
+
+class ContextCacheRegistry:
+    """
+    Mỗi prefix (hướng dẫn chấm + rubric của một bài tập) được tạo cached content một lần,
+    các luồng chấm cùng bài tập dùng chung model tạo từ cached content đó.
+    Prefix quá ngắn, model là alias hoặc tạo cache lỗi -> RETURN None, caller gửi prefix như bình thường.
+    """
+
+    def __init__(self, model_name=GEMINI_MODEL_NAME, ttl=LLM_CONTEXT_CACHE_TTL,
+                 min_tokens=LLM_CONTEXT_CACHE_MIN_TOKENS, retry_after=LLM_CONTEXT_CACHE_RETRY):
+        self.model_name = model_name
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.retry_after = retry_after
+        self.enabled = not model_name.endswith("-latest")
+        if not self.enabled:
+            print(f"⚠️ Context cache needs a pinned model version, '{model_name}' is an alias: sending prompt prefix inline")
+        self._entries = {}      # key -> (model, hết hạn lúc) hoặc (None, thử tạo lại lúc) nếu tạo lỗi
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _key(self, prefix):
+        return hashlib.sha256(f"{self.model_name}\n{prefix}".encode("utf-8")).hexdigest()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _create(self, prefix, key):
+        import google.generativeai as genai
+
+        cache = genai.caching.CachedContent.create(
+            model=self.model_name,
+            display_name=f"edumark-{key[:16]}",
+            contents=[prefix],
+            ttl=datetime.timedelta(seconds=self.ttl),
+        )
+        print(f"🧠 Context cache created for prompt prefix ({estimate_tokens([prefix])} tokens est., ttl {self.ttl}s)")
+        return genai.GenerativeModel.from_cached_content(cached_content=cache)
+
+    def model_for(self, prefix):
+        if not self.enabled or estimate_tokens([prefix]) < self.min_tokens:
+            return None
+        key = self._key(prefix)
+        # Lock theo prefix: nhiều luồng cùng bài tập chỉ tạo cache một lần
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry is not None:
+                model, until = entry
+                if model is None and time.monotonic() < until:
+                    return None
+                # Còn dưới 60s thì tạo lại để request không trỏ vào cache vừa hết hạn
+                if model is not None and until - time.monotonic() > 60:
+                    return model
+            try:
+                model = self._create(prefix, key)
+                self._entries[key] = (model, time.monotonic() + self.ttl)
+                return model
+            except Exception as e:
+                print(f"⚠️ Context cache unavailable, sending prompt prefix inline "
+                      f"(retry in {self.retry_after:.0f}s): {e}")
+                self._entries[key] = (None, time.monotonic() + self.retry_after)
+                return None
+
+
+# ---------------- Backends ----------------
+
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, model_factory, context_cache=None, model_name=GEMINI_MODEL_NAME):
+        self.model_factory = model_factory
+        self.context_cache = context_cache
+        # Model trả lời request (cả qua context cache), dùng làm khoá cache kết quả
+        self.model_name = model_name
+
+    def generate(self, contents, generation_config, prefix=None):
+        if isinstance(generation_config, dict):
+            import google.generativeai as genai
+            generation_config = genai.GenerationConfig(**generation_config)
+        model = self.model_factory()
+        if prefix:
+            cached_model = self.context_cache.model_for(prefix) if self.context_cache else None
+            if cached_model is not None:
+                return cached_model.generate_content(
+                    contents, generation_config=generation_config
+                )
+            # Không có cached content: prefix luôn đứng đầu, giống hệt nhau giữa các học sinh
+            contents = [prefix] + list(contents)
+        return model.generate_content(
+            contents, generation_config=generation_config
+        )
+
+
+class _FakePart:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeContent:
+    def __init__(self, text):
+        self.parts = [_FakePart(text)]
+
+
+class _FakeCandidate:
+    def __init__(self, text):
+        self.content = _FakeContent(text)
+
+
+class FakeResponse:
+    """Giống cấu trúc response của SDK: response.candidates[0].content.parts[0].text"""
+
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [_FakeCandidate(text)]
+
+
+class FakeTransientError(Exception):
+    code = 429
+
+
+class FakeBackend:
+    """
+    Backend offline: trả JSON cố định sau một độ trễ giả lập, có thể ném lỗi 429 ngẫu nhiên.
+    LLM_FAKE_LATENCY (giây), LLM_FAKE_FAILURE_RATE (0..1), LLM_FAKE_RESPONSE (chuỗi JSON)
+    """
+    name = "fake"
+    model_name = "fake"
+
+    def __init__(self, latency=None, failure_rate=None, response=None, seed=None):
+        self.latency = float(os.getenv("LLM_FAKE_LATENCY", "0.5")) if latency is None else latency
+        self.failure_rate = float(os.getenv("LLM_FAKE_FAILURE_RATE", "0")) if failure_rate is None else failure_rate
+        self.response = response or os.getenv("LLM_FAKE_RESPONSE") or json.dumps({
+            "score": 0,
+            "comment": "Fake LLM backend",
+            "feasibility": True,
+            "details": {}
+        })
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate(self, contents, generation_config, prefix=None):
+        with self.lock:
+            self.calls += 1
+            fail = self.random.random() < self.failure_rate
+        time.sleep(self.latency)
+        if fail:
+            raise FakeTransientError("429 Resource exhausted (fake)")
+        return FakeResponse(self.response)
+
+
+# ---------------- Client ----------------
+
+class LLMClient:
+    def __init__(self, backend, rpm=LLM_RPM, tpm=LLM_TPM,
+                 max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX):
+        self.backend = backend
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _backoff(self, attempt):
+        # Full jitter: ngẫu nhiên trong [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def generate(self, contents, generation_config=None, prefix=None):
+        """prefix: phần prompt cố định theo bài tập (backend có thể dùng context cache)"""
+        token_estimate = estimate_tokens(([prefix] if prefix else []) + list(contents))
+        for attempt in range(self.max_retries + 1):
+            self.requests.acquire(1)
+            self.tokens.acquire(token_estimate)
+            try:
+                with self.slots:
+                    return self.backend.generate(contents, generation_config, prefix=prefix)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._backoff(attempt)
+                print(f"⚠️ LLM request failed ({type(e).__name__}: {e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
@@ -0,0 +1,113 @@
+"""
+Worker chấm bài chạy lâu dài (thay cho việc spawn main_processor.py mỗi bài nộp).
+
+Giao thức JSON-lines qua stdin/stdout, mỗi dòng là một JSON:
+  -> {"id": "abc", "urls": ["https://...", "..."], "rubric": "..."}
+  <- {"id": "abc", "ok": true, "result": {score, comment, feasibility, details, cleanedUrls}}
+  -> {"id": "x", "op": "ping"}      <- {"id": "x", "ok": true, "result": "pong"}
+  -> {"id": "m", "op": "metrics"}   <- {"id": "m", "ok": true, "result": "<Prometheus text>"}
+     (xếp hàng sau job đang chạy; Node đọc METRICS_TEXTFILE do luồng nền ghi định kỳ thay vì op này)
+  -> {"id": "y", "op": "shutdown"}  <- {"id": "y", "ok": true, "result": "bye"}
+
+stdout chỉ dành cho giao thức: mọi print/log (kể cả của PaddleOCR, YOLO) bị
+chuyển sang stderr. PaddleOCR, 2 model YOLO và Gemini được load một lần lúc khởi động.
+
+Chạy: python ocr_llm/grading_worker.py  (từ thư mục backend, giống main_processor)
+"""
+import sys
+import io
+import json
+
+from stdio_channel import open_protocol_channel
+
+_channel = open_protocol_channel()
+
+from main_processor import process_submission, parse_urls, build_error_result, log
+from mcq_grader import get_mcq_grader
+from ocr_processor import init_ocr_worker
+from llm_processor import get_gemini_model
+from metrics import REGISTRY, start_textfile_writer
+from resource_planner import configure_resources
+from executor_manager import get_executor_manager, shutdown_executors
+
+
+def send(message):
+    _channel.write(json.dumps(message, ensure_ascii=False) + "\n")
+    _channel.flush()
+
+
+def warm_up():
+    """Load trước tất cả model để job đầu tiên không phải chịu cold start."""
+    log("🔥 Warming up grading worker...")
+    # OCR + YOLO chạy ngay trong process này: giới hạn luồng trước khi load model
+    plan = configure_resources("worker")
+    # Pool làm sạch ảnh sống cùng worker, dùng lại cho mọi job;
+    # khởi động trước khi load Paddle / torch để process con không fork kèm model
+    get_executor_manager().warm("clean")
+    init_ocr_worker(warmup=True, threads=plan.ocr_threads)
+    get_mcq_grader()
+    try:
+        get_gemini_model()
+    except Exception as e:
+        # Thiếu API key không nên làm chết worker, job sẽ tự báo lỗi
+        log(f"⚠️ Gemini warm-up failed: {e}")
+    log("✅ Grading worker ready.")
+
+
+def handle_job(job):
+    op = job.get("op", "grade")
+    if op == "ping":
+        return "pong"
+    if op == "metrics":
+        # Prometheus text format của mọi job worker đã chạy
+        return REGISTRY.render()
+    if op != "grade":
+        raise ValueError(f"Unknown op: {op}")
+
+    raw_urls = parse_urls(job.get("urls") or [])
+    if not raw_urls:
+        raise ValueError("Job has no image urls")
+
+    return process_submission(
+        raw_urls,
+        job.get("rubric") or "",
+        options=job.get("options"),
+        mcq_grader=get_mcq_grader(),
+        ocr_workers=0,
+    )
+
+
+def serve():
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        job_id = None
+        try:
+            job = json.loads(line)
+            job_id = job.get("id")
+            if job.get("op") == "shutdown":
+                send({"id": job_id, "ok": True, "result": "bye"})
+                break
+            result = handle_job(job)
+            send({"id": job_id, "ok": True, "result": result})
+        except Exception as e:
+            log(f"An error occurred in job {job_id}: {e}")
+            send({"id": job_id, "ok": False, "result": build_error_result(e)})
+
+
+def main():
+    sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    start_textfile_writer()
+    warm_up()
+    send({"id": None, "ok": True, "result": "ready"})
+
+    try:
+        serve()
+    finally:
+        shutdown_executors()
+
+
+if __name__ == "__main__":
+    main()
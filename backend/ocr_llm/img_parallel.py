@@ -1,5 +1,20 @@
 from concurrent.futures import ProcessPoolExecutor
-from img_preprocessing import clean_image
+from img_preprocessing import clean_image, clean_image_array
+from page_image import share_array, read_shared_array, export_shared_array, take_shared_array
+from resource_planner import apply_thread_limits, get_resource_plan
+
+
+def create_clean_executor(max_workers=2, threads=None):
+    """
+    Pool làm sạch ảnh: mỗi process giới hạn số luồng OpenCV / OpenMP
+    (mặc định theo resource plan, clean_threads) để N process không tranh nhau CPU.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=apply_thread_limits,
+        initargs=(threads or get_resource_plan().clean_threads,),
+    )
+
 
 def clean_images_parallel(image_paths, max_workers=2):
     """
@@ -7,7 +22,7 @@ def clean_images_parallel(image_paths, max_workers=2):
     """
     print("⚙️ Start parallel cleaning...")
 
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+    with create_clean_executor(max_workers) as executor:
         results = list(executor.map(clean_image, image_paths))
 
     # lọc ảnh lỗi và ghép cặp với ảnh gốc
@@ -18,3 +33,52 @@ def clean_images_parallel(image_paths, max_workers=2):
 
     print("✅ Parallel cleaning finished")
     return final_results
+
+
+def _clean_shared(handle, profile=None):
+    """
+    Chạy trong process con: đọc ảnh từ shared memory, trả ảnh sạch qua shared memory.
+    RETURN: (handle ảnh sạch hoặc None, ma trận gốc -> sạch)
+    """
+    cleaned, transform = clean_image_array(read_shared_array(handle), profile, return_transform=True)
+    if cleaned is None:
+        return None, None
+    return export_shared_array(cleaned), transform
+
+
+def clean_arrays_parallel(images, max_workers=2, profile=None, executor=None, return_transform=False):
+    """
+    Làm sạch nhiều ảnh (numpy BGR) song song, không ghi file trung gian.
+    Ảnh vào/ra được truyền qua shared memory thay vì pickle.
+    max_workers=0: chạy ngay trong process hiện tại.
+    profile: tên profile làm sạch (xem img_preprocessing.PREPROCESS_PROFILES)
+    executor: ProcessPoolExecutor dùng chung (chế độ batch), khi đó bỏ qua max_workers
+    RETURN: list ảnh sạch theo đúng thứ tự đầu vào (None nếu ảnh đó lỗi)
+            return_transform=True: list (ảnh sạch, ma trận gốc -> sạch)
+    """
+    print("⚙️ Start parallel cleaning...")
+
+    if max_workers == 0:
+        results = [clean_image_array(img, profile, return_transform=True) for img in images]
+    else:
+        shared = [share_array(img) for img in images]
+        try:
+            if executor is not None:
+                handles = list(executor.map(
+                    _clean_shared, [h for _, h in shared], [profile] * len(shared)
+                ))
+            else:
+                with create_clean_executor(max_workers) as pool:
+                    handles = list(pool.map(
+                        _clean_shared, [h for _, h in shared], [profile] * len(shared)
+                    ))
+        finally:
+            for shm, _ in shared:
+                shm.close()
+                shm.unlink()
+        results = [(take_shared_array(h) if h else None, t) for h, t in handles]
+
+    print("✅ Parallel cleaning finished")
+    if return_transform:
+        return results
+    return [cleaned for cleaned, _ in results]
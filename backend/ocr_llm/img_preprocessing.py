@@ -3,28 +3,78 @@ import numpy as np
 import os
 import uuid
 
+from stage_cache import config_version
+
 # cleaned sẽ nằm cùng cấp uploads/cleaned
 CLEANED_DIR = os.path.join("uploads", "cleaned")
 os.makedirs(CLEANED_DIR, exist_ok=True)
 
+# Các profile làm sạch ảnh, chọn theo job (options["profile"]) hoặc biến môi trường.
+# denoise = (h, templateWindowSize, searchWindowSize) cho fastNlMeansDenoising,
+# None = thay bằng medianBlur 3x3 (rẻ hơn nhiều, chất lượng thấp hơn).
+# "max-quality" giữ nguyên pipeline gốc.
+PREPROCESS_PROFILES = {
+    "fast": {
+        "max_side": 1600,
+        "denoise1": None,
+        "denoise2": None,
+    },
+    "balanced": {
+        "max_side": 2000,
+        "denoise1": (25, 5, 11),
+        "denoise2": (15, 5, 11),
+    },
+    "max-quality": {
+        "max_side": 2400,
+        "denoise1": (25, 7, 21),
+        "denoise2": (15, 7, 21),
+    },
+}
+DEFAULT_PROFILE = os.getenv("CLEAN_PROFILE", "max-quality")
+
+
+def get_profile(name=None):
+    """RETURN: (tên profile, tham số). Tên không hợp lệ -> ValueError"""
+    name = name or DEFAULT_PROFILE
+    if name not in PREPROCESS_PROFILES:
+        raise ValueError(
+            f"Unknown preprocessing profile '{name}', expected one of {list(PREPROCESS_PROFILES)}"
+        )
+    return name, PREPROCESS_PROFILES[name]
+
+
+def profile_cache_version(profile=None):
+    """Version cho stage_cache: đổi tham số profile -> ảnh sạch cũ trong cache không còn dùng"""
+    name, params = get_profile(profile)
+    return config_version("clean", name, params)
+
+
+def _denoise(gray, params):
+    if params is None:
+        return cv2.medianBlur(gray, 3)
+    h, template_size, search_size = params
+    return cv2.fastNlMeansDenoising(gray, None, h, template_size, search_size)
+
 
 def remove_small_components(binary_img, min_size=80):
     nb_components, output, stats, _ = cv2.connectedComponentsWithStats(
         binary_img, connectivity=8
     )
-    sizes = stats[1:, cv2.CC_STAT_AREA]
-    nb_components -= 1
-    img_clean = np.zeros(output.shape, dtype=np.uint8)
-    for i in range(nb_components):
-        if sizes[i] >= min_size:
-            img_clean[output == i + 1] = 255
-    return img_clean
+    # Bảng tra theo nhãn: 255 cho thành phần đủ lớn, 0 cho nền (nhãn 0) và nhiễu.
+    # Một lần tra bảng trên cả ảnh thay vì so sánh toàn ảnh cho từng thành phần.
+    lut = np.zeros(nb_components, dtype=np.uint8)
+    lut[1:][stats[1:, cv2.CC_STAT_AREA] >= min_size] = 255
+    return lut[output]
 
 
-def deskew_image(binary_img, orig_img):
+def deskew_transform(binary_img, shape):
+    """
+    Góc nghiêng ước lượng từ ảnh nhị phân -> ma trận xoay cho ảnh kích thước shape.
+    RETURN: (M 2x3, angle, (bound_w, bound_h)) hoặc None nếu không xoay
+    """
     coords = np.column_stack(np.where(binary_img > 0))
     if coords.shape[0] < 10:
-        return orig_img, 0.0
+        return None
 
     rect = cv2.minAreaRect(coords[:, ::-1])
     angle = rect[-1]
@@ -35,9 +85,9 @@ def deskew_image(binary_img, orig_img):
         angle = -angle
 
     if abs(angle) > 10:
-        return orig_img, 0.0
+        return None
 
-    (h, w) = orig_img.shape[:2]
+    (h, w) = shape[:2]
     center = (w // 2, h // 2)
     M = cv2.getRotationMatrix2D(center, angle, 1.0)
 
@@ -48,40 +98,60 @@ def deskew_image(binary_img, orig_img):
 
     M[0, 2] += bound_w / 2 - center[0]
     M[1, 2] += bound_h / 2 - center[1]
+    return M, angle, (bound_w, bound_h)
+
 
-    rotated = cv2.warpAffine(
-        orig_img,
+def _rotate(img, transform):
+    M, _, size = transform
+    return cv2.warpAffine(
+        img,
         M,
-        (bound_w, bound_h),
+        size,
         flags=cv2.INTER_LINEAR,
         borderMode=cv2.BORDER_REPLICATE,
     )
-    return rotated, angle
 
 
-def clean_image(file_path: str) -> str:
+def deskew_image(binary_img, orig_img):
+    transform = deskew_transform(binary_img, orig_img.shape)
+    if transform is None:
+        return orig_img, 0.0
+    return _rotate(orig_img, transform), transform[1]
+
+
+def compose_clean_transform(raw_shape, resized_shape, deskew=None):
     """
-    Clean image for OCR.
-    RETURN: path to cleaned image
+    Ma trận affine 2x3 (list) đổi toạ độ ảnh gốc -> toạ độ ảnh sạch (resize rồi xoay),
+    dùng để đưa bbox YOLO (chạy trên ảnh gốc) sang ảnh sạch cho OCR theo vùng.
     """
-    if not os.path.exists(file_path):
-        print("❌ File not found:", file_path)
-        return ""
+    sx = resized_shape[1] / raw_shape[1]
+    sy = resized_shape[0] / raw_shape[0]
+    M = deskew[0] if deskew is not None else np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    return [
+        [float(M[0, 0] * sx), float(M[0, 1] * sy), float(M[0, 2])],
+        [float(M[1, 0] * sx), float(M[1, 1] * sy), float(M[1, 2])],
+    ]
+
 
+def clean_image_array(img: np.ndarray, profile: str = None, return_transform: bool = False):
+    """
+    Clean image for OCR (in-memory).
+    INPUT: ảnh BGR đã decode, profile: tên trong PREPROCESS_PROFILES (mặc định DEFAULT_PROFILE)
+    RETURN: ảnh sạch grayscale (numpy) hoặc None nếu lỗi
+            return_transform=True: (ảnh sạch, ma trận gốc -> sạch) — xem compose_clean_transform
+    """
     try:
-        arr = np.fromfile(file_path, np.uint8)
-        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-        if img is None:
-            print("❌ Cannot decode image")
-            return ""
+        _, params = get_profile(profile)
+        max_side = params["max_side"]
 
+        raw_shape = img.shape
         h, w = img.shape[:2]
-        if max(h, w) > 2400:
-            scale = 2400 / max(h, w)
+        if max(h, w) > max_side:
+            scale = max_side / max(h, w)
             img = cv2.resize(img, None, fx=scale, fy=scale)
 
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        denoised = cv2.fastNlMeansDenoising(gray, None, 25, 7, 21)
+        denoised = _denoise(gray, params["denoise1"])
 
         kernel = np.ones((2, 2), np.uint8)
         opened = cv2.morphologyEx(denoised, cv2.MORPH_OPEN, kernel)
@@ -102,10 +172,11 @@ def clean_image(file_path: str) -> str:
         )
 
         cleaned_components = remove_small_components(adaptive, 120)
-        rotated_color, _ = deskew_image(cleaned_components, img)
+        deskew = deskew_transform(cleaned_components, img.shape)
+        rotated_color = _rotate(img, deskew) if deskew is not None else img
         rotated_gray = cv2.cvtColor(rotated_color, cv2.COLOR_BGR2GRAY)
 
-        den2 = cv2.fastNlMeansDenoising(rotated_gray, None, 15, 7, 21)
+        den2 = _denoise(rotated_gray, params["denoise2"])
         clahe2 = cv2.createCLAHE(1.8, (8, 8)).apply(den2)
 
         adapt2 = cv2.adaptiveThreshold(
@@ -118,6 +189,36 @@ def clean_image(file_path: str) -> str:
         cleaned_final = remove_small_components(adapt2, 100)
         final = cv2.bitwise_not(cleaned_final)
         final = cv2.medianBlur(final, 3)
+        if return_transform:
+            return final, compose_clean_transform(raw_shape, img.shape, deskew)
+        return final
+
+    except Exception as e:
+        import traceback
+        print("❌ Clean error:", e)
+        traceback.print_exc()
+        return (None, None) if return_transform else None
+
+
+def clean_image(file_path: str, profile: str = None) -> str:
+    """
+    Clean image for OCR.
+    RETURN: path to cleaned image
+    """
+    if not os.path.exists(file_path):
+        print("❌ File not found:", file_path)
+        return ""
+
+    try:
+        arr = np.fromfile(file_path, np.uint8)
+        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+        if img is None:
+            print("❌ Cannot decode image")
+            return ""
+
+        final = clean_image_array(img, profile)
+        if final is None:
+            return ""
 
         cleaned_path = os.path.join(
             CLEANED_DIR, f"cleaned_{uuid.uuid4().hex}.jpg"
@@ -0,0 +1,56 @@
+"""
+Cache kết quả chấm của Gemini: cùng prompt (rubric + context), cùng ảnh và cùng
+generation config thì trả lại kết quả đã parse trước đó thay vì gọi API lần nữa
+(retry, bài nộp trùng, chạy lại sau khi crash...).
+
+Dùng chung thư mục / giới hạn dung lượng với stage_cache, thêm TTL riêng.
+Tắt toàn bộ: LLM_CACHE=0. Bỏ qua cho một lần chấm: use_cache=False.
+"""
+import hashlib
+import json
+import os
+import time
+
+from stage_cache import get_stage_cache
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # giây
+LLM_CACHE_VERSION = "1"
+STAGE = "llm"
+
+
+def llm_cache_key(prompt: str, image_blobs, generation_config: dict) -> str:
+    """
+    image_blobs: list bytes đại diện cho từng ảnh gửi đi (theo đúng thứ tự)
+    """
+    h = hashlib.sha256()
+    h.update(LLM_CACHE_VERSION.encode())
+    h.update(json.dumps(generation_config, sort_keys=True, default=str).encode("utf-8"))
+    h.update(prompt.encode("utf-8"))
+    for blob in image_blobs:
+        h.update(hashlib.sha256(blob).digest())
+    return h.hexdigest()
+
+
+def get_cached_result(key: str):
+    """RETURN: dict kết quả đã lưu hoặc None (không có / hết hạn)"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    entry = get_stage_cache().get_json(STAGE, key, LLM_CACHE_VERSION)
+    if not entry:
+        return None
+    if time.time() - entry.get("created", 0) > LLM_CACHE_TTL:
+        return None
+    return entry.get("result")
+
+
+def store_result(key: str, result: dict):
+    """Chỉ gọi với kết quả JSON đã parse thành công"""
+    if not LLM_CACHE_ENABLED:
+        return
+    try:
+        get_stage_cache().set_json(
+            STAGE, key, LLM_CACHE_VERSION, {"created": time.time(), "result": result}
+        )
+    except Exception as e:
+        print(f"⚠️ LLM cache write failed: {e}")
@@ -0,0 +1,80 @@
+"""
+Chuẩn bị ảnh gửi cho Gemini Vision trong giới hạn dung lượng mỗi request.
+
+Ảnh sạch đã được nhị phân hoá (đen/trắng) nên PNG 1-bit nhỏ hơn rất nhiều so với
+JPEG 2400px chất lượng 95 mà chữ vẫn rõ. Mỗi trang được chia đều budget, thử lần lượt
+các mức độ phân giải/encode từ tốt nhất tới nhỏ nhất và chọn mức đầu tiên vừa budget.
+"""
+import io
+import os
+
+import numpy as np
+import PIL.Image
+
+# Tổng số bytes ảnh tối đa cho một request (mặc định 3 MB)
+LLM_PAYLOAD_BUDGET = int(os.getenv("LLM_PAYLOAD_BUDGET", str(3 * 1024 * 1024)))
+LLM_MAX_SIDE = int(os.getenv("LLM_MAX_SIDE", "2400"))
+# Các mức thu nhỏ thử lần lượt (tỉ lệ so với LLM_MAX_SIDE)
+SCALE_STEPS = (1.0, 0.85, 0.7, 0.6, 0.5, 0.4)
+
+
+def is_binarized(img: PIL.Image.Image, tolerance=0.01) -> bool:
+    """Ảnh gần như chỉ có pixel 0/255 (ảnh sạch sau clean_image)"""
+    arr = np.asarray(img.convert("L"))
+    mid = np.count_nonzero((arr > 32) & (arr < 224))
+    return mid <= tolerance * arr.size
+
+
+def _resize(img, scale):
+    w, h = img.size
+    target = int(LLM_MAX_SIDE * scale)
+    if max(w, h) <= target:
+        return img
+    ratio = target / max(w, h)
+    return img.resize((max(1, int(w * ratio)), max(1, int(h * ratio))), PIL.Image.LANCZOS)
+
+
+def _encode(img, binary):
+    buf = io.BytesIO()
+    if binary:
+        img.convert("L").convert("1", dither=PIL.Image.NONE).save(buf, format="PNG", optimize=True)
+        return buf.getvalue(), "image/png"
+    img.convert("L").save(buf, format="JPEG", quality=80, optimize=True)
+    return buf.getvalue(), "image/jpeg"
+
+
+def encode_page(img: PIL.Image.Image, page_budget: int):
+    """
+    RETURN: (bytes, mime_type, size (w, h)) của phiên bản lớn nhất vừa page_budget,
+    hoặc phiên bản nhỏ nhất nếu không mức nào vừa.
+    """
+    binary = is_binarized(img)
+    best = None
+    for scale in SCALE_STEPS:
+        resized = _resize(img, scale)
+        data, mime = _encode(resized, binary)
+        best = (data, mime, resized.size)
+        if len(data) <= page_budget:
+            break
+    return best
+
+
+def prepare_vision_parts(images, budget: int = None):
+    """
+    images: list PIL.Image
+    RETURN: (list part {"mime_type", "data"} cho generate_content, tổng số bytes)
+    """
+    budget = budget or LLM_PAYLOAD_BUDGET
+    if not images:
+        return [], 0
+
+    page_budget = budget // len(images)
+    parts, total = [], 0
+    for idx, img in enumerate(images, start=1):
+        data, mime, size = encode_page(img, page_budget)
+        parts.append({"mime_type": mime, "data": data})
+        total += len(data)
+        print(f"🖼️ Page {idx}: {img.size[0]}x{img.size[1]} -> {size[0]}x{size[1]} {mime}, {len(data) / 1024:.0f} KB")
+
+    print(f"📦 Vision payload: {total / 1024:.0f} KB for {len(images)} page(s) (budget {budget / 1024:.0f} KB)")
+    return parts, total
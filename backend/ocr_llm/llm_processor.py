@@ -1,12 +1,18 @@
 # d:\TIEN\Nam5\DATN\EduMark\backend\ocr_llm\llm_processor.py
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import os
 import re
 import json
 import PIL.Image
+import numpy as np
 from dotenv import load_dotenv
-from prompt import prompt_template
+from prompt import instruction_template, student_template
+from llm_cache import llm_cache_key, get_cached_result, store_result
+from llm_payload import prepare_vision_parts
+from metrics import bind, record_bytes, timed
+from gemini_client import (
+    GEMINI_MODEL_NAME, LLM_BACKEND, LLM_CONTEXT_CACHE,
+    LLMClient, GeminiBackend, FakeBackend, ContextCacheRegistry
+)
 from concurrent.futures import ThreadPoolExecutor, as_completed
 # from encoding_fix_backup import force_utf8
 # force_utf8()
@@ -17,18 +23,27 @@ load_dotenv(dotenv_path=dotenv_path)
 # --- Singleton Pattern for Gemini Model ---
 _gemini_model = None
 
+# Cấu hình để yêu cầu LLM trả về đúng định dạng JSON
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "temperature": 0.1,  # Giảm sáng tạo để kết quả ổn định
+}
+
 def _configure_gemini():
     global _gemini_model
     try:
+        # SDK Gemini chỉ được import khi thật sự gọi LLM
+        import google.generativeai as genai
+
         api_key = os.getenv('GOOGLE_API_KEY')
         if not api_key:
             raise ValueError("ERROR: Environment variable 'GOOGLE_API_KEY' is not set in .env file.")
         
         genai.configure(api_key=api_key)
         
-        print("Initializing Gemini (gemini-Flash-lastest) model...")
+        print(f"Initializing Gemini ({GEMINI_MODEL_NAME}) model...")
         # Sử dụng gemini-pro, một model mạnh mẽ và ổn định
-        _gemini_model = genai.GenerativeModel('gemini-flash-latest') 
+        _gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
         print("✅ Gemini model is ready.")
         
     except Exception as e:
@@ -41,6 +56,28 @@ def get_gemini_model():
     if _gemini_model is None:
         _configure_gemini()
     return _gemini_model
+
+
+# --- Client dùng chung: rate limit + retry + giới hạn đồng thời cho mọi luồng chấm ---
+_llm_client = None
+
+def get_llm_client():
+    global _llm_client
+    if _llm_client is None:
+        if LLM_BACKEND == "fake":
+            backend = FakeBackend()
+        else:
+            context_cache = ContextCacheRegistry(GEMINI_MODEL_NAME) if LLM_CONTEXT_CACHE else None
+            backend = GeminiBackend(get_gemini_model, context_cache=context_cache, model_name=GEMINI_MODEL_NAME)
+        _llm_client = LLMClient(backend)
+    return _llm_client
+
+def set_llm_backend(backend):
+    """Thay backend (vd. FakeBackend khi test/benchmark offline)"""
+    global _llm_client
+    _llm_client = LLMClient(backend)
+    return _llm_client
+
 def clean_json_string(text):
     """
     Hàm làm sạch chuỗi JSON trả về từ LLM.
@@ -59,7 +96,12 @@ def clean_json_string(text):
     return text
 
 # --- Main Grading Function ---
-def grade_submission_with_llm(image_paths: list, rubric: str, final_context_text: str):
+def grade_submission_with_llm(image_paths: list, rubric: str, final_context_text: str,
+                              use_cache: bool = True):
+    """
+    image_paths: list đường dẫn ảnh sạch hoặc ảnh numpy đã có sẵn trong RAM
+    use_cache=False: bỏ qua cache kết quả, luôn gọi Gemini
+    """
     
     print("\n--- 4. START GRADING WITH LLM ---")
     
@@ -74,20 +116,22 @@ def grade_submission_with_llm(image_paths: list, rubric: str, final_context_text
         }
 
     try:
-        # Lấy model Gemini (sẽ được khởi tạo nếu chưa có)
-        model = get_gemini_model()
-
         image_parts = []
-        for path in image_paths:
+        for idx, path in enumerate(image_paths):
             try:
-                if os.path.exists(path):
+                if isinstance(path, np.ndarray):
+                    # Ảnh sạch trong RAM (grayscale, hoặc BGR nếu là ảnh màu)
+                    arr = path if path.ndim == 2 else np.ascontiguousarray(path[:, :, ::-1])
+                    image_parts.append(PIL.Image.fromarray(arr))
+                    print(f"✅ Loaded image for Vision: page {idx + 1} (in-memory)")
+                elif os.path.exists(path):
                     img = PIL.Image.open(path)
                     image_parts.append(img)
                     print(f"✅ Loaded image for Vision: {os.path.basename(path)}")
                 else:
                     print(f"⚠️ Image path not found: {path}")
             except Exception as e:
-                print(f"⚠️ Error loading image {path}: {e}")
+                print(f"⚠️ Error loading image {idx + 1}: {e}")
 
         if not image_parts:
             return {
@@ -97,37 +141,47 @@ def grade_submission_with_llm(image_paths: list, rubric: str, final_context_text
                 "details": {}
             }
 
-        # Điền thông tin vào prompt template
-        final_prompt = prompt_template.format(
-            rubric=rubric,
-            recognized_text=final_context_text
-        )
+        # Prefix cố định cho cả bài tập (hướng dẫn + rubric) và phần riêng của học sinh
+        instruction_prefix = instruction_template.format(rubric=rubric)
+        student_prompt = student_template.format(recognized_text=final_context_text)
+
+        # Thu nhỏ / encode lại ảnh (PNG 1-bit cho ảnh đã nhị phân hoá) cho vừa payload budget
+        vision_parts, vision_bytes = prepare_vision_parts(image_parts)
 
         # 4. Gửi Request Đa phương thức (Multimodal: Text Prompt + Images)
-        # Gemini nhận input là một list [Prompt_Text, Image1, Image2, ...]
-        input_content = [final_prompt] + image_parts
+        # Gemini nhận input là [Prefix, Student_Text, Image1, Image2, ...]; prefix được client
+        # gửi qua context cache (nếu có) nên ở đây chỉ còn phần thay đổi theo học sinh
+        input_content = [student_prompt] + vision_parts
 
-        print("Sending VISION request (Text + Images) to Google API...")
+        # Client dùng chung (model Gemini sẽ được khởi tạo khi gửi request đầu tiên)
+        client = get_llm_client()
 
-        safety_settings = {
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-        }
-
-        # Cấu hình để yêu cầu LLM trả về đúng định dạng JSON
-        generation_config = genai.GenerationConfig(
-            response_mime_type="application/json",
-            temperature=0.1# Giảm sáng tạo để kết quả ổn định
+        # Cùng model + cùng prompt + cùng ảnh + cùng config -> dùng lại kết quả đã chấm
+        cache_key = llm_cache_key(
+            instruction_prefix + student_prompt,
+            [part["data"] for part in vision_parts],
+            {"model": client.backend.model_name, **GENERATION_CONFIG},
         )
+        if use_cache:
+            cached = get_cached_result(cache_key)
+            if cached is not None:
+                print("✅ LLM cache hit, reuse previous grading result.")
+                return cached
+
+        print("Sending VISION request (Text + Images) to Google API...")
 
         print("Sending score request to Google API...")
-        # Gọi API và lấy kết quả
-        response = model.generate_content(
-            input_content,
-            generation_config=generation_config
-        )
+        record_bytes("llm_image", vision_bytes)
+        record_bytes("llm_prompt", len((instruction_prefix + student_prompt).encode("utf-8")))
+        # Gọi API (qua rate limiter, tự retry khi gặp 429/5xx) và lấy kết quả
+        with timed("llm_request"):
+            # Config dạng dict: backend Gemini tự đổi sang GenerationConfig của SDK,
+            # backend fake chạy offline không cần SDK
+            response = client.generate(
+                input_content,
+                generation_config=GENERATION_CONFIG,
+                prefix=instruction_prefix
+            )
 
         # Trích xuất nội dung text từ response một cách an toàn
         import traceback as _tb
@@ -158,9 +212,12 @@ def grade_submission_with_llm(image_paths: list, rubric: str, final_context_text
 
             print("✅Get JSON response from API.")
             # Parse chuỗi JSON thành dictionary của Python
-            cleaned_json = clean_json_string(response_text)
-            grading_result = json.loads(cleaned_json)
+            with timed("llm_parse"):
+                cleaned_json = clean_json_string(response_text)
+                grading_result = json.loads(cleaned_json)
             print("✅ JSON parsed successfully.")
+            # Chỉ lưu cache khi đã parse JSON thành công
+            store_result(cache_key, grading_result)
             return grading_result
         except Exception as e:
             print(f"🛑 Failed to extract/parse JSON from LLM response: {e}")
@@ -184,11 +241,12 @@ def grade_submission_with_llm(image_paths: list, rubric: str, final_context_text
             "details": {}
         }
 
-def grade_multiple_submissions_parallel(submissions, max_workers=5):
+def grade_multiple_submissions_parallel(submissions, max_workers=5, use_cache=True):
     """
     Chấm nhiều bài song song bằng Gemini (ThreadPoolExecutor)
     submissions: List tuple (image_paths, rubric, final_context_text)
     max_workers: số luồng xử lý song song
+    use_cache=False: bỏ qua cache kết quả LLM
     """
 
     results = [None] * len(submissions)
@@ -197,7 +255,7 @@ def grade_multiple_submissions_parallel(submissions, max_workers=5):
 
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         future_to_index = {
-            executor.submit(grade_submission_with_llm, imgs, rub, txt): i
+            executor.submit(bind(grade_submission_with_llm), imgs, rub, txt, use_cache): i
             for i, (imgs, rub, txt) in enumerate(submissions)
         }
 
@@ -2,194 +2,446 @@ import sys
 import json
 import io
 import os
-import shutil
-import requests
+import time
 import uuid
-from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
 # --- QUAN TRỌNG: Load .env TRƯỚC KHI import các module khác ---
 # Vì cloudinary_uploader dùng os.getenv ngay khi import
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
+# --stream: stdout chỉ chứa event JSON-lines, phải tách kênh TRƯỚC khi import OCR/YOLO
+# (print của thư viện đi sang stderr)
+_event_channel = None
+if __name__ == "__main__" and "--stream" in sys.argv:
+    from stdio_channel import open_protocol_channel
+    _event_channel = open_protocol_channel()
+
 # Import các module custom của bạn
-from img_parallel import clean_images_parallel
+from img_parallel import clean_arrays_parallel
+from img_preprocessing import get_profile, profile_cache_version
+from ocr_processor import OCR_BATCHED, ocr_cache_version
+from stage_cache import CACHE_ENABLED, get_stage_cache, run_cached, config_version
 from ocr_batch_processor import ocr_batch_parallel
+from ocr_regions import get_ocr_mode, region_cache_version, ocr_by_regions
 from llm_processor import grade_multiple_submissions_parallel
-from mcq_grader import MCQGrader
-from cloudinary_uploader import upload_cleaned_image
-
-# Thiết lập encoding cho luồng IO
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
-
-# Cấu hình thư mục tạm
-RUN_ID = uuid.uuid4().hex
-TEMP_RAW_DIR = os.path.join("uploads", "temp", "raw", RUN_ID)
-TEMP_CLEAN_DIR = os.path.join("uploads", "temp", "cleaned", RUN_ID)
-
-os.makedirs(TEMP_RAW_DIR, exist_ok=True)
-os.makedirs(TEMP_CLEAN_DIR, exist_ok=True)
+from mcq_grader import get_mcq_grader
+from cloudinary_uploader import BackgroundUploader
+from page_image import PageImage
+from downloader import download_images
+from metrics import job_metrics, record_bytes, record_image, record_stage
+from debug_writer import job_debug_dir
+from resource_planner import configure_resources, get_resource_plan
+from executor_manager import get_executor_manager, ocr_stage, shutdown_executors
 
 def log(message):
     sys.stderr.write(f"{message}\n")
     sys.stderr.flush()
 
-def download_image(src, save_path):
-    """Tải ảnh từ URL hoặc copy từ local path"""
-    if src.startswith("http://") or src.startswith("https://"):
-        r = requests.get(src, timeout=30)
-        r.raise_for_status()
-        with open(save_path, "wb") as f:
-            f.write(r.content)
-    elif os.path.exists(src):
-        shutil.copyfile(src, save_path)
-    else:
-        raise ValueError(f"Invalid image source: {src}")
+def parse_urls(urls):
+    """Chuẩn hoá danh sách ảnh: nhận chuỗi "a,b,c" (CLI) hoặc list (worker)"""
+    if isinstance(urls, str):
+        urls = urls.split(",")
+    return [u.strip() for u in urls if u and u.strip()]
 
-def main():
-    if len(sys.argv) != 3:
-        print(json.dumps({"error": "Usage: python main_processor.py <urls> <rubric>"}))
-        sys.exit(1)
 
-    # Split and strip URLs to avoid whitespace issues
-    raw_urls = [u.strip() for u in sys.argv[1].split(",") if u.strip()]
-    rubric = sys.argv[2]
+def build_error_result(e):
+    """Cấu trúc lỗi thống nhất mà phía Node đang đọc"""
+    return {
+        "score": 0,
+        "comment": f"System Error: {str(e)}",
+        "feasibility": False,
+        "details": {},
+        "cleanedUrls": []
+    }
+
+
+def download_pages(raw_urls):
+    """BƯỚC 1: DOWNLOAD (song song, session dùng chung) & DECODE. RETURN: list PageImage"""
+    downloaded_pages = []
+    for i, (url, data) in enumerate(zip(raw_urls, download_images(raw_urls))):
+        if data is None:
+            continue
+        page = PageImage(i, url, data)
+        record_bytes("download", len(data))
+        if page.decode() is None:
+            log(f"Error processing image {url}: Cannot decode image")
+            continue
+        record_image(page.raw.shape[1], page.raw.shape[0], len(data))
+        downloaded_pages.append(page)
+    if not downloaded_pages:
+        raise Exception("No valid images were downloaded.")
+    return downloaded_pages
+
+
+def pool_size(max_workers, n_items, planned):
+    """max_workers=None -> số worker theo resource plan; không mở nhiều process hơn số việc"""
+    workers = planned if max_workers is None else max_workers
+    return min(workers, n_items) if workers else 0
+
+
+def clean_pages(downloaded_pages, profile, cache, max_workers=None, executor=None):
+    """
+    BƯỚC 2: LÀM SẠCH ẢNH SONG SONG.
+    Trang đã từng xử lý (cùng bytes ảnh + cùng cấu hình) lấy thẳng từ cache.
+    max_workers=None: theo resource plan (clean_workers)
+    RETURN: list PageImage đã có .cleaned và .clean_transform (bỏ trang lỗi)
+    """
+    version = profile_cache_version(profile)
+    keys = [p.digest for p in downloaded_pages]
+    transforms = {}
+
+    def compute(todo):
+        results = clean_arrays_parallel(
+            [p.raw for p in todo], profile=profile,
+            max_workers=pool_size(max_workers, len(todo), get_resource_plan().clean_workers),
+            executor=executor, return_transform=True,
+        )
+        for page, (_, transform) in zip(todo, results):
+            transforms[page.digest] = transform
+        return [cleaned for cleaned, _ in results]
+
+    cleaned_result = run_cached(cache, "clean", version, keys, downloaded_pages, compute, kind="image")
+    # Ma trận gốc -> sạch (cho OCR theo vùng) lưu cache riêng, cạnh ảnh sạch
+    transform_result = run_cached(
+        cache, "clean_transform", version, keys, downloaded_pages,
+        lambda todo: [transforms.get(p.digest) for p in todo],
+    )
+    pages = []
+    for page, cleaned, transform in zip(downloaded_pages, cleaned_result, transform_result):
+        if cleaned is not None:
+            page.cleaned = cleaned
+            page.clean_transform = transform
+            pages.append(page)
+
+    if not pages:
+        raise Exception("No images could be cleaned.")
+    return pages
+
+
+def ocr_pages(pages, profile, cache, max_workers=None, executor=None, mode="full", layout_version=None,
+              batched=False, chunks=1):
+    """
+    BƯỚC 4: CHẠY OCR (Trên ảnh Cleaned). RETURN: list kết quả OCR theo trang
+    mode="regions": chỉ OCR các khối chữ ngoài vùng trắc nghiệm, cần mcq_pages(..., with_layout=True)
+    chạy trước; layout_version = mcq_grader.cache_version() (bố cục đổi -> kết quả OCR đổi)
+    batched=True: detection từng trang, recognition gom dòng chữ của mọi trang thành lô lớn
+    max_workers=None: theo resource plan (ocr_workers), 0 = OCR trong process hiện tại
+    executor: pool OCR dùng chung (ExecutorManager), khi đó bỏ qua max_workers;
+    chunks: số task batched mỗi lần gọi trên executor đó
+    """
+    planned = get_resource_plan().ocr_workers
+    version = config_version(profile_cache_version(profile), ocr_cache_version(batched))
+    if mode == "regions":
+        return run_cached(
+            cache, "ocr", config_version(version, region_cache_version(), layout_version),
+            [p.digest for p in pages],
+            pages,
+            lambda todo: ocr_by_regions(
+                todo,
+                lambda imgs: ocr_batch_parallel(
+                    imgs, max_workers=pool_size(max_workers, len(imgs), planned), executor=executor,
+                    resize=False, batched=batched, chunks=chunks,
+                ),
+            ),
+            store_if=lambda v: isinstance(v, list),
+        )
+    return run_cached(
+        cache, "ocr", version,
+        [p.digest for p in pages],
+        [p.cleaned for p in pages],
+        lambda imgs: ocr_batch_parallel(
+            imgs, max_workers=pool_size(max_workers, len(imgs), planned), executor=executor,
+            batched=batched, chunks=chunks,
+        ),
+        store_if=lambda v: isinstance(v, list),
+    )
+
+
+def mcq_pages(pages, cache, mcq_grader, debug_dir=None, with_layout=False):
+    """
+    Chấm trắc nghiệm tất cả các trang (ảnh RAW) trong 1 lần predict theo lô.
+    debug_dir: có giá trị thì ghi ảnh debug (luồng nền) vào thư mục này
+    with_layout=True: lưu thêm bố cục trang vào page.layout (cho OCR theo vùng)
+    RETURN: list kết quả trắc nghiệm theo trang
+    """
+    version = mcq_grader.cache_version()
+    results = run_cached(
+        cache, "mcq", config_version(version, "layout", mcq_grader.LAYOUT_VERSION) if with_layout else version,
+        [p.digest for p in pages],
+        pages,
+        lambda todo: mcq_grader.process_images(
+            [p.raw for p in todo],
+            save_debug=debug_dir is not None,
+            debug_paths=[os.path.join(debug_dir, f"{p.index}_debug.jpg") if debug_dir else None for p in todo],
+            with_layout=with_layout,
+        ),
+    )
+    if not with_layout:
+        return results
+    for page, result in zip(pages, results):
+        page.layout = result["layout"]
+    return [result["answers"] for result in results]
+
+
+def combine_mcq_results(pages, mcq_page_results):
+    """Ghép kết quả trắc nghiệm của các trang theo số câu toàn cục. RETURN: dict {số câu: kết quả}"""
+    combined_mcq_results = {}
+    question_offset = 0
+
+    for i, page in enumerate(pages):
+        # Kết quả Trắc nghiệm của trang (đã chấm theo lô trên ảnh RAW)
+        page_mcq_results = mcq_page_results[i]
+
+        # Mapping kết quả MCQ sang số câu toàn cục
+        if page_mcq_results:
+            current_page_max_q = 0
+
+            for local_q_num, data in page_mcq_results.items():
+                val = int(local_q_num)
+                if val > current_page_max_q:
+                    current_page_max_q = val
+
+                # Tính số thứ tự câu hỏi toàn cục (Global Question Number)
+                global_q_num = str(question_offset + val)
+                combined_mcq_results[global_q_num] = data
+
+            # Cập nhật offset dựa trên số câu lớn nhất tìm thấy, tránh lỗi khi YOLO bị miss câu
+            question_offset += current_page_max_q
+        else:
+            log(f"MCQ Info: No circles found on page {i+1} ({page.source})")
+    return combined_mcq_results
+
+
+def build_llm_context(pages, ocr_results_rich, mcq_page_results, mcq_grader):
+    """
+    BƯỚC 5: Ghép kết quả OCR + MCQ của các trang thành context text cho LLM.
+    RETURN: (final_context, combined_mcq_results theo số câu toàn cục)
+    """
+    full_ocr_text_context = ""
+
+    for i, page in enumerate(pages):
+        # Lấy data OCR của trang tương ứng
+        page_ocr_data = ocr_results_rich[i]
+
+        # A. Xử lý OCR Data (Defensive Programming)
+        processed_page_ocr_data = []
+        if isinstance(page_ocr_data, list):
+            for item in page_ocr_data:
+                if isinstance(item, dict):
+                    processed_page_ocr_data.append(item)
+
+        # B. Tạo Context Text cho LLM
+        page_text_lines = [item.get('text', '') for item in processed_page_ocr_data]
+        page_text_str = "\n".join(page_text_lines)
+        full_ocr_text_context += f"\n--- Page {i+1} Content ---\n{page_text_str}\n"
+
+    combined_mcq_results = combine_mcq_results(pages, mcq_page_results)
+
+    # --- TỔNG HỢP KẾT QUẢ ---
+    mcq_text_block = mcq_grader.format_for_llm(combined_mcq_results)
+    log(f"\n=== CHI TIẾT KẾT QUẢ TRẮC NGHIỆM ===\n{mcq_text_block}\n======================================\n")
+
+    # Context bao gồm cả kết quả trắc nghiệm và text OCR
+    final_context = f"{mcq_text_block}\n\n=== OCR RAW TEXT ===\n{full_ocr_text_context}"
+
+    log(f"Context length sent to LLM: {len(final_context)} chars")
+    if len(final_context) < 10:
+        log("WARNING: Context quá ngắn, có thể OCR/YOLO không tìm thấy gì!")
+    return final_context, combined_mcq_results
+
+
+def resolve_options(options):
+    """RETURN: (options, profile, cache) theo tuỳ chọn của job"""
+    options = options or {}
+    profile, _ = get_profile(options.get("profile"))
+    # options["cache"]=False: bỏ qua cache, chạy lại toàn bộ các stage
+    cache = get_stage_cache() if CACHE_ENABLED and options.get("cache", True) else None
+    return options, profile, cache
 
-    download_raw_paths = []
 
-    # Danh sách quản lý đường dẫn
-    raw_local = []      # Đường dẫn ảnh gốc (cho MCQ Grader)
-    cleaned_local = []  # Đường dẫn ảnh sạch (cho OCR/LLM)
-    cleaned_cloud = []  # URL ảnh sạch trên Cloudinary (trả về FE)
+class StageClock:
+    """Đo thời gian (wall + CPU) từng stage, ghi vào metrics và báo event "stage" (nếu có on_event)"""
+
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self.last = time.perf_counter()
+        self.last_cpu = time.thread_time()
+
+    def done(self, stage, **data):
+        now, now_cpu = time.perf_counter(), time.thread_time()
+        record_stage(stage, now - self.last, now_cpu - self.last_cpu)
+        ms = round((now - self.last) * 1000, 1)
+        self.last, self.last_cpu = now, now_cpu
+        if self.on_event is not None:
+            self.on_event("stage", stage=stage, ms=ms, data=data)
+        return ms
+
+
+def process_submission(raw_urls, rubric, options=None, mcq_grader=None, ocr_workers=None,
+                       on_event=None, executors=None, one_shot=False):
+    """
+    Chấm một bài nộp: download -> clean -> upload -> OCR -> MCQ -> LLM.
+    Dùng chung cho CLI (main) và worker chạy lâu dài (grading_worker).
+    - mcq_grader: truyền grader đã load sẵn để khỏi load lại YOLO
+    - ocr_workers=0: chạy OCR ngay trong process hiện tại (engine đã warm),
+      None: OCR trên pool "ocr" / "ocr_batched" của executors
+    - executors: ExecutorManager giữ pool clean / OCR giữa các bài nộp,
+      None: manager dùng chung của process (get_executor_manager)
+    - one_shot=True: chấm một bài rồi thoát (CLI), pool OCR chỉ mở min(số ảnh, plan) worker;
+      False: pool dùng lâu cho nhiều bài, warm đủ số worker theo plan
+    - options["profile"]: profile làm sạch ảnh ("fast" / "balanced" / "max-quality")
+    - options["cache"] / options["llm_cache"] = False: bỏ qua cache stage / cache kết quả LLM
+    - on_event(event, **fields): nhận event "stage" sau mỗi stage (thời gian + dữ liệu từng phần,
+      vd. đáp án trắc nghiệm trước khi LLM chấm xong)
+    RETURN: dict kết quả (score, comment, feasibility, details, cleanedUrls, timings)
+    """
+    run_id = uuid.uuid4().hex
+    # Số liệu thời gian / dung lượng của job (khối "timings"), PROFILE_DIR: dump cProfile
+    with job_metrics(run_id) as job:
+        result = _process_submission(
+            run_id, raw_urls, rubric, options, mcq_grader, ocr_workers, on_event,
+            executors or get_executor_manager(), one_shot,
+        )
+        return {**result, "timings": job.summary()}
+
+
+def _process_submission(run_id, raw_urls, rubric, options, mcq_grader, ocr_workers, on_event, executors,
+                        one_shot):
+    options, profile, cache = resolve_options(options)
+    ocr_mode = get_ocr_mode(options.get("ocr_mode"))
+    ocr_batched = options.get("ocr_batched", OCR_BATCHED)
+    ocr_pool = ocr_stage(ocr_batched)
+    clock = StageClock(on_event)
+
+    ocr_executor, ocr_chunks = None, 1
+    if ocr_workers != 0:
+        # Không mở nhiều process OCR hơn số ảnh (số trang chỉ có thể ít hơn khi download lỗi);
+        # khởi động worker ngay: PaddleOCR load trong lúc download / clean
+        ocr_chunks = pool_size(None, len(raw_urls), executors.workers(ocr_pool))
+        ocr_executor = executors.warm(ocr_pool, ocr_chunks if one_shot else None)
+
+    # Ảnh đi qua pipeline ở dạng mảng trong RAM, không cần thư mục tạm;
+    # ảnh debug MCQ chỉ ghi khi job bật options["debug"] (hoặc MCQ_DEBUG=1)
+    debug_dir = job_debug_dir(options, run_id)
+
+    uploader = None     # Upload ảnh sạch lên Cloudinary ở luồng nền
 
     try:
-        # --- BƯỚC 1: DOWNLOAD & CLEAN ---
-        for i, url in enumerate(raw_urls):
-            # 1.1 Download RAW
-            raw_path = os.path.join(TEMP_RAW_DIR, f"{i}.jpg")
-            try:
-                download_image(url, raw_path)
-                download_raw_paths.append(raw_path)
-            except Exception as e:
-                log(f"Error processing image {url}: {e}")
-        if not download_raw_paths:
-            raise Exception("No valid images were downloaded.")
-        
+        # --- BƯỚC 1: DOWNLOAD & DECODE ---
+        downloaded_pages = download_pages(raw_urls)
+        clock.done("download", pages=len(downloaded_pages))
+
         # --- BƯỚC 2. LÀM SẠCH ẢNH SONG SONG ---
-        cleaned_result = clean_images_parallel(download_raw_paths, max_workers=1)
-        if not cleaned_result:
-            raise Exception("No images could be cleaned.")
-        
-        for orig, clean in cleaned_result:
-            raw_local.append(orig)
-            cleaned_local.append(clean)
-
-        if not cleaned_local:
-            raise Exception("No images could be processed.")
-
-        # --- BƯỚC 3: UPLOAD CLEANED TO CLOUDINARY 
-        for img in cleaned_local:
-            try:
-                url = upload_cleaned_image(img, "processed_batch")
-                cleaned_cloud.append(url)
-            except Exception as e: 
-                log(f"Cloudinary upload failed for {img}: {e}")
-                cleaned_cloud.append(None) 
+        log(f"Preprocessing profile: {profile}")
+        pages = clean_pages(downloaded_pages, profile, cache, executor=executors.get("clean"))
+        clock.done("clean", pages=len(pages), profile=profile)
+
+        # --- BƯỚC 3: UPLOAD CLEANED TO CLOUDINARY (chạy nền, song song với OCR/MCQ/LLM)
+        uploader = BackgroundUploader("processed_batch")
+        for page in pages:
+            uploader.submit(page)
+
+        if mcq_grader is None:
+            mcq_grader = get_mcq_grader()
+        if ocr_mode == "regions":
+            # OCR theo vùng cần bố cục trắc nghiệm -> chạy MCQ trước OCR
+            mcq_page_results = mcq_pages(pages, cache, mcq_grader, debug_dir, with_layout=True)
+            clock.done("mcq", answers=combine_mcq_results(pages, mcq_page_results))
 
         # --- BƯỚC 4: CHẠY OCR (Trên ảnh Cleaned) ---
-        ocr_results_rich = ocr_batch_parallel(cleaned_local, max_workers=1)
+        ocr_results_rich = ocr_pages(
+            pages, profile, cache, max_workers=ocr_workers, executor=ocr_executor,
+            mode=ocr_mode, layout_version=mcq_grader.cache_version(),
+            batched=ocr_batched, chunks=ocr_chunks,
+        )
+        clock.done("ocr", lines=sum(len(r) for r in ocr_results_rich if isinstance(r, list)))
 
         # --- BƯỚC 5: XỬ LÝ LOGIC MCQ & CONTEXT (Từ Main 2) ---
-        mcq_grader = MCQGrader()
-        full_ocr_text_context = ""
-        combined_mcq_results = {}
-        question_offset = 0
-
-        for i, clean_path in enumerate(cleaned_local):
-            current_raw_path = raw_local[i]
-            
-            # Lấy data OCR của trang tương ứng
-            page_ocr_data = ocr_results_rich[i]
-
-            # A. Xử lý OCR Data (Defensive Programming)
-            processed_page_ocr_data = []
-            if isinstance(page_ocr_data, list):
-                for item in page_ocr_data:
-                    if isinstance(item, dict):
-                        processed_page_ocr_data.append(item)
-            
-            # B. Tạo Context Text cho LLM
-            page_text_lines = [item.get('text', '') for item in processed_page_ocr_data]
-            page_text_str = "\n".join(page_text_lines)
-            full_ocr_text_context += f"\n--- Page {i+1} Content ---\n{page_text_str}\n"
-
-            # C. Chấm Trắc nghiệm (Dùng ảnh RAW)
-            # Quan trọng: Truyền current_raw_path vào đây
-            page_mcq_results = mcq_grader.process_image(current_raw_path, save_debug=True)
-
-            # D. Mapping kết quả MCQ (Dùng page_ocr_data để map tọa độ nếu cần)
-            if page_mcq_results:
-                current_page_max_q = 0
-                
-                for local_q_num, data in page_mcq_results.items():
-                    val = int(local_q_num)
-                    if val > current_page_max_q:
-                        current_page_max_q = val
-                        
-                    # Tính số thứ tự câu hỏi toàn cục (Global Question Number)
-                    global_q_num = str(question_offset + val)
-                    combined_mcq_results[global_q_num] = data
-                
-                # Cập nhật offset dựa trên số câu lớn nhất tìm thấy, tránh lỗi khi YOLO bị miss câu
-                question_offset += current_page_max_q
-            else:
-                log(f"MCQ Info: No circles found on page {i+1} ({current_raw_path})")
-
-        # --- BƯỚC 5: TỔNG HỢP KẾT QUẢ ---
-        mcq_text_block = mcq_grader.format_for_llm(combined_mcq_results)
-        log(f"\n=== CHI TIẾT KẾT QUẢ TRẮC NGHIỆM ===\n{mcq_text_block}\n======================================\n")
+        if ocr_mode == "full":
+            mcq_page_results = mcq_pages(pages, cache, mcq_grader, debug_dir)
+        if cache is not None:
+            log(f"Stage cache: {cache.stats()}")
 
-        # --- BƯỚC 6: GỬI CHO LLM ---
-        # Context bao gồm cả kết quả trắc nghiệm và text OCR
-        final_context = f"{mcq_text_block}\n\n=== OCR RAW TEXT ===\n{full_ocr_text_context}"
-        
-        log(f"Context length sent to LLM: {len(final_context)} chars")
-        if len(final_context) < 10:
-            log("WARNING: Context quá ngắn, có thể OCR/YOLO không tìm thấy gì!")
+        final_context, mcq_answers = build_llm_context(pages, ocr_results_rich, mcq_page_results, mcq_grader)
+        if ocr_mode == "full":
+            clock.done("mcq", answers=mcq_answers)
 
+        # --- BƯỚC 6: GỬI CHO LLM ---
         # LLM sẽ nhìn vào ảnh clean (dễ đọc chữ) + context text
-        submission_payload = [(cleaned_local, rubric, final_context)]
-        
-        grading_result = grade_multiple_submissions_parallel(submission_payload, max_workers=1)[0]
+        submission_payload = [([p.cleaned for p in pages], rubric, final_context)]
+
+        grading_result = grade_multiple_submissions_parallel(
+            submission_payload, max_workers=1, use_cache=options.get("llm_cache", True)
+        )[0]
         log("Grading complete.")
+        clock.done("llm", score=grading_result.get("score"))
 
-        # --- BƯỚC 7: TRẢ VỀ JSON ---
-        print("<<<JSON_START>>>", flush=True)
-        print(json.dumps({
+        # Lấy URL ảnh sạch ngay trước khi trả kết quả
+        cleaned_cloud = uploader.collect()
+        clock.done("upload", cleanedUrls=cleaned_cloud)
+
+        return {
             **grading_result,
             "cleanedUrls": cleaned_cloud  # Thêm URLs từ Cloudinary (Yêu cầu Main 1)
-        }, ensure_ascii=False), flush=True)
-        print("<<<JSON_END>>>", flush=True)
-
-    except Exception as e:
-        log(f"An error occurred: {e}")
-        error_result = {
-            "score": 0,
-            "comment": f"System Error: {str(e)}",
-            "feasibility": False,
-            "details": {},
-            "cleanedUrls": []
         }
+
+    finally:
+        if uploader is not None:
+            uploader.close()
+
+
+def main():
+    args = [a for a in sys.argv[1:] if a != "--stream"]
+    events = None
+    if _event_channel is not None:
+        # --stream: mỗi stage một event NDJSON, cuối cùng event "result" (thay cho marker)
+        from stdio_channel import EventStream
+        events = EventStream(_event_channel)
+    else:
+        # Thiết lập encoding cho luồng IO
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
+
+    def finish(ok, result):
+        if events is not None:
+            events.emit("result", ok=ok, result=result)
+            return
+        # --- BƯỚC 7: TRẢ VỀ JSON ---
         print("<<<JSON_START>>>", flush=True)
-        print(json.dumps(error_result, ensure_ascii=False), flush=True)
+        print(json.dumps(result, ensure_ascii=False), flush=True)
         print("<<<JSON_END>>>", flush=True)
+
+    if len(args) not in (2, 3):
+        usage = "Usage: python main_processor.py [--stream] <urls> <rubric> [options_json]"
+        if events is not None:
+            events.emit("result", ok=False, result={"error": usage})
+        else:
+            print(json.dumps({"error": usage}))
         sys.exit(1)
 
+    # Chia CPU / RAM của container cho các stage (quota cgroup, override bằng env)
+    configure_resources("single")
+
+    # Split and strip URLs to avoid whitespace issues
+    raw_urls = parse_urls(args[0])
+    rubric = args[1]
+
+    try:
+        # Tuỳ chọn theo job, vd. '{"profile": "balanced"}'
+        options = json.loads(args[2]) if len(args) == 3 else {}
+        # Chấm một bài rồi thoát: pool OCR vừa đủ số ảnh của bài
+        result = process_submission(
+            raw_urls, rubric, options=options, on_event=events.emit if events else None, one_shot=True
+        )
+        finish(True, result)
+
+    except Exception as e:
+        log(f"An error occurred: {e}")
+        finish(False, build_error_result(e))
+        sys.exit(1)
     finally:
-        # Dọn dẹp thư mục tạm
-        shutil.rmtree(TEMP_RAW_DIR, ignore_errors=True)
-        shutil.rmtree(TEMP_CLEAN_DIR, ignore_errors=True)
+        shutdown_executors()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
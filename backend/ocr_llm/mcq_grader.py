@@ -1,11 +1,14 @@
 import os
 import re
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional
 
-import cv2
-from ultralytics import YOLO
 import numpy as np
 
+from page_image import load_image
+from stage_cache import config_version, hash_file
+from metrics import timed
+from debug_writer import get_debug_writer
+
 MODEL_ABCD_PATH = os.path.join(os.path.dirname(__file__), '..', 'models', 'ABCD_start.pt')
 MODEL_STRUCT_PATH = os.path.join(os.path.dirname(__file__), '..', 'models', 'cauhoi_circle.pt')
 
@@ -24,17 +27,96 @@ MAP_STRUCT = {
 }
 CONF_ABCD = 0.15
 CONF_STRUCT = 0.25
+IMG_SIZE = 1024
+# Số trang tối đa đưa vào một lần predict (giới hạn RAM khi chấm cả lớp)
+YOLO_BATCH_SIZE = int(os.getenv("YOLO_BATCH_SIZE", "8"))
+# "torch": ultralytics (.pt), "onnx": ONNX Runtime (.onnx export từ .pt, xem yolo_onnx.py)
+MCQ_BACKENDS = ("torch", "onnx")
+MCQ_BACKEND = os.getenv("MCQ_BACKEND", "torch")
+MCQ_ONNX_INT8 = os.getenv("MCQ_ONNX_INT8", "0") == "1"
+
+
+def intersection_areas(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Diện tích giao nhau của từng cặp bbox (giống MCQGrader.iou_area, tính một lần cho cả ma trận).
+    boxes_*: mảng int (N, 4) [x1, y1, x2, y2]. RETURN: mảng int64 (len(a), len(b))
+    """
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return np.zeros((len(boxes_a), len(boxes_b)), dtype=np.int64)
+    a = boxes_a.astype(np.int64)[:, None, :]
+    b = boxes_b.astype(np.int64)[None, :, :]
+    w = np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    h = np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    return np.where((w >= 0) & (h >= 0), w * h, 0)
+
+
+def cluster_rows(ys, row_th: float) -> List[List[int]]:
+    """
+    Gom các circle (đã sort theo y tăng dần) thành từng hàng.
+    Mỗi hàng neo theo circle đầu tiên; hàng mới chỉ được tạo khi circle cách neo cuối >= row_th,
+    nên các neo cách nhau >= row_th và circle sau chỉ có thể thuộc hàng cuối cùng
+    -> một lượt O(n) thay cho việc dò lại mọi hàng đã có.
+    RETURN: list các hàng, mỗi hàng là list chỉ số trong ys
+    """
+    rows: List[List[int]] = []
+    anchor = None
+    for i, y in enumerate(ys):
+        if rows and abs(anchor - y) < row_th:
+            rows[-1].append(i)
+        else:
+            rows.append([i])
+            anchor = y
+    return rows
+
+
+def model_paths(backend=MCQ_BACKEND, int8=MCQ_ONNX_INT8) -> Tuple[str, str]:
+    """File trọng số (ABCD, structure) của backend"""
+    if backend not in MCQ_BACKENDS:
+        raise ValueError(f"Unknown MCQ backend '{backend}', expected one of {list(MCQ_BACKENDS)}")
+    if backend == "onnx":
+        from yolo_onnx import onnx_path
+        return onnx_path(MODEL_ABCD_PATH, int8), onnx_path(MODEL_STRUCT_PATH, int8)
+    return MODEL_ABCD_PATH, MODEL_STRUCT_PATH
+
 
 class MCQGrader:
-    def __init__(self):
+    def __init__(self, backend: Optional[str] = None, int8: Optional[bool] = None):
         self.model_abcd = None
         self.model_struct = None
-        if os.path.exists(MODEL_ABCD_PATH) and os.path.exists(MODEL_STRUCT_PATH):
-            print(f"✅ Loading YOLO model from: {MODEL_ABCD_PATH} and {MODEL_STRUCT_PATH}")
-            self.model_abcd = YOLO(MODEL_ABCD_PATH) 
-            self.model_struct = YOLO(MODEL_STRUCT_PATH)
+        self._cache_version = None
+        self.backend = backend or MCQ_BACKEND
+        self.paths = model_paths(self.backend, MCQ_ONNX_INT8 if int8 is None else int8)
+        abcd_path, struct_path = self.paths
+        if os.path.exists(abcd_path) and os.path.exists(struct_path):
+            print(f"✅ Loading YOLO model ({self.backend}) from: {abcd_path} and {struct_path}")
+            from resource_planner import apply_thread_limits, get_resource_plan
+            threads = get_resource_plan().mcq_threads
+            if self.backend == "onnx":
+                # ONNX Runtime: không cần torch / ultralytics trong process
+                from yolo_onnx import OnnxYOLO
+                self.model_abcd = OnnxYOLO(abcd_path, threads)
+                self.model_struct = OnnxYOLO(struct_path, threads)
+            else:
+                # Import ultralytics (torch) chỉ khi khởi tạo grader
+                from ultralytics import YOLO
+                # torch vừa được load: giới hạn luồng theo plan của process chính
+                apply_thread_limits(threads)
+                self.model_abcd = YOLO(abcd_path)
+                self.model_struct = YOLO(struct_path)
         else:
-            print(f"⚠️ Warning: Model file not found at {MODEL_ABCD_PATH} or {MODEL_STRUCT_PATH}. Please check the path.")
+            print(f"⚠️ Warning: Model file not found at {abcd_path} or {struct_path}. Please check the path.")
+
+    # Đổi các trường của page_layout -> tăng để bố cục cũ trong stage_cache không còn dùng
+    LAYOUT_VERSION = 2
+
+    def cache_version(self) -> str:
+        """Version cho stage_cache: hash trọng số 2 model YOLO (.pt hoặc .onnx) + ngưỡng conf + imgsz"""
+        if self._cache_version is None:
+            weights = [hash_file(p) if os.path.exists(p) else None for p in self.paths]
+            self._cache_version = config_version(
+                "mcq", weights, CONF_ABCD, CONF_STRUCT, IMG_SIZE, MAP_ABCD, MAP_STRUCT
+            )
+        return self._cache_version
 
     @staticmethod
     def center(b):
@@ -47,24 +129,104 @@ class MCQGrader:
         if x2<x1 or y2<y1: return 0
         return (x2-x1)*(y2-y1)
 
-    def process_image(self, image_path: str, save_debug: bool = False) -> Dict[str, Any]:
+    def _predict_batch(self, model, images: List[np.ndarray], conf: float, name: str = "yolo") -> list:
+        """Chạy YOLO theo lô (tối đa YOLO_BATCH_SIZE ảnh / lần predict)"""
+        results = []
+        for start in range(0, len(images), YOLO_BATCH_SIZE):
+            chunk = images[start:start + YOLO_BATCH_SIZE]
+            with timed(name):
+                results.extend(model.predict(
+                    chunk, imgsz=IMG_SIZE, conf=conf, batch=len(chunk), verbose=False
+                ))
+        return results
+
+    def process_image(self, image, save_debug: bool = False,
+                      debug_path: Optional[str] = None) -> Dict[str, Any]:
+        return self.process_images(
+            [image], save_debug=save_debug, debug_paths=[debug_path]
+        )[0]
+
+    def process_images(self, images: list, save_debug: bool = False,
+                       debug_paths: Optional[List[Optional[str]]] = None,
+                       with_layout: bool = False) -> List[Dict[str, Any]]:
+        """
+        Chấm nhiều trang (của một hoặc nhiều bài) với 1 lần predict theo lô cho mỗi model.
+        images: list đường dẫn file hoặc ảnh BGR numpy đã decode
+        save_debug: vẽ đáp án lên ảnh và ghi file ở luồng nền (DebugWriter), không chặn kết quả
+        debug_paths: nơi ghi ảnh debug cho từng trang (mặc định: cạnh file ảnh gốc)
+        with_layout: mỗi trang trả {"answers": ..., "layout": page_layout} (cho OCR theo vùng)
+        RETURN: list kết quả theo đúng thứ tự images, giống hệt process_image từng trang
+        """
+        if debug_paths is None:
+            debug_paths = [None] * len(images)
+        debug_paths = [
+            dp if dp or isinstance(src, np.ndarray)
+            else src.replace(".jpg", "_debug.jpg").replace(".png", "_debug.png")
+            for src, dp in zip(images, debug_paths)
+        ]
         # Sử dụng imdecode để đọc được đường dẫn tiếng Việt/Unicode trên Windows
-        img_array = np.fromfile(image_path, np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-        if img is None:
-            return {}
+        images = [load_image(img) for img in images]
 
-        h, w = img.shape[:2]
+        valid_idx = [i for i, img in enumerate(images) if img is not None]
+        results: List[Dict[str, Any]] = [
+            {"answers": {}, "layout": None} if with_layout else {} for _ in images
+        ]
+        if not valid_idx:
+            return results
 
         # ==================== PREDICT ====================
-        res_abcd = self.model_abcd.predict(
-            image_path, imgsz=1024, conf=CONF_ABCD, verbose=False
-        )[0]
+        # Gom các trang cùng kích thước vào một lô: ultralytics chỉ letterbox
+        # kiểu "rect" (giống predict từng ảnh) khi cả lô cùng shape
+        groups: Dict[tuple, List[int]] = {}
+        for i in valid_idx:
+            groups.setdefault(images[i].shape, []).append(i)
+
+        for idx_list in groups.values():
+            # Truyền mảng đã decode để YOLO không phải đọc lại file
+            batch = [images[i] for i in idx_list]
+            res_abcd_list = self._predict_batch(self.model_abcd, batch, CONF_ABCD, "yolo_abcd")
+            res_struct_list = self._predict_batch(self.model_struct, batch, CONF_STRUCT, "yolo_struct")
+
+            for i, res_abcd, res_struct in zip(idx_list, res_abcd_list, res_struct_list):
+                detections = self._parse_detections(res_abcd, res_struct)
+                answers = self._grade_page(
+                    images[i], *detections, debug_paths[i] if save_debug else None
+                )
+                results[i] = (
+                    {
+                        "answers": answers,
+                        "layout": self.page_layout(
+                            images[i], *detections, anchored=self._has_objects(res_abcd)
+                        ),
+                    }
+                    if with_layout else answers
+                )
+        return results
 
-        res_struct = self.model_struct.predict(
-            image_path, imgsz=1024, conf=CONF_STRUCT, verbose=False
-        )[0]
+    @staticmethod
+    def page_layout(img: np.ndarray, options, circles, questions, mcq_start_y,
+                    anchored: bool = False) -> Dict[str, Any]:
+        """
+        Bố cục trang theo toạ độ ảnh RAW (lưu được vào cache JSON):
+        vùng trắc nghiệm bắt đầu từ mcq_start_y, các bbox circle / option A-D / cau_hoi.
+        anchored: model ABCD detect được 'objects' (mcq_start_y không phải giá trị fallback)
+        """
+        return {
+            "width": int(img.shape[1]),
+            "height": int(img.shape[0]),
+            "mcq_start_y": int(mcq_start_y),
+            "anchored": bool(anchored),
+            "circles": [c["bbox"] for c in circles],
+            "options": [o["bbox"] for o in options],
+            "questions": [q["bbox"] for q in questions],
+        }
 
+    @staticmethod
+    def _has_objects(res_abcd) -> bool:
+        return any(MAP_ABCD.get(int(row[5])) == 'objects' for row in res_abcd.boxes.data.tolist())
+
+    def _parse_detections(self, res_abcd, res_struct):
+        """RETURN: (options, circles trong vùng trắc nghiệm, questions, mcq_start_y)"""
         options, circles, questions = [], [], []
         mcq_start_y = None
 
@@ -105,58 +267,56 @@ class MCQGrader:
                 print("❌ Không detect được object / circle / cau_hoi")
         
         circles = [c for c in circles if c['center'][1] >= mcq_start_y]
+        return options, circles, questions, mcq_start_y
 
+    def _grade_page(self, img: np.ndarray, options, circles, questions, mcq_start_y,
+                    debug_path: Optional[str] = None) -> Dict[str, Any]:
         # =====================================================
         # STEP 1 — MAP CIRCLE ↔ OPTION (MAX IOU)
         # =====================================================
-        for c in circles:
-            best_opt, best_area = None, 0
-            for o in options:
-                area = self.iou_area(c["bbox"], o["bbox"])
-                if area > best_area:
-                    best_area = area
-                    best_opt = o
-
-            if best_opt and best_area > 0.1 * (
-                (best_opt["bbox"][2] - best_opt["bbox"][0]) *
-                (best_opt["bbox"][3] - best_opt["bbox"][1])
-            ):
-                best_opt["selected"] = True
-                c["mapped"] = True
+        # Ma trận diện tích giao (circle × option) tính một lần, dùng lại ở STEP 3
+        circle_boxes = np.array([c["bbox"] for c in circles], dtype=np.int64).reshape(-1, 4)
+        option_boxes = np.array([o["bbox"] for o in options], dtype=np.int64).reshape(-1, 4)
+        areas = intersection_areas(circle_boxes, option_boxes)
+
+        if areas.size:
+            # argmax lấy option đầu tiên có diện tích lớn nhất (giống so sánh ">" tuần tự)
+            best = areas.argmax(axis=1)
+            best_area = areas[np.arange(len(circles)), best]
+            opt_area = (option_boxes[:, 2] - option_boxes[:, 0]) * (option_boxes[:, 3] - option_boxes[:, 1])
+            for ci in np.flatnonzero((best_area > 0) & (best_area > 0.1 * opt_area[best])):
+                options[best[ci]]["selected"] = True
+                circles[ci]["mapped"] = True
 
         # =====================================================
         # STEP 2 — GROUP CIRCLES BY ROW (CORE FIX)
         # =====================================================
-        circles.sort(key=lambda c: c["center"][1])
+        order = sorted(range(len(circles)), key=lambda i: circles[i]["center"][1])
         avg_h = np.mean(
             [c["bbox"][3] - c["bbox"][1] for c in circles]
         ) if circles else 80
 
         ROW_TH = avg_h * 1.4
-        rows: List[List[dict]] = []
-
-        for c in circles:
-            placed = False
-            for r in rows:
-                if abs(r[0]["center"][1] - c["center"][1]) < ROW_TH:
-                    r.append(c)
-                    placed = True
-                    break
-            if not placed:
-                rows.append([c])
+        row_indices = [
+            [order[k] for k in row]
+            for row in cluster_rows([circles[i]["center"][1] for i in order], ROW_TH)
+        ]
+        rows: List[List[dict]] = [[circles[i] for i in row] for row in row_indices]
 
         # =====================================================
         # STEP 3 — ANSWER INFERENCE PER ROW
         # =====================================================
         results = {}
+        debug_marks = []
+        selected = np.array([o["selected"] for o in options], dtype=bool)
+        # overlaps[i, j]: circle i chạm option j đã được chọn
+        overlaps = (areas > 0) & selected[None, :] if areas.size else areas.astype(bool)
 
-        for q_idx, row in enumerate(rows, start=1):
+        for q_idx, (row, idx) in enumerate(zip(rows, row_indices), start=1):
 
-            row_opts = []
-            for c in row:
-                for o in options:
-                    if o["selected"] and self.iou_area(o["bbox"], c["bbox"]) > 0:
-                        row_opts.append(o)
+            # Giữ đúng thứ tự (circle trong hàng, rồi option) như vòng lặp lồng nhau cũ
+            _, opt_idx = np.nonzero(overlaps[idx])
+            row_opts = [options[j] for j in opt_idx]
 
             row_opts.sort(key=lambda o: o["center"][0])
             detected_labels = [o["label"] for o in row_opts]
@@ -186,17 +346,16 @@ class MCQGrader:
                 "status": status
             }
 
-            # Debug text
-            cv2.putText(
-                img, str(final) if final else "_",
-                (row[0]["bbox"][0], row[0]["bbox"][1] - 5),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 120, 0), 2
-            )
+            # Debug text: chỉ ghi lại nhãn + vị trí, writer nền vẽ lên bản sao của ảnh
+            if debug_path:
+                debug_marks.append((
+                    str(final) if final else "_",
+                    (row[0]["bbox"][0], row[0]["bbox"][1] - 5),
+                ))
 
-        # ==================== SAVE DEBUG ====================
-        if save_debug:
-            out = image_path.replace(".jpg", "_debug.jpg").replace(".png", "_debug.png")
-            cv2.imwrite(out, img)
+        # ==================== SAVE DEBUG (luồng nền) ====================
+        if debug_path:
+            get_debug_writer().submit(debug_path, img, debug_marks)
 
         return results
 
@@ -212,4 +371,14 @@ class MCQGrader:
             ans_str = ",".join(info['answer']) if isinstance(info['answer'], list) else info['answer']
             lines.append(f"Câu {k}: {ans_str} ({info['status']})")
 
-        return "\n".join(lines)
\ No newline at end of file
+        return "\n".join(lines)
+
+
+# --- Singleton: giữ YOLO đã load cho các lần chấm tiếp theo (worker mode) ---
+_mcq_grader = None
+
+def get_mcq_grader():
+    global _mcq_grader
+    if _mcq_grader is None:
+        _mcq_grader = MCQGrader()
+    return _mcq_grader
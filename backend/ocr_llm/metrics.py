@@ -0,0 +1,274 @@
+"""
+Đo thời gian (wall + CPU) từng stage của pipeline chấm bài.
+
+- REGISTRY: counter / histogram dùng chung cho cả process, xuất dạng Prometheus text
+  (ghi ra METRICS_TEXTFILE sau mỗi job và định kỳ mỗi METRICS_TEXTFILE_INTERVAL giây trong
+  worker mode, Node / textfile collector đọc file đó; hoặc op "metrics" của grading_worker)
+- job_metrics(): gom số liệu của MỘT job -> khối "timings" trong result JSON
+- PROFILE_DIR=<thư mục>: bật cProfile cho từng job, dump <job_id>.prof
+  (xem bằng snakeviz / pstats; muốn flamegraph cả process thì py-spy record --pid <pid>)
+
+CPU time là time.thread_time() của luồng chạy stage; phần việc chạy trong process pool
+(clean / OCR nhiều worker) chỉ được tính wall time ở phía process cha.
+"""
+import contextlib
+import contextvars
+import cProfile
+import functools
+import os
+import sys
+import threading
+import time
+
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE")
+METRICS_TEXTFILE_INTERVAL = float(os.getenv("METRICS_TEXTFILE_INTERVAL", "15"))
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+PIXEL_BUCKETS = (0.25e6, 0.5e6, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6)
+
+HELP = {
+    "grading_stage_wall_seconds": "Wall time per pipeline stage",
+    "grading_stage_cpu_seconds_total": "CPU time (thread) spent per pipeline stage",
+    "grading_bytes_total": "Bytes moved per kind (download, upload, llm_image, llm_prompt)",
+    "grading_image_pixels": "Input page size in pixels",
+    "grading_job_seconds": "End-to-end wall time per grading job",
+    "grading_jobs_total": "Grading jobs by status",
+    "grading_debug_images_total": "MCQ debug images by status (written, dropped, error)",
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _labels(labels, extra=None):
+    items = sorted(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> Histogram
+
+    def inc(self, name, value=1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines, typed = [], set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                header(name, "counter")
+                lines.append(f"{name}{_labels(labels)} {value:g}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                header(name, "histogram")
+                # counts đã là luỹ kế (observe tăng mọi bucket có bound >= value)
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f"{name}_bucket{_labels(labels, ('le', f'{bound:g}'))} {count}")
+                lines.append(f"{name}_bucket{_labels(labels, ('le', '+Inf'))} {hist.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {hist.sum:g}")
+                lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class JobMetrics:
+    """Số liệu của một job chấm bài (khối "timings" trong result JSON)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.bytes = {}
+        self.images = []
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, wall, cpu):
+        with self._lock:
+            s = self.stages.setdefault(stage, {"wall_ms": 0.0, "cpu_ms": 0.0, "count": 0})
+            s["wall_ms"] += wall * 1000
+            s["cpu_ms"] += cpu * 1000
+            s["count"] += 1
+
+    def add_bytes(self, kind, n):
+        with self._lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + n
+
+    def add_image(self, width, height, nbytes):
+        with self._lock:
+            self.images.append({"width": width, "height": height, "bytes": nbytes})
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        with self._lock:
+            return {
+                "total_ms": round(self.elapsed() * 1000, 1),
+                "stages": {
+                    stage: {"wall_ms": round(s["wall_ms"], 1), "cpu_ms": round(s["cpu_ms"], 1), "count": s["count"]}
+                    for stage, s in self.stages.items()
+                },
+                "bytes": dict(self.bytes),
+                "images": list(self.images),
+            }
+
+
+_current_job = contextvars.ContextVar("grading_job", default=None)
+
+
+def record_stage(stage, wall, cpu):
+    REGISTRY.observe("grading_stage_wall_seconds", wall, stage=stage)
+    REGISTRY.inc("grading_stage_cpu_seconds_total", cpu, stage=stage)
+    job = _current_job.get()
+    if job is not None:
+        job.add_stage(stage, wall, cpu)
+
+
+def record_bytes(kind, n):
+    REGISTRY.inc("grading_bytes_total", n, kind=kind)
+    job = _current_job.get()
+    if job is not None:
+        job.add_bytes(kind, n)
+
+
+def record_image(width, height, nbytes):
+    REGISTRY.observe("grading_image_pixels", width * height, buckets=PIXEL_BUCKETS)
+    job = _current_job.get()
+    if job is not None:
+        job.add_image(width, height, nbytes)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """with timed("ocr_page"): ...  -> ghi wall + CPU time của khối lệnh"""
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - wall, time.thread_time() - cpu)
+
+
+@contextlib.contextmanager
+def attach(job):
+    """Ghi số liệu vào JobMetrics có sẵn (vd. mỗi học sinh trong batch đi qua nhiều luồng)"""
+    token = _current_job.set(job)
+    try:
+        yield job
+    finally:
+        _current_job.reset(token)
+
+
+def bind(fn):
+    """Cho luồng trong ThreadPoolExecutor ghi số liệu vào job hiện tại: executor.submit(bind(fn), ...)"""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def _dump_profile(profiler, job_id):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{job_id}.prof")
+    profiler.dump_stats(path)
+    sys.stderr.write(f"🔬 Profile written: {path}\n")
+
+
+_textfile_lock = threading.Lock()
+
+
+def write_textfile():
+    """Ghi toàn bộ metrics ra METRICS_TEXTFILE (ghi file tạm rồi replace)"""
+    if not METRICS_TEXTFILE:
+        return
+    tmp = f"{METRICS_TEXTFILE}.tmp"
+    # Cuối job và luồng định kỳ cùng ghi: dùng chung một file tạm
+    with _textfile_lock:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(REGISTRY.render())
+        os.replace(tmp, METRICS_TEXTFILE)
+
+
+def start_textfile_writer(interval=METRICS_TEXTFILE_INTERVAL):
+    """
+    Luồng nền ghi METRICS_TEXTFILE mỗi `interval` giây: đọc metrics không phải xếp hàng
+    sau job đang chạy (stage của job dở dang cũng hiện ra trước khi job xong).
+    RETURN: thread, hoặc None nếu không đặt METRICS_TEXTFILE
+    """
+    if not METRICS_TEXTFILE:
+        return None
+
+    def loop():
+        while True:
+            try:
+                write_textfile()
+            except OSError as e:
+                sys.stderr.write(f"⚠️ Could not write metrics textfile: {e}\n")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="metrics-textfile", daemon=True)
+    thread.start()
+    return thread
+
+
+@contextlib.contextmanager
+def job_metrics(job_id):
+    """Gom số liệu của một job; PROFILE_DIR có giá trị thì profile luôn cả job"""
+    job = JobMetrics()
+    token = _current_job.set(job)
+    profiler = None
+    if PROFILE_DIR:
+        sys.stderr.write(f"🔬 Profiling job {job_id} (pid {os.getpid()})\n")
+        profiler = cProfile.Profile()
+        profiler.enable()
+    status = "ok"
+    try:
+        yield job
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            try:
+                _dump_profile(profiler, job_id)
+            except OSError as e:
+                sys.stderr.write(f"⚠️ Could not write profile: {e}\n")
+        _current_job.reset(token)
+        REGISTRY.observe("grading_job_seconds", job.elapsed())
+        REGISTRY.inc("grading_jobs_total", status=status)
+        try:
+            write_textfile()
+        except OSError as e:
+            sys.stderr.write(f"⚠️ Could not write metrics textfile: {e}\n")
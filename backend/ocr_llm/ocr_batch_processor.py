@@ -1,12 +1,101 @@
 from concurrent.futures import ProcessPoolExecutor
-from ocr_processor import extract_text_from_image
+import numpy as np
+from ocr_processor import (
+    extract_text_from_image, extract_text_from_shared, extract_text_batched,
+    extract_text_batched_shared, init_ocr_worker,
+)
+from page_image import share_array
+from resource_planner import get_resource_plan
 
-def ocr_batch_parallel(image_paths, max_workers=4):
+def _share(img, shared):
+    if not isinstance(img, np.ndarray):
+        return img
+    shm, handle = share_array(img)
+    shared.append(shm)
+    return handle
 
-    if not isinstance(image_paths, list):
+
+def _submit_all(executor, images, shared, resize=True):
+    futures = []
+    for img in images:
+        if isinstance(img, np.ndarray):
+            shm, handle = share_array(img)
+            shared.append(shm)
+            futures.append(executor.submit(extract_text_from_shared, handle, resize))
+        else:
+            futures.append(executor.submit(extract_text_from_image, img, resize))
+    return [f.result() for f in futures]
+
+
+def _submit_batched(executor, images, shared, resize=True, chunks=1):
+    """
+    Chia images thành `chunks` nhóm liên tiếp, mỗi nhóm là MỘT task extract_text_batched:
+    dòng chữ của mọi ảnh trong nhóm được nhận dạng chung các lô lớn.
+    """
+    if not images:
+        return []
+    size = -(-len(images) // max(1, min(chunks, len(images))))
+    futures = [
+        executor.submit(
+            extract_text_batched_shared, [_share(img, shared) for img in images[start:start + size]], resize
+        )
+        for start in range(0, len(images), size)
+    ]
+    return [result for f in futures for result in f.result()]
+
+
+def create_ocr_executor(max_workers=4, warmup=False, batched=False, threads=None):
+    """
+    Pool OCR sống lâu (chế độ batch): mỗi process load PaddleOCR một lần trong initializer.
+    batched=True: load các module detection / recognition rời cho extract_text_batched
+    threads: số luồng CPU mỗi process, mặc định theo resource plan (ocr_threads)
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=init_ocr_worker,
+        initargs=(warmup, batched, threads or get_resource_plan().ocr_threads),
+    )
+
+
+def ocr_batch_parallel(images, max_workers=4, warmup=False, executor=None, resize=True, batched=False,
+                       chunks=1):
+    """
+    OCR nhiều ảnh song song.
+    images: list đường dẫn file hoặc list ảnh numpy (ảnh numpy được gửi qua shared memory)
+    executor: pool tạo bởi create_ocr_executor() để dùng chung giữa nhiều bài nộp
+    resize=False: ảnh đã scale sẵn (vùng cắt của OCR theo vùng)
+    batched=True: gom dòng chữ của nhiều ảnh vào các lô recognition chung (extract_text_batched);
+        chia thành max_workers nhóm, hoặc `chunks` nhóm khi dùng executor chung
+        (mặc định 1: song song giữa các bài nộp thay vì trong một bài)
+    """
+
+    if not isinstance(images, list):
         return []
 
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        results = list(executor.map(extract_text_from_image, image_paths))
+    # max_workers=0: chạy ngay trong process hiện tại, dùng lại engine OCR đã warm
+    if max_workers == 0:
+        if batched:
+            return extract_text_batched(images, resize)
+        return [extract_text_from_image(img, resize) for img in images]
+
+    # Mỗi worker process tạo PaddleOCR đúng 1 lần trong initializer,
+    # các trang sau dùng lại engine thay vì load model cho từng ảnh
+    shared = []
+    try:
+        if executor is not None:
+            if batched:
+                results = _submit_batched(executor, images, shared, resize, chunks)
+            else:
+                results = _submit_all(executor, images, shared, resize)
+        else:
+            with create_ocr_executor(max_workers, warmup, batched) as pool:
+                if batched:
+                    results = _submit_batched(pool, images, shared, resize, chunks=max_workers)
+                else:
+                    results = _submit_all(pool, images, shared, resize)
+    finally:
+        for shm in shared:
+            shm.close()
+            shm.unlink()
 
     return results
@@ -3,52 +3,163 @@ import os
 import logging
 import numpy as np
 import cv2
-from paddleocr import PaddleOCR
+from page_image import load_image, read_shared_array
+from stage_cache import config_version
+from metrics import timed
 # from backend.ocr_llm.encoding_fix import force_utf8
 # force_utf8()
 
 logging.getLogger("ppocr").setLevel(logging.ERROR)
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
 
-_ocr_model = None                            
+_ocr_model = None
+_text_modules = None
+# Số luồng CPU của Paddle trong process này (init_ocr_worker), None = mặc định của PaddleOCR
+_cpu_threads = None
 
-def extract_text_from_image(image_path):
+OCR_LANG = 'en'
+OCR_TARGET_WIDTH = 2000
+
+# Chế độ batched (PaddleOCR 3.x): detection từng ảnh, gom mọi dòng chữ của cả bài nộp
+# vào các lô recognition lớn. Bật theo job: options["ocr_batched"], hoặc OCR_BATCHED=1
+OCR_BATCHED = os.getenv("OCR_BATCHED", "0") == "1"
+OCR_DET_MODEL = os.getenv("OCR_DET_MODEL", "PP-OCRv5_server_det")
+OCR_REC_MODEL = os.getenv("OCR_REC_MODEL", "en_PP-OCRv5_mobile_rec")
+OCR_ORI_MODEL = os.getenv("OCR_ORI_MODEL", "PP-LCNet_x0_25_textline_ori")
+OCR_REC_BATCH_SIZE = int(os.getenv("OCR_REC_BATCH_SIZE", "32"))
+
+
+def ocr_cache_version(batched=False):
+    """Version cho stage_cache: gồm cấu hình OCR và phiên bản PaddleOCR"""
+    try:
+        from importlib.metadata import version
+        paddle_version = version("paddleocr")
+    except Exception:
+        paddle_version = "unknown"
+    base = config_version("ocr", OCR_LANG, True, OCR_TARGET_WIDTH, paddle_version)
+    if not batched:
+        return base
+    return config_version(base, "batched", OCR_DET_MODEL, OCR_REC_MODEL, OCR_ORI_MODEL)
+
+
+def _thread_kwargs():
+    # PaddleOCR mặc định mở 8-10 luồng / process bất kể số core -> truyền số luồng theo resource plan
+    return {} if _cpu_threads is None else {"cpu_threads": _cpu_threads}
+
+
+def get_ocr_model():
+    """Mỗi process chỉ khởi tạo PaddleOCR một lần rồi dùng lại."""
+    global _ocr_model
+    if _ocr_model is None:
+        # Import paddle khi thật sự cần OCR: process chỉ làm sạch ảnh không phải load paddle
+        from paddleocr import PaddleOCR
+        _ocr_model = PaddleOCR(use_angle_cls=True, lang=OCR_LANG, device='cpu', **_thread_kwargs())
+    return _ocr_model
+
+
+def get_text_modules():
+    """
+    Các module rời của PaddleOCR 3.x (detection, hướng dòng chữ, recognition) cho chế độ batched,
+    mỗi process load một lần. PaddleOCR 2.x không có các module này -> ImportError.
+    """
+    global _text_modules
+    if _text_modules is None:
+        from paddleocr import TextDetection, TextLineOrientationClassification, TextRecognition
+        kwargs = _thread_kwargs()
+        _text_modules = (
+            TextDetection(model_name=OCR_DET_MODEL, device='cpu', **kwargs),
+            TextLineOrientationClassification(model_name=OCR_ORI_MODEL, device='cpu', **kwargs),
+            TextRecognition(model_name=OCR_REC_MODEL, device='cpu', **kwargs),
+        )
+    return _text_modules
+
+
+def ocr_scale(width):
+    """Hệ số resize trước khi OCR: chỉ đưa về OCR_TARGET_WIDTH khi ảnh rộng < 500 hoặc > 2000px"""
+    if width < 500 or width > 2000:
+        return OCR_TARGET_WIDTH / width
+    return 1.0
+
+
+def scale_for_ocr(img_array):
+    """Resize (giữ tỉ lệ) về OCR_TARGET_WIDTH nếu chiều rộng không nằm trong khoảng tối ưu"""
+    height, width = img_array.shape[:2]
+    scale_ratio = ocr_scale(width)
+    if scale_ratio == 1.0:
+        return img_array
+    print(f"Resizing image from {width}px to {OCR_TARGET_WIDTH}px width...")
+    new_height = int(height * scale_ratio)
+    return cv2.resize(img_array, (OCR_TARGET_WIDTH, new_height), interpolation=cv2.INTER_CUBIC)
+
+
+def init_ocr_worker(warmup=False, batched=False, threads=None):
+    """
+    Initializer cho ProcessPoolExecutor: tạo engine OCR một lần cho mỗi worker process.
+    warmup=True: chạy thử 1 ảnh nhỏ để Paddle khởi tạo graph/bộ nhớ trước khi nhận trang thật.
+    batched=True: load các module rời (extract_text_batched) thay cho pipeline PaddleOCR
+    threads: số luồng CPU của process này (xem resource_planner), đặt TRƯỚC khi load Paddle
+    """
+    global _cpu_threads
+    if threads:
+        from resource_planner import apply_thread_limits
+        apply_thread_limits(threads)
+        _cpu_threads = threads
+    if batched:
+        try:
+            get_text_modules()
+        except Exception as e:
+            print(f"⚠️ Batched OCR unavailable ({e}), falling back to per-page OCR")
+            batched = False
+    ocr = None if batched else get_ocr_model()
+    if warmup:
+        try:
+            dummy = np.full((64, 256, 3), 255, dtype=np.uint8)
+            cv2.putText(dummy, "warm up", (10, 45), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+            if batched:
+                extract_text_batched([dummy])
+            else:
+                ocr.ocr(dummy)
+        except Exception as e:
+            print(f"⚠️ OCR warm-up failed: {e}")
+
+def extract_text_from_image(image, resize=True):
     """
     Hàm xử lý chính: Đọc ảnh -> OCR -> Trả về văn bản.
+    image: đường dẫn file hoặc ảnh numpy đã decode (BGR hoặc grayscale)
+    resize=False: ảnh đã được scale sẵn (vd. vùng cắt từ trang, xem ocr_regions)
     """
-    print(f"\n--- ⚙️ BẮT ĐẦU OCR: {os.path.basename(image_path) if image_path else 'Unknown'} ⚙️ ---")
+    is_array = isinstance(image, np.ndarray)
+    name = "in-memory image" if is_array else (os.path.basename(image) if image else 'Unknown')
+    print(f"\n--- ⚙️ BẮT ĐẦU OCR: {name} ⚙️ ---")
 
     # 2. Kiểm tra đường dẫn
-    if not image_path or not os.path.exists(image_path):
-        print(f"🛑 Error: Not Found image file at path'{image_path}'.")
+    if not is_array and (not image or not os.path.exists(image)):
+        print(f"🛑 Error: Not Found image file at path'{image}'.")
         return ""
 
     try:
         # Lấy model (đã load hoặc load mới)
-        # ocr = get_ocr_model()
-        from paddleocr import PaddleOCR
-        ocr = PaddleOCR(use_angle_cls=True, lang='en', device='cpu')
+        ocr = get_ocr_model()
 
-        img_array = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        img_array = load_image(image)
 
         if img_array is None:
             print("🛑 Error: OpenCV can not read image file (File error or corrupted).")
             return ""
-        
-        TARGET_WIDTH = 2000
-        height, width, _ = img_array.shape
+
+        # Ảnh sạch trong RAM là grayscale, PaddleOCR cần 3 kênh
+        if img_array.ndim == 2:
+            img_array = cv2.cvtColor(img_array, cv2.COLOR_GRAY2BGR)
         
         # Chỉ resize nếu chiều rộng không nằm trong khoảng tối ưu
-        if width < 500 or width > 2000:
-            print(f"Resizing image from {width}px to {TARGET_WIDTH}px width...")
-            scale_ratio = TARGET_WIDTH / width
-            new_height = int(height * scale_ratio)
-            img_array = cv2.resize(img_array, (TARGET_WIDTH, new_height), interpolation=cv2.INTER_CUBIC)
+        if resize:
+            img_array = scale_for_ocr(img_array)
 
         print(f"👁️ Scanning text in image...")
         
         # 4. Chạy OCR
-        result = ocr.ocr(img_array)
+        with timed("ocr_page"):
+            result = ocr.ocr(img_array)
 
         final_structure = []
         score_list = []
@@ -86,7 +197,10 @@ def extract_text_from_image(image_path):
             if texts and scores:
                 for t, s in zip(texts, scores):
                     print(f"Text: {t} | Reliability: {s:.2f}")
-                    final_structure.append(t)
+                    final_structure.append({
+                        'text': t,
+                        'score': s
+                    })
                     score_list.append(s)
             else:
                  print("⚠️ Dictionary data returned empty.")
@@ -97,7 +211,7 @@ def extract_text_from_image(image_path):
             accuracy_percentage = avg_confidence * 100
             
             print("-" * 30)
-            print(f"📊 REPORT FOR: {os.path.basename(image_path)}")
+            print(f"📊 REPORT FOR: {name}")
             print(f"   • Total lines detected: {len(score_list)}")
             print(f"   • Avg Confidence Score: {avg_confidence:.4f}")
             print(f"   • Estimated Accuracy:   {accuracy_percentage:.2f}%")
@@ -116,6 +230,112 @@ def extract_text_from_image(image_path):
         traceback.print_exc()
         return ""
     
+def extract_text_from_shared(handle, resize=True):
+    """Chạy trong process con: OCR ảnh được truyền qua shared memory"""
+    return extract_text_from_image(read_shared_array(handle), resize)
+
+
+def crop_text_line(img, poly):
+    """Cắt một dòng chữ theo tứ giác detection (nắn phẳng), dòng dựng đứng thì xoay ngang"""
+    pts = np.asarray(poly, dtype=np.float32).reshape(4, 2)
+    width = int(max(np.linalg.norm(pts[0] - pts[1]), np.linalg.norm(pts[2] - pts[3])))
+    height = int(max(np.linalg.norm(pts[0] - pts[3]), np.linalg.norm(pts[1] - pts[2])))
+    width, height = max(width, 1), max(height, 1)
+    dst = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    crop = cv2.warpPerspective(
+        img, cv2.getPerspectiveTransform(pts, dst), (width, height),
+        flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE,
+    )
+    if height / width >= 1.5:
+        crop = np.rot90(crop)
+    return crop
+
+
+def sort_reading_order(polys):
+    """Sắp các tứ giác theo thứ tự đọc: trên xuống, trái sang (cùng dòng nếu lệch y < 10px)"""
+    polys = sorted(polys, key=lambda p: (p[0][1], p[0][0]))
+    for i in range(len(polys) - 1):
+        for j in range(i, -1, -1):
+            if abs(polys[j + 1][0][1] - polys[j][0][1]) < 10 and polys[j + 1][0][0] < polys[j][0][0]:
+                polys[j], polys[j + 1] = polys[j + 1], polys[j]
+            else:
+                break
+    return polys
+
+
+def extract_text_batched(images, resize=True):
+    """
+    OCR nhiều ảnh (các trang của một bài nộp, hoặc các vùng cắt) với recognition theo lô:
+    detection từng ảnh -> gom mọi dòng chữ -> phân loại hướng + nhận dạng theo lô OCR_REC_BATCH_SIZE
+    -> trả dòng về đúng ảnh, đúng thứ tự đọc.
+    RETURN: list kết quả giống extract_text_from_image (list {text, score}, "" nếu ảnh lỗi)
+    """
+    print(f"\n--- ⚙️ BẮT ĐẦU OCR (batched): {len(images)} image(s) ⚙️ ---")
+    try:
+        det, ori, rec = get_text_modules()
+    except Exception as e:
+        print(f"⚠️ Batched OCR unavailable ({e}), falling back to per-page OCR")
+        return [extract_text_from_image(img, resize) for img in images]
+
+    try:
+        arrays = []
+        for image in images:
+            img_array = load_image(image)
+            if img_array is not None:
+                if img_array.ndim == 2:
+                    img_array = cv2.cvtColor(img_array, cv2.COLOR_GRAY2BGR)
+                if resize:
+                    img_array = scale_for_ocr(img_array)
+            arrays.append(img_array)
+
+        # 1. Detection từng ảnh, cắt các dòng chữ theo thứ tự đọc
+        crops, owners = [], []
+        with timed("ocr_det"):
+            for i, img_array in enumerate(arrays):
+                if img_array is None:
+                    continue
+                polys = det.predict(img_array, batch_size=1)[0]["dt_polys"]
+                for poly in sort_reading_order([np.asarray(p).tolist() for p in polys]):
+                    crops.append(crop_text_line(img_array, poly))
+                    owners.append(i)
+
+        results = [[] if img_array is not None else "" for img_array in arrays]
+        if not crops:
+            print("⚠️ Warning: No text detected.")
+            return results
+
+        # 2. Dòng bị lộn ngược (180°) thì xoay lại trước khi nhận dạng
+        with timed("ocr_rec"):
+            for i, res in enumerate(ori.predict(crops, batch_size=OCR_REC_BATCH_SIZE)):
+                if "180" in str(res["label_names"][0]):
+                    crops[i] = cv2.rotate(crops[i], cv2.ROTATE_180)
+            recognized = rec.predict(crops, batch_size=OCR_REC_BATCH_SIZE)
+
+        # 3. Trả từng dòng về ảnh của nó (kết quả predict của PaddleOCR 3.x là object kiểu dict)
+        for owner, res in zip(owners, recognized):
+            results[owner].append({
+                'text': res["rec_text"],
+                'score': float(res["rec_score"]),
+            })
+
+        batches = -(-len(crops) // OCR_REC_BATCH_SIZE)
+        print(f"✅ Batched OCR: {len(crops)} line(s) from {len(images)} image(s) in {batches} recognition batch(es)")
+        return results
+
+    except Exception as e:
+        print(f"❌ Exception error when running batched OCR: {e}")
+        import traceback
+        traceback.print_exc()
+        return ["" for _ in images]
+
+
+def extract_text_batched_shared(items, resize=True):
+    """Chạy trong process con: OCR batched các ảnh (handle shared memory hoặc đường dẫn file)"""
+    return extract_text_batched(
+        [read_shared_array(item) if isinstance(item, tuple) else item for item in items], resize
+    )
+
+
 def sanitize_text(text):
     """
     Loại bỏ ký tự rác, giữ lại ký tự toán học & chữ số.
@@ -0,0 +1,158 @@
+"""
+OCR theo vùng: bỏ vùng trắc nghiệm (MCQGrader đã chấm bằng YOLO) khỏi ảnh sạch,
+chỉ OCR các khối chữ tự luận còn lại dưới dạng ảnh cắt.
+
+  - bố cục trang (mcq_start_y, bbox circle / option A-D) lấy từ MCQGrader.page_layout, toạ độ ảnh RAW
+  - đổi sang toạ độ ảnh sạch bằng ma trận của bước làm sạch (resize + deskew),
+    xem img_preprocessing.compose_clean_transform
+  - vùng trắc nghiệm được tô trắng, phần còn lại tách thành các khối theo khoảng trắng dọc,
+    mỗi khối là một ảnh cắt (OCR song song trong pool như các trang)
+
+Bật theo job: options["ocr_mode"] = "regions" (hoặc OCR_MODE=regions cho cả process).
+Trang thiếu bố cục / ma trận (vd. ảnh sạch lấy từ cache cũ) hoặc OCR vùng lỗi -> OCR cả trang như trước.
+"""
+import os
+
+import cv2
+import numpy as np
+
+from ocr_processor import ocr_scale, scale_for_ocr
+from stage_cache import config_version
+
+OCR_MODES = ("full", "regions")
+OCR_MODE = os.getenv("OCR_MODE", "full")
+
+# Khoảng trắng dọc tối thiểu giữa hai khối chữ (tỉ lệ theo chiều cao trang)
+REGION_MIN_GAP = float(os.getenv("OCR_REGION_MIN_GAP", "0.015"))
+REGION_PAD = 16         # px lề trắng quanh mỗi khối (detector cần lề)
+REGION_MIN_INK = 3      # số px mực tối thiểu để một hàng được tính là có chữ
+REGION_MIN_HEIGHT = 8   # khối thấp hơn (px) coi là nhiễu
+
+
+def get_ocr_mode(name=None):
+    """RETURN: tên chế độ OCR. Tên không hợp lệ -> ValueError"""
+    name = name or OCR_MODE
+    if name not in OCR_MODES:
+        raise ValueError(f"Unknown OCR mode '{name}', expected one of {list(OCR_MODES)}")
+    return name
+
+
+def region_cache_version():
+    """Version cho stage_cache: đổi tham số tách khối -> kết quả OCR cũ không còn dùng"""
+    return config_version("regions", "anchored", REGION_MIN_GAP, REGION_PAD, REGION_MIN_INK, REGION_MIN_HEIGHT)
+
+
+def mcq_band(layout):
+    """
+    Dải trắc nghiệm theo toạ độ RAW (hết chiều ngang trang, gồm cả câu hỏi ghi cạnh các ô tròn).
+    Chỉ tin bố cục có ô tròn hoặc có 'objects' thật: không có cả hai thì mcq_start_y là fallback
+    (cau_hoi / 0), vài option A-D detect nhầm trên trang tự luận sẽ tô trắng mất chữ viết tay.
+    RETURN: [x1, y1, x2, y2] hoặc None nếu trang không có trắc nghiệm
+    """
+    if not layout["circles"] and not layout.get("anchored"):
+        return None
+    start_y = layout["mcq_start_y"]
+    grid = layout["circles"] + [
+        b for b in layout["options"] if (b[1] + b[3]) // 2 >= start_y
+    ]
+    if not grid:
+        return None
+    pad = int(np.median([b[3] - b[1] for b in grid]))
+    top = min(start_y, min(b[1] for b in grid)) - pad
+    bottom = max(b[3] for b in grid) + pad
+    return [0, max(0, top), layout["width"], min(layout["height"], bottom)]
+
+
+def map_polygon(box, transform):
+    """bbox trên ảnh RAW -> 4 đỉnh (int32) trên ảnh sạch theo ma trận affine 2x3"""
+    x1, y1, x2, y2 = box
+    corners = np.array([[x1, y1, 1], [x2, y1, 1], [x2, y2, 1], [x1, y2, 1]], dtype=np.float64)
+    return np.round(corners @ np.asarray(transform, dtype=np.float64).T).astype(np.int32)
+
+
+def text_blocks(gray):
+    """
+    Tách ảnh sạch (chữ đen nền trắng) thành các khối chữ theo khoảng trắng dọc.
+    RETURN: list bbox [x1, y1, x2, y2] trên ảnh, từ trên xuống
+    """
+    ink = gray < 128
+    rows = np.flatnonzero(np.count_nonzero(ink, axis=1) >= REGION_MIN_INK)
+    if rows.size == 0:
+        return []
+
+    min_gap = max(1, int(gray.shape[0] * REGION_MIN_GAP))
+    breaks = np.flatnonzero(np.diff(rows) > min_gap)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]])) + 1
+
+    blocks = []
+    for y1, y2 in zip(starts, ends):
+        if y2 - y1 < REGION_MIN_HEIGHT:
+            continue
+        cols = np.flatnonzero(ink[y1:y2].any(axis=0))
+        blocks.append([int(cols[0]), int(y1), int(cols[-1]) + 1, int(y2)])
+    return blocks
+
+
+def region_crops(cleaned, layout, transform):
+    """
+    Ảnh cắt các khối chữ ngoài vùng trắc nghiệm, đã scale giống như OCR cả trang.
+    RETURN: list ảnh grayscale theo thứ tự từ trên xuống
+    """
+    gray = cleaned if cleaned.ndim == 2 else cv2.cvtColor(cleaned, cv2.COLOR_BGR2GRAY)
+    band = mcq_band(layout)
+    if band is not None:
+        gray = gray.copy()
+        cv2.fillConvexPoly(gray, map_polygon(band, transform), 255)
+
+    scale = ocr_scale(gray.shape[1])
+    crops, pixels = [], 0
+    for x1, y1, x2, y2 in text_blocks(gray):
+        crop = cv2.copyMakeBorder(
+            gray[y1:y2, x1:x2], REGION_PAD, REGION_PAD, REGION_PAD, REGION_PAD,
+            cv2.BORDER_CONSTANT, value=255
+        )
+        if scale != 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        pixels += crop.shape[0] * crop.shape[1]
+        crops.append(crop)
+
+    page_pixels = gray.shape[0] * gray.shape[1] * scale * scale
+    print(f"✂️ OCR regions: {len(crops)} block(s), {pixels / page_pixels:.0%} of page pixels"
+          f"{' (MCQ area masked)' if band is not None else ''}")
+    return crops
+
+
+def ocr_by_regions(pages, ocr_fn):
+    """
+    OCR các trang theo vùng, ghép dòng của các khối lại theo trang.
+    pages: PageImage đã có .cleaned, .layout (MCQGrader.page_layout) và .clean_transform
+    ocr_fn(list ảnh): OCR song song các ảnh ĐÃ scale (resize=False), RETURN list kết quả theo thứ tự
+    RETURN: list kết quả OCR theo trang (list dict {text, score}), giống OCR cả trang
+    """
+    # Trang không tách vùng được thì đưa cả trang (đã scale) vào cùng lô với các ảnh cắt
+    jobs = []
+    for page in pages:
+        if page.layout is None or page.clean_transform is None:
+            jobs.append([scale_for_ocr(page.cleaned)])
+        else:
+            jobs.append(region_crops(page.cleaned, page.layout, page.clean_transform))
+
+    flat = [img for images in jobs for img in images]
+    flat_results = iter(ocr_fn(flat) if flat else [])
+
+    results, retry = [], []
+    for i, images in enumerate(jobs):
+        parts = [next(flat_results) for _ in images]
+        if all(isinstance(p, list) for p in parts):
+            results.append([line for p in parts for line in p])
+        else:
+            results.append(None)
+            retry.append(i)
+
+    # Có khối OCR lỗi: làm lại cả trang để không mất chữ của trang đó
+    if retry:
+        print(f"⚠️ Region OCR failed on {len(retry)} page(s), retrying full page")
+        for i, result in zip(retry, ocr_fn([scale_for_ocr(pages[i].cleaned) for i in retry])):
+            results[i] = result
+    return results
@@ -0,0 +1,95 @@
+"""
+Trang bài làm ở dạng ảnh đã decode trong RAM, đi xuyên suốt pipeline
+clean -> OCR -> MCQ -> LLM mà không phải ghi/đọc lại file trung gian.
+"""
+import hashlib
+import os
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+class PageImage:
+    def __init__(self, index, source, data: bytes):
+        self.index = index      # Thứ tự trang trong bài nộp
+        self.source = source    # URL / đường dẫn gốc (để log)
+        self.data = data        # Bytes ảnh gốc như đã tải về
+        self.raw = None         # Ảnh gốc BGR (cho MCQ Grader)
+        self.cleaned = None     # Ảnh sạch grayscale (cho OCR/LLM)
+        self.clean_transform = None     # Ma trận affine 2x3: toạ độ ảnh gốc -> ảnh sạch
+        self.layout = None      # Bố cục trắc nghiệm (MCQGrader.page_layout) cho OCR theo vùng
+        self._cleaned_jpeg = None
+        self._digest = None
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 của bytes ảnh gốc, dùng làm key cho stage_cache"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data or b"").hexdigest()
+        return self._digest
+
+    def decode(self):
+        """Decode bytes gốc một lần duy nhất. RETURN: ảnh BGR hoặc None nếu hỏng"""
+        if self.raw is None and self.data:
+            self.raw = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+        return self.raw
+
+    def cleaned_jpeg(self, quality=95) -> bytes:
+        """Encode ảnh sạch sang JPEG (chỉ khi cần upload), cache lại cho các lần sau"""
+        if self._cleaned_jpeg is None and self.cleaned is not None:
+            self._cleaned_jpeg = cv2.imencode(
+                ".jpg", self.cleaned, [cv2.IMWRITE_JPEG_QUALITY, quality]
+            )[1].tobytes()
+        return self._cleaned_jpeg
+
+
+def load_image(image, flags=cv2.IMREAD_COLOR):
+    """Stage nào cũng nhận được cả mảng numpy lẫn đường dẫn file"""
+    if isinstance(image, np.ndarray):
+        return image
+    if not image or not os.path.exists(image):
+        return None
+    # Sử dụng imdecode để đọc được đường dẫn tiếng Việt/Unicode trên Windows
+    return cv2.imdecode(np.fromfile(image, np.uint8), flags)
+
+
+# --- Shared memory: chuyển mảng ảnh sang process pool mà không pickle cả ảnh ---
+
+def share_array(arr: np.ndarray):
+    """
+    Copy mảng vào một vùng shared memory mới.
+    RETURN: (shm, handle) — người tạo giữ shm và phải unlink() khi xong.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def read_shared_array(handle) -> np.ndarray:
+    """Đọc (copy) mảng từ shared memory theo handle, không unlink"""
+    name, shape, dtype = handle
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+
+
+def export_shared_array(arr: np.ndarray):
+    """
+    Dùng trong process con để trả kết quả: ghi vào shared memory rồi đóng,
+    process cha đọc bằng take_shared_array() và unlink.
+    """
+    shm, handle = share_array(arr)
+    shm.close()
+    return handle
+
+
+def take_shared_array(handle) -> np.ndarray:
+    """Đọc mảng do process con trả về rồi giải phóng vùng shared memory"""
+    arr = read_shared_array(handle)
+    shm = shared_memory.SharedMemory(name=handle[0])
+    shm.close()
+    shm.unlink()
+    return arr
@@ -2,7 +2,11 @@
 # from encoding_fix import force_utf8
 # force_utf8()
 
-prompt_template = """
+# Prompt được chia làm 2 phần để phần đầu luôn giống hệt nhau cho cả lớp:
+# - instruction_template: vai trò + rubric + hướng dẫn chấm + định dạng JSON (cố định theo bài tập,
+#   có thể đăng ký làm cached content một lần cho mỗi bài tập)
+# - student_template: phần thay đổi theo từng học sinh (kết quả YOLO + OCR), gửi kèm ảnh
+instruction_template = """
 You are an AI teaching assistant for grading, extremely careful, fair, and format-compliant.
 Your task is to grade the student’s work based on ALL provided answers and grading rubric.
 
@@ -10,15 +14,12 @@ Your task is to grade the student’s work based on ALL provided answers and gra
 ANSWER KEY AND GRADING RUBRIC (PROVIDED BY TEACHER):
 {rubric}
 ---
-STUDENT’S WORK (EXAM IMAGE, YOLO DETECTION RESULTS, AND OCR TEXT, MAY CONTAIN ERRORS):
-{recognized_text}
----
 
 GRADING INSTRUCTIONS (FOLLOW THESE STEPS):
 1. *Analyze the Student’s Work:*
    Carefully read the STUDENT’S WORK. Analyze the attached IMAGES to understand the structure of the work, since OCR text may be inaccurate. Try to infer the student’s intent when OCR text differs significantly from the IMAGE.
    Identify the structure of the work: Which part is Multiple Choice, which part is Written Response.
-   The `recognized_text` above includes 2 parts:
+   The STUDENT’S WORK section (at the end, after these instructions) includes 2 parts:
      + Part 1: "--- KẾT QUẢ CHẤM TRẮC NGHIỆM (YOLO DETECTED) ---" -> These are the answers (A, B, C, D) detected by the system.
      + Part 2: "=== OCR RAW TEXT ===" -> This is the raw text scanned from the image (used for grading Written Response).
 
@@ -81,7 +82,16 @@ MANDATORY JSON structure:
     }}
   }}
 }}
+"""
+
+student_template = """
+---
+STUDENT’S WORK (EXAM IMAGE, YOLO DETECTION RESULTS, AND OCR TEXT, MAY CONTAIN ERRORS):
+{recognized_text}
 ---
 FINAL JSON RESULT (RETURN ONLY JSON):
 """
 
+# Prompt đầy đủ (giữ cho tương thích): prompt_template.format(rubric=..., recognized_text=...)
+prompt_template = instruction_template + student_template
+
@@ -0,0 +1,215 @@
+"""
+Chia CPU / RAM của máy (hoặc container) cho các stage của pipeline chấm bài.
+
+OpenCV, Paddle (OpenMP/MKL) và torch mặc định mỗi thư viện tự mở số luồng = số core
+của HOST trong MỖI process, nên N worker OCR trên container 4 CPU có thể chạy 10*N luồng
+(tranh nhau CPU), còn số worker cố định thì để thừa core trên máy lớn.
+
+Planner đọc:
+  - CPU: quota cgroup (v2 cpu.max / v1 cpu.cfs_quota_us) và CPU affinity của process
+  - RAM: giới hạn cgroup trừ phần đang dùng, hoặc MemAvailable của máy
+rồi chọn số process + số luồng mỗi process cho từng stage:
+  - "single": main_processor chấm một bài, các stage chạy lần lượt -> mỗi stage dùng hết CPU
+  - "worker": grading_worker, OCR chạy ngay trong process chính
+  - "batch":  batch_processor, các stage chạy chồng lên nhau -> chia CPU theo BATCH_CPU_SHARES
+
+Override bằng env: RESOURCE_CPUS, RESOURCE_MEMORY_MB (thay giá trị đọc được),
+CLEAN_WORKERS, CLEAN_THREADS, OCR_WORKERS, OCR_THREADS, MCQ_THREADS (thay giá trị tính ra).
+"""
+import os
+import sys
+
+RESOURCE_MODES = ("single", "worker", "batch")
+
+# RAM ước lượng (MB): process chính (YOLO + torch) và mỗi worker process
+MAIN_PROCESS_MEMORY_MB = int(os.getenv("MAIN_PROCESS_MEMORY_MB", "1200"))
+CLEAN_WORKER_MEMORY_MB = int(os.getenv("CLEAN_WORKER_MEMORY_MB", "300"))
+OCR_WORKER_MEMORY_MB = int(os.getenv("OCR_WORKER_MEMORY_MB", "1500"))
+# Paddle chạy 1 trang nhanh hơn hẳn khi có >= 2 luồng: ít worker nhiều luồng hơn là ngược lại
+OCR_MIN_THREADS = int(os.getenv("OCR_MIN_THREADS", "2"))
+# Chế độ batch: tỉ lệ CPU cho clean / mcq, phần còn lại cho OCR
+BATCH_CPU_SHARES = {"clean": 0.25, "mcq": 0.25}
+
+# Biến môi trường luồng của các thư viện BLAS / OpenMP (đọc khi thư viện load)
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS",
+)
+
+
+def _env_int(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def _read(path):
+    with open(path, "r") as f:
+        return f.read().strip()
+
+
+def cgroup_cpu_limit():
+    """Số CPU theo quota cgroup (vd. 1.5), None nếu không giới hạn / không phải Linux"""
+    try:
+        quota, period = _read("/sys/fs/cgroup/cpu.max").split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(_read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"))
+        period = int(_read("/sys/fs/cgroup/cpu/cpu.cfs_period_us"))
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus():
+    """Số core process được dùng: min(CPU affinity, quota cgroup), tối thiểu 1"""
+    override = _env_int("RESOURCE_CPUS")
+    if override:
+        return override
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Windows / macOS không có sched_getaffinity
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_limit()
+    if quota is not None:
+        cpus = min(cpus, quota)
+    return max(1, int(cpus))
+
+
+def available_memory_mb():
+    """RAM còn dùng được (MB): giới hạn cgroup - đang dùng, MemAvailable của máy; None nếu không đọc được"""
+    override = _env_int("RESOURCE_MEMORY_MB")
+    if override:
+        return override
+    candidates = []
+    for limit_path, usage_path in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes"),
+    ):
+        try:
+            limit = _read(limit_path)
+            if limit != "max":
+                candidates.append((int(limit) - int(_read(usage_path))) // (1024 * 1024))
+            break
+        except (OSError, ValueError):
+            continue
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    candidates.append(int(line.split()[1]) // 1024)
+                    break
+    except (OSError, ValueError):
+        pass
+    # cgroup v1 không giới hạn trả về số rất lớn -> lấy min với RAM thật của máy
+    return max(0, min(candidates)) if candidates else None
+
+
+class ResourcePlan:
+    """Số process / số luồng mỗi process cho từng stage"""
+
+    def __init__(self, mode, cpus, memory_mb, clean_workers, clean_threads,
+                 ocr_workers, ocr_threads, mcq_threads):
+        self.mode = mode
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.clean_workers = clean_workers
+        self.clean_threads = clean_threads
+        # ocr_workers=0: OCR chạy trong process chính (worker mode)
+        self.ocr_workers = ocr_workers
+        self.ocr_threads = ocr_threads
+        # Luồng của process chính: YOLO (torch) + OpenCV chạy trực tiếp
+        self.mcq_threads = mcq_threads
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def describe(self):
+        memory = f"{self.memory_mb} MB" if self.memory_mb is not None else "unknown"
+        return (f"{self.mode}: {self.cpus} CPU, RAM {memory} | "
+                f"clean {self.clean_workers}x{self.clean_threads}t, "
+                f"ocr {self.ocr_workers}x{self.ocr_threads}t, mcq {self.mcq_threads}t")
+
+
+def plan_resources(mode="single", cpus=None, memory_mb=None):
+    """
+    Tính ResourcePlan cho một process chấm bài.
+    cpus / memory_mb: bỏ trống -> đọc từ cgroup / hệ thống
+    """
+    if mode not in RESOURCE_MODES:
+        raise ValueError(f"Unknown resource mode '{mode}', expected one of {list(RESOURCE_MODES)}")
+    cpus = cpus or available_cpus()
+    if memory_mb is None:
+        memory_mb = available_memory_mb()
+
+    if mode == "batch":
+        clean_cpus = max(1, round(cpus * BATCH_CPU_SHARES["clean"]))
+        mcq_cpus = max(1, round(cpus * BATCH_CPU_SHARES["mcq"]))
+        ocr_cpus = max(1, cpus - clean_cpus - mcq_cpus)
+    else:
+        # Các stage chạy lần lượt: stage nào đang chạy thì dùng hết CPU
+        clean_cpus = mcq_cpus = ocr_cpus = cpus
+
+    ocr_workers = 0 if mode == "worker" else max(1, ocr_cpus // OCR_MIN_THREADS)
+    clean_workers = clean_cpus
+
+    # Giới hạn số process theo RAM (luôn giữ ít nhất 1 worker mỗi stage)
+    if memory_mb is not None:
+        budget = memory_mb - MAIN_PROCESS_MEMORY_MB
+        if ocr_workers:
+            ocr_workers = max(1, min(ocr_workers, budget // OCR_WORKER_MEMORY_MB))
+            budget -= ocr_workers * OCR_WORKER_MEMORY_MB
+        else:
+            # PaddleOCR load ngay trong process chính
+            budget -= OCR_WORKER_MEMORY_MB
+        clean_workers = max(1, min(clean_workers, budget // CLEAN_WORKER_MEMORY_MB))
+
+    if _env_int("OCR_WORKERS") is not None:
+        ocr_workers = _env_int("OCR_WORKERS")
+    clean_workers = _env_int("CLEAN_WORKERS") or clean_workers
+    return ResourcePlan(
+        mode, cpus, memory_mb,
+        clean_workers=clean_workers,
+        clean_threads=_env_int("CLEAN_THREADS") or max(1, clean_cpus // clean_workers),
+        ocr_workers=ocr_workers,
+        ocr_threads=_env_int("OCR_THREADS") or max(1, ocr_cpus // max(1, ocr_workers)),
+        mcq_threads=_env_int("MCQ_THREADS") or mcq_cpus,
+    )
+
+
+def apply_thread_limits(threads):
+    """
+    Giới hạn số luồng của OpenCV, OpenMP/MKL và torch trong process hiện tại.
+    Dùng làm initializer của worker process; biến môi trường chỉ có tác dụng với
+    thư viện load SAU lời gọi này (Paddle được import lazy trong worker nên vẫn kịp).
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    import cv2
+    cv2.setNumThreads(threads)
+    # torch đã load (YOLO trong process chính) thì đổi trực tiếp, không tự import torch
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+_plan = None
+
+
+def configure_resources(mode="single"):
+    """Tính plan cho process này (gọi một lần ở entry point) và áp giới hạn luồng cho process chính"""
+    global _plan
+    _plan = plan_resources(mode)
+    apply_thread_limits(_plan.mcq_threads)
+    sys.stderr.write(f"🧮 Resource plan {_plan.describe()}\n")
+    return _plan
+
+
+def get_resource_plan():
+    """Plan hiện tại; chưa configure -> tính theo chế độ "single" """
+    if _plan is None:
+        configure_resources()
+    return _plan
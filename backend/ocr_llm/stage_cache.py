@@ -0,0 +1,186 @@
+"""
+Cache trên đĩa theo nội dung cho các stage của pipeline (ảnh sạch, kết quả OCR, kết quả MCQ).
+
+Key = SHA-256 của bytes ảnh gốc + tên stage + "config version" của stage đó
+(tham số tiền xử lý, ngôn ngữ OCR, hash trọng số YOLO, ngưỡng conf...).
+Đổi cấu hình -> version khác -> tự động không dùng lại kết quả cũ.
+Dung lượng bị giới hạn, vượt ngưỡng thì xoá các mục ít được dùng gần đây nhất (LRU theo mtime).
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+import cv2
+import numpy as np
+
+CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join("uploads", "cache"))
+CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+CACHE_ENABLED = os.getenv("OCR_CACHE", "1") != "0"
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def config_version(*parts) -> str:
+    """Hash ngắn của cấu hình một stage (mọi thứ có thể làm đổi kết quả)"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class StageCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._size = None
+
+    # ---------- đường dẫn & thống kê ----------
+    def _path(self, stage, content_hash, version, ext):
+        return os.path.join(self.root, stage, content_hash[:2], f"{content_hash}-{version}{ext}")
+
+    def _count(self, stage, hit):
+        with self._lock:
+            s = self._stats.setdefault(stage, {"hits": 0, "misses": 0})
+            s["hits" if hit else "misses"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {stage: dict(v) for stage, v in self._stats.items()}
+
+    # ---------- đọc / ghi ----------
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        # Cập nhật mtime để LRU biết mục này vừa được dùng
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, path, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Ghi file tạm rồi os.replace để process khác không đọc phải file ghi dở
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._add_size(len(data))
+
+    def get_json(self, stage, content_hash, version):
+        data = self._read(self._path(stage, content_hash, version, ".json"))
+        value = json.loads(data.decode("utf-8")) if data is not None else None
+        self._count(stage, value is not None)
+        return value
+
+    def set_json(self, stage, content_hash, version, value):
+        # numpy scalar (vd. điểm tin cậy float32 của Paddle) -> số Python
+        data = json.dumps(
+            value, ensure_ascii=False,
+            default=lambda o: o.item() if hasattr(o, "item") else str(o)
+        ).encode("utf-8")
+        self._write(self._path(stage, content_hash, version, ".json"), data)
+
+    def get_image(self, stage, content_hash, version):
+        data = self._read(self._path(stage, content_hash, version, ".png"))
+        img = None
+        if data is not None:
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+        self._count(stage, img is not None)
+        return img
+
+    def set_image(self, stage, content_hash, version, img):
+        # PNG: không mất dữ liệu, ảnh đã nhị phân hoá nên nén rất tốt
+        ok, buf = cv2.imencode(".png", img)
+        if ok:
+            self._write(self._path(stage, content_hash, version, ".png"), buf.tobytes())
+
+    # ---------- giới hạn dung lượng (LRU) ----------
+    def _entries(self):
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def _add_size(self, n):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += n
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Xoá các mục cũ nhất (theo lần dùng gần nhất) cho tới khi còn ~90% giới hạn"""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._size = total
+
+
+_cache = None
+
+
+def get_stage_cache():
+    global _cache
+    if _cache is None:
+        _cache = StageCache()
+    return _cache
+
+
+def run_cached(cache, stage, version, keys, items, compute, kind="json", store_if=None):
+    """
+    Lấy kết quả từng item từ cache; chỉ gọi compute(list_items_bị_miss) cho phần còn thiếu.
+    cache=None: luôn compute (tắt cache).
+    kind: "json" hoặc "image"; store_if(value) quyết định có lưu kết quả hay không.
+    RETURN: list kết quả theo đúng thứ tự items
+    """
+    if cache is None:
+        return compute(items)
+
+    store_if = store_if or (lambda v: v is not None)
+    getter = cache.get_image if kind == "image" else cache.get_json
+    setter = cache.set_image if kind == "image" else cache.set_json
+
+    results = [getter(stage, key, version) for key in keys]
+    missing = [i for i, value in enumerate(results) if value is None]
+    if missing:
+        computed = compute([items[i] for i in missing])
+        for i, value in zip(missing, computed):
+            results[i] = value
+            if store_if(value):
+                try:
+                    setter(stage, keys[i], version, value)
+                except Exception as e:
+                    print(f"⚠️ Cache write failed ({stage}): {e}")
+    return results
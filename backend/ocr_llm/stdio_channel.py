@@ -0,0 +1,45 @@
+"""
+Kênh giao thức JSON-lines qua stdout cho các process chạy lâu (grading_worker, batch_processor).
+Phải gọi open_protocol_channel() TRƯỚC khi import PaddleOCR / YOLO / Gemini.
+"""
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+
+def open_protocol_channel():
+    """
+    Tách fd 1 thành kênh giao thức riêng, rồi trỏ fd 1 sang stderr
+    để print của thư viện (và process con) không làm hỏng JSON.
+    """
+    protocol_fd = os.dup(1)
+    os.dup2(2, 1)
+    channel = io.open(protocol_fd, "w", encoding="utf-8", buffering=1)
+    sys.stdout = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8", line_buffering=True)
+    sys.stderr = sys.stdout
+    return channel
+
+
+class EventStream:
+    """
+    Ghi event NDJSON (mỗi dòng một JSON) lên kênh giao thức.
+    Mỗi event có "t_ms": số ms kể từ lúc tạo stream (bắt đầu job).
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        message = {"event": event, "t_ms": round((time.perf_counter() - self.started) * 1000, 1), **fields}
+        line = json.dumps(
+            message, ensure_ascii=False,
+            default=lambda o: o.item() if hasattr(o, "item") else str(o)
+        )
+        with self._lock:
+            self.channel.write(line + "\n")
+            self.channel.flush()
@@ -0,0 +1,235 @@
+"""
+Backend ONNX Runtime (CPU) cho 2 model YOLO của MCQGrader, thay cho ultralytics + torch.
+
+  - export: YOLO(.pt).export(format="onnx", dynamic=True) -> <tên>.onnx cạnh file .pt,
+    tuỳ chọn quantize int8 (static, calibration trên ảnh bài thi) -> <tên>_int8.onnx
+  - chạy: letterbox kiểu "rect" + decode + NMS theo class (IoU 0.7, max_det 300) giống
+    ultralytics predict, trả kết quả có .boxes.data [x1, y1, x2, y2, conf, cls] theo toạ độ ảnh gốc
+    nên MCQGrader._parse_detections dùng chung cho cả 2 backend
+
+Bật: MCQ_BACKEND=onnx (MCQ_ONNX_INT8=1: dùng bản int8). Process chấm bài khi đó không load torch.
+
+Export (từ thư mục backend, cần ultralytics; --int8 cần thêm onnxruntime):
+  python ocr_llm/yolo_onnx.py
+  python ocr_llm/yolo_onnx.py --int8
+So khớp đáp án + độ trễ với backend torch: ocr_llm/benchmarks/mcq_onnx_parity.py
+"""
+import argparse
+import glob
+import os
+
+import cv2
+import numpy as np
+
+# Giống giá trị mặc định của ultralytics predict
+ONNX_IOU = 0.7
+ONNX_MAX_DET = 300
+NMS_MAX_WH = 7680       # offset toạ độ theo class để NMS từng class trong một lần
+LETTERBOX_COLOR = (114, 114, 114)
+
+CALIB_GLOB = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "uploads", "Bai_thi_Toan_4a2*", "**", "*.jpg"
+)
+
+
+def onnx_path(pt_path, int8=False):
+    """ABCD_start.pt -> ABCD_start.onnx (hoặc ABCD_start_int8.onnx)"""
+    stem = os.path.splitext(pt_path)[0]
+    return f"{stem}_int8.onnx" if int8 else f"{stem}.onnx"
+
+
+# ---------------- tiền xử lý / hậu xử lý (giống ultralytics) ----------------
+
+def letterbox(img, imgsz, stride=32):
+    """
+    Resize giữ tỉ lệ cho cạnh dài = imgsz, pad tối thiểu cho mỗi cạnh chia hết cho stride
+    (LetterBox(auto=True) của ultralytics, áp dụng khi cả lô cùng kích thước).
+    """
+    h, w = img.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    dw, dh = (imgsz - new_w) % stride / 2, (imgsz - new_h) % stride / 2
+    if (w, h) != (new_w, new_h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    return cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+
+
+def to_blob(images):
+    """list ảnh BGR cùng kích thước -> tensor float32 NCHW RGB [0, 1]"""
+    batch = np.stack(images)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+def nms(boxes, scores, iou_thres):
+    """NMS tham lam (như torchvision.ops.nms). RETURN: chỉ số box giữ lại, theo score giảm dần"""
+    order = np.argsort(-scores, kind="stable")
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        h = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_thres]
+    return np.array(keep, dtype=np.int64)
+
+
+def decode(pred, conf, iou_thres=ONNX_IOU, max_det=ONNX_MAX_DET):
+    """
+    Đầu ra YOLOv8+ của một ảnh (4 + số class, số anchor): xywh + điểm từng class.
+    RETURN: ndarray (N, 6) [x1, y1, x2, y2, conf, cls] trên ảnh letterbox, conf giảm dần
+    """
+    pred = pred.T
+    scores = pred[:, 4:]
+    cls = scores.argmax(1)
+    best = scores[np.arange(len(cls)), cls]
+    mask = best > conf
+    if not mask.any():
+        return np.zeros((0, 6), dtype=np.float32)
+
+    xywh, best, cls = pred[mask, :4], best[mask], cls[mask]
+    boxes = np.empty_like(xywh)
+    boxes[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+    boxes[:, 2:] = xywh[:, :2] + xywh[:, 2:] / 2
+
+    keep = nms(boxes + cls[:, None] * NMS_MAX_WH, best, iou_thres)[:max_det]
+    return np.concatenate(
+        [boxes[keep], best[keep, None], cls[keep, None].astype(np.float32)], axis=1
+    ).astype(np.float32)
+
+
+def scale_boxes(letterbox_shape, det, image_shape):
+    """Toạ độ box trên ảnh letterbox -> ảnh gốc (scale_boxes + clip của ultralytics)"""
+    gain = min(letterbox_shape[0] / image_shape[0], letterbox_shape[1] / image_shape[1])
+    pad_x = round((letterbox_shape[1] - image_shape[1] * gain) / 2 - 0.1)
+    pad_y = round((letterbox_shape[0] - image_shape[0] * gain) / 2 - 0.1)
+    det = det.copy()
+    det[:, [0, 2]] = ((det[:, [0, 2]] - pad_x) / gain).clip(0, image_shape[1])
+    det[:, [1, 3]] = ((det[:, [1, 3]] - pad_y) / gain).clip(0, image_shape[0])
+    return det
+
+
+# ---------------- runtime ----------------
+
+class OnnxBoxes:
+    def __init__(self, data):
+        self.data = data
+
+
+class OnnxResult:
+    """Phần kết quả MCQGrader dùng: .boxes.data giống ultralytics Results"""
+
+    def __init__(self, data):
+        self.boxes = OnnxBoxes(data)
+
+
+class OnnxYOLO:
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        # ultralytics ghi stride / imgsz vào metadata của file ONNX
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.stride = int(meta.get("stride", 32))
+
+    def predict(self, images, imgsz, conf, iou=ONNX_IOU, max_det=ONNX_MAX_DET, **kwargs):
+        """Cùng ý nghĩa với YOLO.predict (các tham số khác như batch / verbose được bỏ qua)"""
+        shapes = {img.shape for img in images}
+        if len(shapes) > 1:
+            # Lô khác kích thước: letterbox mỗi ảnh một kiểu -> chạy từng ảnh
+            return [r for img in images for r in self.predict([img], imgsz, conf, iou, max_det)]
+
+        boxed = [letterbox(img, imgsz, self.stride) for img in images]
+        output = self.session.run(None, {self.input_name: to_blob(boxed)})[0]
+        return [
+            OnnxResult(scale_boxes(boxed[0].shape, decode(pred, conf, iou, max_det), img.shape))
+            for img, pred in zip(images, output)
+        ]
+
+
+# ---------------- export ----------------
+
+class _CalibrationReader:
+    """Ảnh bài thi thật (đã letterbox) làm dữ liệu calibration cho quantize_static"""
+
+    def __init__(self, input_name, paths, imgsz):
+        self.input_name = input_name
+        self.paths = iter(paths)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        from page_image import load_image
+
+        for path in self.paths:
+            img = load_image(path)
+            if img is not None:
+                return {self.input_name: to_blob([letterbox(img, self.imgsz)])}
+        return None
+
+
+def quantize_int8(src, dst, calib_paths, imgsz):
+    """
+    Quantize static int8 (QDQ, weight per-channel) với calibration trên calib_paths.
+    Chỉ quantize Conv: đầu ra của head gộp toạ độ box (px) và điểm class (0-1) trong một tensor,
+    quantize cả tensor đó thì điểm class bị làm tròn về 0; conv DFL (giải mã box) giữ float.
+    """
+    import onnx
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    input_name = ort.InferenceSession(src, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    exclude = [node.name for node in onnx.load(src).graph.node if "/dfl/" in node.name]
+    quantize_static(
+        src, dst, _CalibrationReader(input_name, calib_paths, imgsz),
+        quant_format=QuantFormat.QDQ, per_channel=True,
+        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        op_types_to_quantize=["Conv"], nodes_to_exclude=exclude,
+    )
+    return dst
+
+
+def export_onnx(pt_path, imgsz, int8=False, calib_paths=()):
+    """Export một model .pt -> .onnx (shape động), int8=True: thêm bản _int8.onnx. RETURN: path dùng để chạy"""
+    from ultralytics import YOLO
+
+    exported = YOLO(pt_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    path = onnx_path(pt_path)
+    if os.path.abspath(exported) != os.path.abspath(path):
+        os.replace(exported, path)
+    print(f"✅ Exported {os.path.basename(pt_path)} -> {path}")
+    if not int8:
+        return path
+    if not calib_paths:
+        raise ValueError("int8 quantization needs calibration images")
+    quantized = quantize_int8(path, onnx_path(pt_path, int8=True), calib_paths, imgsz)
+    print(f"✅ Quantized int8 -> {quantized} ({len(calib_paths)} calibration image(s))")
+    return quantized
+
+
+def main():
+    from mcq_grader import IMG_SIZE, MODEL_ABCD_PATH, MODEL_STRUCT_PATH
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--int8", action="store_true", help="Quantize thêm bản int8")
+    parser.add_argument("--calib", default=CALIB_GLOB, help="Glob ảnh calibration cho int8")
+    parser.add_argument("--calib-limit", type=int, default=32)
+    args = parser.parse_args()
+
+    calib_paths = sorted(p for p in glob.glob(args.calib, recursive=True) if not p.endswith("_debug.jpg"))
+    for pt_path in (MODEL_ABCD_PATH, MODEL_STRUCT_PATH):
+        export_onnx(pt_path, IMG_SIZE, args.int8, calib_paths[:args.calib_limit])
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,9 @@ import userRoutes from './routes/userRoute.js'
 import classroomRoutes from './routes/classroomRoute.js'
 import assignmentRoutes from './routes/assignmentRoute.js'
 import submissionRoutes from './routes/submissionRoute.js'
+import { getWorkerMetrics } from './utils/gradingWorker.js'
+import authMiddleware from './middleware/auth.js'
+import authorizeRoles from './middleware/role.js'
 
 connectDB()
 
@@ -80,6 +83,13 @@ app.get('/healthz', (req, res) => {
   res.status(200).send('OK')
 })
 
+/* =======================
+   METRICS CỦA WORKER CHẤM BÀI (Prometheus text format, AI_GRADING_WORKER=true)
+======================= */
+app.get('/metrics/grading', authMiddleware, authorizeRoles('teacher'), async (req, res) => {
+  res.type('text/plain; version=0.0.4').send(await getWorkerMetrics())
+})
+
 app.get('/', (req, res) => {
   res.send('EduMark Backend is running')
 })
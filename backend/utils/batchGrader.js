@@ -0,0 +1,73 @@
+import { spawn } from "child_process";
+import fs from "fs";
+import path from "path";
+import readline from "readline";
+
+// Chấm cả lớp bằng một process Python (ocr_llm/batch_processor.py) thay vì spawn từng bài.
+// Manifest gửi qua stdin, kết quả từng học sinh trả về dạng JSON-lines ngay khi chấm xong.
+const BATCH_TIMEOUT_MS = 3600000; // 1 giờ cho cả lớp
+
+/**
+ * @param {{id: string, files: string[]}[]} items - Mỗi phần tử là một bài nộp (id + ảnh).
+ * @param {string} answerKey - Đáp án chung của bài tập.
+ * @param {(id: string, result: object) => Promise<void>|void} onResult - Gọi mỗi khi một bài chấm xong.
+ * @returns {Promise<{total: number, failed: number, seconds: number}|null>} - Thống kê cuối batch.
+ */
+export const gradeClassBatch = (items, answerKey, onResult) => {
+  return new Promise((resolve) => {
+    const pythonScript = path.join(process.cwd(), "ocr_llm", "batch_processor.py");
+    const proc = spawn("python", [pythonScript, "-"], {
+      stdio: ["pipe", "pipe", "pipe"],
+      env: {
+        ...process.env,
+        PYTHONIOENCODING: "utf-8",
+        PYTHONLEGACYWINDOWSSTDIO: "utf-8",
+      },
+    });
+
+    let summary = null;
+    const pendingWrites = [];
+
+    const timeout = setTimeout(() => {
+      console.error("[Batch grading] Timeout, killing...");
+      try { proc.kill("SIGKILL"); } catch (e) { /* ignore */ }
+    }, BATCH_TIMEOUT_MS);
+
+    readline.createInterface({ input: proc.stdout }).on("line", (line) => {
+      let msg;
+      try {
+        msg = JSON.parse(line);
+      } catch (e) {
+        console.error("[Batch grading] Dòng stdout không phải JSON:", line);
+        return;
+      }
+
+      if (msg.studentId === null) {
+        summary = msg.result;
+        return;
+      }
+      pendingWrites.push(
+        Promise.resolve(onResult(msg.studentId, msg.ok ? msg.result : {})).catch((err) =>
+          console.error(`[Batch grading] Lỗi lưu kết quả ${msg.studentId}:`, err)
+        )
+      );
+    });
+
+    proc.stderr.on("data", (chunk) => {
+      console.error(`[Python stderr] ${chunk.toString()}`);
+    });
+
+    proc.on("close", async (code) => {
+      clearTimeout(timeout);
+      await Promise.all(pendingWrites);
+      console.log(`[Batch grading] Finished with code: ${code}`, summary);
+      resolve(summary);
+    });
+
+    const manifest = {
+      rubric: answerKey || "",
+      students: items.map((item) => ({ id: String(item.id), pages: item.files })),
+    };
+    proc.stdin.end(JSON.stringify(manifest));
+  });
+};
@@ -0,0 +1,123 @@
+import { spawn } from "child_process";
+import fs from "fs";
+import os from "os";
+import path from "path";
+import readline from "readline";
+
+// Worker Python chạy lâu dài (ocr_llm/grading_worker.py), giữ model OCR/YOLO/Gemini luôn warm.
+// Giao tiếp bằng JSON-lines qua stdin/stdout, mỗi job có id riêng.
+// Worker xử lý lần lượt từng job nên Node giữ hàng đợi FIFO và chỉ gửi job tiếp theo
+// khi job trước đã có kết quả: timeout tính từ lúc job thực sự được worker nhận.
+const JOB_TIMEOUT_MS = 600000; // 10 phút, giống executePythonScript
+// Worker ghi metrics ra file này định kỳ (metrics.py), đọc metrics không đi qua hàng đợi job
+const METRICS_TEXTFILE =
+  process.env.METRICS_TEXTFILE || path.join(os.tmpdir(), `edumark-grading-${process.pid}.prom`);
+
+let worker = null;
+let nextJobId = 1;
+const queue = [];
+let running = null; // job worker đang chạy: { id, line, resolve, fallback, timeout }
+
+const finishRunning = (value) => {
+  const job = running;
+  running = null;
+  clearTimeout(job.timeout);
+  job.resolve(value);
+};
+
+const dispatchNext = () => {
+  if (running || queue.length === 0) return;
+  if (!worker) worker = startWorker();
+
+  const job = queue.shift();
+  running = job;
+  job.timeout = setTimeout(() => {
+    if (running !== job) return;
+    console.error(`[Grading worker] Job ${job.id} timeout, restarting worker...`);
+    finishRunning(job.fallback);
+    // Job treo thì giết worker; job còn trong hàng đợi chạy tiếp trên worker mới
+    const stuck = worker;
+    worker = null;
+    try { stuck?.kill("SIGKILL"); } catch (e) { /* ignore */ }
+    dispatchNext();
+  }, JOB_TIMEOUT_MS);
+  worker.stdin.write(job.line);
+};
+
+const startWorker = () => {
+  const pythonScript = path.join(process.cwd(), "ocr_llm", "grading_worker.py");
+  const proc = spawn("python", [pythonScript], {
+    stdio: ["pipe", "pipe", "pipe"],
+    env: {
+      ...process.env,
+      PYTHONIOENCODING: "utf-8",
+      PYTHONLEGACYWINDOWSSTDIO: "utf-8",
+      METRICS_TEXTFILE,
+    },
+  });
+
+  readline.createInterface({ input: proc.stdout }).on("line", (line) => {
+    let msg;
+    try {
+      msg = JSON.parse(line);
+    } catch (e) {
+      console.error("[Grading worker] Dòng stdout không phải JSON:", line);
+      return;
+    }
+
+    if (msg.id === null) {
+      console.log("[Grading worker] Ready.");
+      return;
+    }
+
+    if (!running || running.id !== msg.id) return;
+    finishRunning(msg.result ?? running.fallback);
+    dispatchNext();
+  });
+
+  proc.stderr.on("data", (chunk) => {
+    console.error(`[Python stderr] ${chunk.toString()}`);
+  });
+
+  proc.on("close", (code) => {
+    if (worker !== proc) return;
+    worker = null;
+    console.error(`[Grading worker] Worker exited with code: ${code}`);
+    // Chỉ job đang chạy bị mất; job trong hàng đợi chưa gửi nên chạy tiếp trên worker mới
+    if (running) finishRunning(running.fallback);
+    dispatchNext();
+  });
+
+  return proc;
+};
+
+const sendToWorker = (payload, fallback) =>
+  new Promise((resolve) => {
+    const id = String(nextJobId++);
+    queue.push({ id, line: JSON.stringify({ id, ...payload }) + "\n", resolve, fallback, timeout: null });
+    dispatchNext();
+  });
+
+/**
+ * Gửi một bài nộp cho worker đang chạy (tự khởi động nếu chưa có).
+ * @param {string[]} fileUrls - Mảng các đường dẫn tệp.
+ * @param {string} answerKey - Đáp án.
+ * @returns {Promise<object>} - Cùng schema với kết quả của main_processor.py.
+ */
+export const gradeWithWorker = (fileUrls, answerKey) =>
+  sendToWorker({ urls: fileUrls, rubric: answerKey || "" }, {});
+
+/**
+ * Metrics (Prometheus text format) của worker: thời gian từng stage, bytes, số job.
+ * Đọc từ METRICS_TEXTFILE nên không phải chờ job đang chạy.
+ * @returns {Promise<string>} - Chuỗi rỗng nếu worker chưa chạy.
+ */
+export const getWorkerMetrics = async () => {
+  if (!worker) return "";
+  try {
+    return await fs.promises.readFile(METRICS_TEXTFILE, "utf-8");
+  } catch (e) {
+    // Worker vừa khởi động, chưa ghi file lần nào
+    return "";
+  }
+};